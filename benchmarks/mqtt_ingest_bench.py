@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingest benchmark for subscriber/subscriber.py.
+
+Publishes synthetic readings to lake/raw/int and lake/raw/float at a fixed
+rate, then polls lake_raw_data_int/lake_raw_data_float until every message
+shows up (or a drain timeout expires). Each payload carries the run id, a
+sequence number and the publish time, so publish-to-row latency is measured
+on this machine's clock alone.
+
+Requires a running broker (e.g. `mosquitto -c mosquitto/mosquitto.conf`),
+the subscriber, and the lake tables created by init_db.py.
+
+Example:
+    python benchmarks/mqtt_ingest_bench.py --rate 500 --duration 30 --int-ratio 0.5 \
+        --payload-bytes 256 --output bench_results.jsonl
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import paho.mqtt.client as mqtt
+import psycopg2
+
+TOPIC_INT = "lake/raw/int"
+TOPIC_FLOAT = "lake/raw/float"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MQTT -> PostgreSQL ingest benchmark")
+    parser.add_argument("--broker", default=os.environ.get("MQTT_BROKER", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MQTT_PORT", "1883")))
+    parser.add_argument("--rate", type=float, default=200, help="messages per second to publish")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to publish for")
+    parser.add_argument("--payload-bytes", type=int, default=128, help="approximate JSON payload size")
+    parser.add_argument("--int-ratio", type=float, default=0.5, help="share of messages sent to lake/raw/int")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for rows after publishing")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="seconds between DB polls")
+    parser.add_argument("--label", default="", help="free-form tag stored with the results")
+    parser.add_argument("--output", help="append the JSON result to this file (JSON lines); stdout if omitted")
+    return parser.parse_args()
+
+
+def db_connect():
+    return psycopg2.connect(
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=int(os.environ.get("DB_PORT", "5432")),
+        dbname=os.environ.get("DB_NAME", "sensordata"),
+        user=os.environ.get("DB_USER", "user"),
+        password=os.environ.get("DB_PASSWORD", "password"),
+    )
+
+
+def build_payload(run_id, seq, is_int, payload_bytes):
+    payload = {
+        "value": random.randint(0, 1000) if is_int else round(random.uniform(0, 1000), 3),
+        "bench_run": run_id,
+        "seq": seq,
+        "published_at": time.time(),
+    }
+    encoded = json.dumps(payload)
+    padding = payload_bytes - len(encoded) - len(', "pad": ""')
+    if padding > 0:
+        payload["pad"] = "x" * padding
+        encoded = json.dumps(payload)
+    return encoded
+
+
+class RowPoller:
+    """Tracks when each benchmark row first becomes visible in the lake tables."""
+
+    QUERY = """
+        SELECT id, (payload->>'seq')::bigint, (payload->>'published_at')::float8
+        FROM {table}
+        WHERE id > %s AND payload->>'bench_run' = %s
+        ORDER BY id
+    """
+
+    def __init__(self, conn, run_id):
+        self.conn = conn
+        self.conn.autocommit = True
+        self.run_id = run_id
+        self.last_id = {}
+        self.latencies = {}
+        self.last_arrival = None
+
+    def start(self):
+        # Only rows inserted after this point can belong to the run
+        with self.conn.cursor() as cur:
+            for table in ("lake_raw_data_int", "lake_raw_data_float"):
+                cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                self.last_id[table] = cur.fetchone()[0]
+
+    def poll(self):
+        observed_at = time.time()
+        with self.conn.cursor() as cur:
+            for table, last_id in self.last_id.items():
+                cur.execute(self.QUERY.format(table=table), (last_id, self.run_id))
+                for row_id, seq, published_at in cur.fetchall():
+                    self.last_id[table] = row_id
+                    self.latencies.setdefault(seq, observed_at - published_at)
+                    self.last_arrival = observed_at
+        return len(self.latencies)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main():
+    args = parse_args()
+    run_id = uuid.uuid4().hex[:12]
+
+    poller = RowPoller(db_connect(), run_id)
+    poller.start()
+
+    client = mqtt.Client(protocol=mqtt.MQTTv311, client_id=f"ingest_bench_{run_id}")
+    client.connect(args.broker, args.port, keepalive=60)
+    client.loop_start()
+
+    total = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    next_poll = time.monotonic() + args.poll_interval
+    print(f"Run {run_id}: publishing {total} messages at {args.rate:g} msg/s to {args.broker}:{args.port}", file=sys.stderr)
+
+    started = time.monotonic()
+    started_wall = time.time()
+    for seq in range(total):
+        # Pace against the schedule instead of sleeping a fixed interval, so publish overhead does not lower the rate
+        delay = started + seq * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        is_int = random.random() < args.int_ratio
+        client.publish(TOPIC_INT if is_int else TOPIC_FLOAT, build_payload(run_id, seq, is_int, args.payload_bytes), qos=args.qos)
+        if time.monotonic() >= next_poll:
+            poller.poll()
+            next_poll = time.monotonic() + args.poll_interval
+    publish_seconds = time.monotonic() - started
+
+    deadline = time.monotonic() + args.drain_timeout
+    while poller.poll() < total and time.monotonic() < deadline:
+        time.sleep(args.poll_interval)
+    ingest_seconds = (poller.last_arrival - started_wall) if poller.last_arrival else None
+
+    client.loop_stop()
+    client.disconnect()
+
+    latencies = sorted(poller.latencies.values())
+    received = len(latencies)
+    result = {
+        "run_id": run_id,
+        "label": args.label,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "payload_bytes": args.payload_bytes,
+            "int_ratio": args.int_ratio,
+            "qos": args.qos,
+            "poll_interval": args.poll_interval,
+        },
+        "published": total,
+        "received": received,
+        "lost": total - received,
+        "loss_ratio": (total - received) / total if total else 0.0,
+        "publish_rate": total / publish_seconds if publish_seconds else None,
+        "sustained_rate": received / ingest_seconds if ingest_seconds else None,
+        # Latency resolution is bounded by --poll-interval
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+    line = json.dumps(result)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the per-message CPU cost in subscriber.on_message.
+
+Runs the real on_message against an in-memory queue stub (no broker, no
+database) and compares it with the previous decode path
+(decode + json.loads + json.dumps for the JSONB column). Prints one JSON line
+with microseconds per message for each variant.
+
+Example:
+    python benchmarks/on_message_bench.py --messages 200000
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "subscriber"))
+
+import subscriber  # noqa: E402
+
+
+class _Message:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class _NullQueue:
+    def put(self, item):
+        pass
+
+
+def legacy_decode(msg):
+    """Decode path before the fast-path change, kept for comparison."""
+    payload = json.loads(msg.payload.decode("utf-8"))
+    value = payload.get("value")
+    return json.dumps(payload), value
+
+
+def fast_decode(msg):
+    payload = subscriber.parse_json(msg.payload)
+    return msg.payload.decode("utf-8"), payload.get("value")
+
+
+def per_message_us(func, messages, repeat):
+    def run():
+        for msg in messages:
+            func(msg)
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="on_message per-message CPU cost")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--payload-bytes", type=int, default=128)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    subscriber.ingest_queue = _NullQueue()
+
+    pad = "x" * max(0, args.payload_bytes - 60)
+    messages = [
+        _Message("lake/raw/int", json.dumps({"value": i, "sensor": "s1", "pad": pad}).encode())
+        if i % 2 else
+        _Message("lake/raw/float", json.dumps({"value": i + 0.5, "sensor": "s1", "pad": pad}).encode())
+        for i in range(args.messages)
+    ]
+
+    result = {
+        "messages": args.messages,
+        "payload_bytes": len(messages[0].payload),
+        "json_parser": getattr(subscriber.parse_json, "__module__", "json"),
+        "us_per_message": {
+            "legacy_decode": per_message_us(legacy_decode, messages, args.repeat),
+            "fast_decode": per_message_us(fast_decode, messages, args.repeat),
+            "on_message": per_message_us(lambda m: subscriber.on_message(None, None, m), messages, args.repeat),
+        },
+    }
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Cold-start and rerun latency of streamlit_app/app.py.
+
+Runs the dashboard headlessly with Streamlit's AppTest (no browser, no
+server) against the configured database. Each cold start happens in a fresh
+interpreter, so it includes module imports (plotly, pandas) and empty
+st.cache_data / st.cache_resource caches. In the same interpreter the script
+then times warm reruns and, when the app has the view selector, a rerun per
+view.
+
+--rev compares against the app.py of a git revision (e.g. the commit before
+lazy view loading), copied next to the current app so utils/ and styles/
+resolve the same way. Prints one JSON line per variant.
+
+Example:
+    python benchmarks/streamlit_startup_bench.py --rev HEAD~1 --cold-runs 5 --reruns 10 \
+        --output startup_results.jsonl
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit_app")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streamlit dashboard startup/rerun latency")
+    parser.add_argument("--rev", action="append", default=[], help="git revision(s) to compare with the working tree")
+    parser.add_argument("--cold-runs", type=int, default=3, help="fresh interpreters per variant")
+    parser.add_argument("--reruns", type=int, default=5, help="warm reruns per interpreter")
+    parser.add_argument("--timeout", type=float, default=120, help="AppTest timeout per run (seconds)")
+    parser.add_argument("--label", default="", help="free-form tag stored with the results")
+    parser.add_argument("--output", help="append the JSON results to this file (JSON lines); stdout if omitted")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def timed_run(at, timeout):
+    started = time.perf_counter()
+    at.run(timeout=timeout)
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"app raised: {at.exception[0].message}")
+    return elapsed
+
+
+def worker(app_path, reruns, timeout):
+    """One fresh interpreter: cold run, warm reruns and per-view reruns."""
+    started = time.perf_counter()
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    from streamlit.testing.v1 import AppTest
+
+    streamlit_import_s = time.perf_counter() - started
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    cold_s = timed_run(at, timeout)
+    modules_after_cold = sorted(m for m in ("plotly.express", "plotly.graph_objects") if m in sys.modules)
+    rerun_s = [timed_run(at, timeout) for _ in range(reruns)]
+
+    views = {}
+    selector = [r for r in at.radio if r.key == "view"]
+    if selector:
+        for option in selector[0].options:
+            selector[0].set_value(option)
+            views[option] = statistics.median(timed_run(at, timeout) for _ in range(max(1, reruns)))
+
+    return {
+        "streamlit_import_s": streamlit_import_s,
+        "cold_run_s": cold_s,
+        "plotly_loaded_on_first_view": modules_after_cold,
+        "rerun_s": statistics.median(rerun_s) if rerun_s else None,
+        "view_rerun_s": views,
+    }
+
+
+def run_variant(name, app_path, args):
+    samples = []
+    for _ in range(args.cold_runs):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", app_path,
+             "--reruns", str(args.reruns), "--timeout", str(args.timeout)],
+            capture_output=True, text=True,
+        )
+        wall_s = time.perf_counter() - started
+        if proc.returncode != 0:
+            raise RuntimeError(f"{name}: worker failed\n{proc.stderr}")
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        sample["process_wall_s"] = wall_s
+        samples.append(sample)
+
+    def median(key):
+        return statistics.median(s[key] for s in samples)
+
+    view_names = samples[0]["view_rerun_s"].keys()
+    return {
+        "variant": name,
+        "label": args.label,
+        "cold_runs": args.cold_runs,
+        "reruns": args.reruns,
+        "process_wall_s": median("process_wall_s"),
+        "streamlit_import_s": median("streamlit_import_s"),
+        "cold_run_s": median("cold_run_s"),
+        "rerun_s": median("rerun_s"),
+        "plotly_loaded_on_first_view": samples[0]["plotly_loaded_on_first_view"],
+        "view_rerun_s": {v: statistics.median(s["view_rerun_s"][v] for s in samples) for v in view_names},
+    }
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.reruns, args.timeout)))
+        return
+
+    variants = [("working-tree", os.path.join(APP_DIR, "app.py"))]
+    copies = []
+    for rev in args.rev:
+        source = subprocess.run(["git", "show", f"{rev}:streamlit_app/app.py"],
+                                cwd=APP_DIR, capture_output=True, text=True, check=True).stdout
+        path = os.path.join(APP_DIR, f"_bench_app_{len(copies)}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        copies.append(path)
+        variants.append((rev, path))
+
+    try:
+        for name, path in variants:
+            line = json.dumps(run_variant(name, path, args))
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            print(line)
+    finally:
+        for path in copies:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
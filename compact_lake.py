@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Retención y compactación de las tablas crudas del lago (lake_raw_data_int / lake_raw_data_float).
+
+Las filas más antiguas que LAKE_RETENTION_DAYS se retiran en lotes pequeños, cada uno en su propia
+transacción corta (SELECT ... FOR UPDATE + DELETE), para no bloquear las inserciones del subscriber.
+En la misma sentencia cada lote se suma a lake_raw_rollup_hourly (conteo, suma, suma de cuadrados,
+mínimo y máximo por topic y hora).
+
+Si LAKE_ARCHIVE_DIR está definido, las filas completas (incluido el payload) se archivan en Parquet
+antes de borrarlas: un único ParquetWriter recibe cada lote como un row group y el archivo se publica
+(fsync + rename del .tmp) cada LAKE_ARCHIVE_FILE_ROWS filas; sólo entonces se borran esas filas por id.
+Una caída antes de publicar el archivo no borra nada; una caída entre la publicación y el borrado, o un
+lote que no obtiene sus bloqueos, deja filas que la siguiente ejecución vuelve a archivar (se distinguen
+por id).
+
+Al terminar se ejecuta VACUUM para que el espacio liberado se reutilice en nuevas inserciones y,
+si LAKE_COMPACT_REINDEX está activo y la pasada borró una fracción suficiente de la tabla,
+REINDEX CONCURRENTLY para compactar los índices de topic y timestamp.
+
+Uso:
+    python compact_lake.py              # una ejecución (o en bucle cada LAKE_COMPACT_INTERVAL_SECONDS)
+    python compact_lake.py --dry-run    # sólo informa cuántas filas se moverían
+"""
+
+import os
+import sys
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
+
+from init_db import LAKE_ROLLUP_SQL
+
+# Misma base de datos y credenciales por defecto que el job de ingesta (run_publisher.py)
+DB_HOST = os.getenv("DB_HOST", "postgres_db")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "sensordata")
+DB_USER = os.getenv("DB_USER", "user")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+
+# Antigüedad a partir de la cual las filas salen de las tablas calientes y tablas a compactar
+LAKE_RETENTION_DAYS = float(os.getenv("LAKE_RETENTION_DAYS", "30"))
+LAKE_COMPACT_TABLES = [t.strip() for t in os.getenv("LAKE_COMPACT_TABLES", "lake_raw_data_int,lake_raw_data_float").split(",") if t.strip()]
+# Filas por lote (una transacción cada uno) y pausa entre lotes para ceder I/O a las inserciones
+LAKE_COMPACT_BATCH_ROWS = int(os.getenv("LAKE_COMPACT_BATCH_ROWS", "5000"))
+LAKE_COMPACT_PAUSE_SECONDS = float(os.getenv("LAKE_COMPACT_PAUSE_SECONDS", "0.1"))
+# Si un lote no obtiene sus bloqueos en este tiempo se aborta y se reintenta en la siguiente vuelta
+LAKE_COMPACT_LOCK_TIMEOUT_MS = int(os.getenv("LAKE_COMPACT_LOCK_TIMEOUT_MS", "2000"))
+# Directorio del archivo Parquet (vacío = sólo agregados, el payload se descarta) y filas por archivo
+LAKE_ARCHIVE_DIR = os.getenv("LAKE_ARCHIVE_DIR", "lake_archive")
+LAKE_ARCHIVE_FILE_ROWS = int(os.getenv("LAKE_ARCHIVE_FILE_ROWS", "1000000"))
+# Reconstruir los índices sin bloquear escrituras tras la compactación, sólo si la pasada borró al menos
+# esta fracción de las filas de la tabla (con pocas filas borradas VACUUM basta y el REINDEX no compensa)
+LAKE_COMPACT_REINDEX = os.getenv("LAKE_COMPACT_REINDEX", "false").lower() == "true"
+LAKE_COMPACT_REINDEX_MIN_FRACTION = float(os.getenv("LAKE_COMPACT_REINDEX_MIN_FRACTION", "0.2"))
+# Zona horaria de las columnas timestamp del lago (TIMESTAMP sin zona). El subscriber las llena con
+# datetime.now() sin zona, es decir, la hora local de su contenedor, que es UTC si no se define TZ.
+# El corte se calcula en esta zona, no en la TimeZone de la sesión de Postgres.
+LAKE_TIMEZONE = os.getenv("LAKE_TIMEZONE", "UTC")
+# Ejecución en bucle dentro del proceso (0 = una sola ejecución)
+LAKE_COMPACT_INTERVAL_SECONDS = int(os.getenv("LAKE_COMPACT_INTERVAL_SECONDS", "0"))
+
+# Un lote: bloquear filas viejas ({batch}), borrarlas y sumarlas a los agregados horarios, todo en una
+# única sentencia. Devuelve cuántas filas se movieron.
+MOVE_BATCH_SQL = """
+WITH batch AS (
+    {batch}
+), moved AS (
+    DELETE FROM {table} t USING batch b
+    WHERE t.id = b.id
+    RETURNING t.topic, t.value, t.timestamp
+), rolled AS (
+    INSERT INTO lake_raw_rollup_hourly AS r
+        (source_table, topic, bucket_start, row_count, sample_count, value_sum, value_sumsq, value_min, value_max)
+    SELECT %(table_name)s, topic, date_trunc('hour', timestamp), COUNT(*), COUNT(value),
+           COALESCE(SUM(value), 0), COALESCE(SUM(value::float8 * value), 0), MIN(value), MAX(value)
+    FROM moved
+    GROUP BY topic, date_trunc('hour', timestamp)
+    ON CONFLICT (source_table, topic, bucket_start) DO UPDATE SET
+        row_count = r.row_count + EXCLUDED.row_count,
+        sample_count = r.sample_count + EXCLUDED.sample_count,
+        value_sum = r.value_sum + EXCLUDED.value_sum,
+        value_sumsq = r.value_sumsq + EXCLUDED.value_sumsq,
+        value_min = LEAST(r.value_min, EXCLUDED.value_min),
+        value_max = GREATEST(r.value_max, EXCLUDED.value_max)
+)
+SELECT COUNT(*) FROM moved;
+"""
+# Sin archivo: cualquier fila vieja, sin esperar a las que estén bloqueadas
+OLD_ROWS_BATCH = "SELECT id FROM {table} WHERE timestamp < %(cutoff)s LIMIT %(batch_rows)s FOR UPDATE SKIP LOCKED"
+# Con archivo: exactamente las filas ya archivadas
+ARCHIVED_ROWS_BATCH = "SELECT id FROM {table} WHERE id = ANY(%(ids)s) FOR UPDATE"
+
+# Lectura de un lote para el archivo, en orden de id a partir del último archivado
+ARCHIVE_BATCH_SQL = """
+SELECT id, topic, payload::text, value, timestamp FROM {table}
+WHERE timestamp < %(cutoff)s AND id > %(after_id)s
+ORDER BY id
+LIMIT %(batch_rows)s;
+"""
+
+# --- Funciones ---
+
+def get_db_connection():
+    """Establece conexión a la BD con reintentos."""
+    for i in range(5):
+        try:
+            conn = psycopg2.connect(
+                host=DB_HOST, port=DB_PORT, dbname=DB_NAME,
+                user=DB_USER, password=DB_PASSWORD
+            )
+            print("✅ Conexión a la base de datos PostgreSQL exitosa.")
+            return conn
+        except psycopg2.OperationalError as e:
+            print(f"❌ Error al conectar con PostgreSQL (intento {i+1}/5): {e}")
+            time.sleep(5)
+    return None
+
+def relation_sizes(cur, table):
+    """Tamaño en bytes del heap (con TOAST) y de los índices de la tabla."""
+    cur.execute(
+        "SELECT pg_table_size(%s::regclass), pg_indexes_size(%s::regclass), "
+        "(SELECT reltuples FROM pg_class WHERE oid = %s::regclass);",
+        (table, table, table),
+    )
+    heap, indexes, tuples = cur.fetchone()
+    return {"heap": heap, "indexes": indexes, "rows_estimate": max(tuples, 0)}
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+def archive_schema(table):
+    """Esquema Parquet de la tabla, o None si el archivo está desactivado."""
+    if not LAKE_ARCHIVE_DIR:
+        return None
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("❌ pyarrow no está instalado: instálalo o deja LAKE_ARCHIVE_DIR vacío para conservar sólo agregados.")
+        sys.exit(1)
+    value_type = pa.int64() if table.endswith("_int") else pa.float64()
+    return pa.schema([
+        ("id", pa.int64()),
+        ("topic", pa.string()),
+        ("payload", pa.string()),
+        ("value", value_type),
+        ("timestamp", pa.timestamp("us")),
+    ])
+
+def archive_file(conn, table, schema, cutoff, after_id):
+    """
+    Archiva hasta LAKE_ARCHIVE_FILE_ROWS filas anteriores a cutoff con id > after_id en un único archivo
+    Parquet, un row group por lote, y lo publica antes de que se borre nada.
+    Devuelve (lotes de ids archivados, ruta del archivo o None).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = os.path.join(LAKE_ARCHIVE_DIR, table)
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".parquet.tmp"):
+            # Archivo a medio escribir de una ejecución interrumpida: sus filas siguen en la tabla
+            os.remove(os.path.join(directory, name))
+    query = sql.SQL(ARCHIVE_BATCH_SQL).format(table=sql.Identifier(table))
+    batches, archived = [], 0
+    writer = tmp_path = first = None
+    try:
+        while archived < LAKE_ARCHIVE_FILE_ROWS:
+            with conn.cursor() as cur:
+                cur.execute(query, {"cutoff": cutoff, "after_id": after_id,
+                                    "batch_rows": min(LAKE_COMPACT_BATCH_ROWS, LAKE_ARCHIVE_FILE_ROWS - archived)})
+                rows = cur.fetchall()
+            conn.rollback()
+            if not rows:
+                break
+            if writer is None:
+                first = rows[0]
+                tmp_path = os.path.join(directory, f"{first[4]:%Y%m%d}-{first[0]}.parquet.tmp")
+                writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+            batches.append([row[0] for row in rows])
+            archived += len(rows)
+            after_id = rows[-1][0]
+            if len(rows) < LAKE_COMPACT_BATCH_ROWS:
+                break
+        if writer is None:
+            return [], None
+        writer.close()
+        writer = None
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        final_path = os.path.join(directory, f"{first[4]:%Y%m%d}-{first[0]}-{after_id}.parquet")
+        os.replace(tmp_path, final_path)
+        return batches, final_path
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def move_batch(conn, query, params, report, table):
+    """
+    Mueve un lote en su propia transacción. Devuelve las filas movidas, o None si no obtuvo sus bloqueos
+    (y ya se reintentaron demasiados lotes en esta pasada).
+    """
+    while True:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s;", (LAKE_COMPACT_LOCK_TIMEOUT_MS,))
+                cur.execute(query, params)
+                moved = cur.fetchone()[0]
+            conn.commit()
+            return moved
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            report["lock_timeouts"] += 1
+            print(f"⚠️ {table}: lote bloqueado por otra transacción, se reintenta.")
+            if report["lock_timeouts"] >= 10:
+                print(f"⚠️ {table}: demasiados bloqueos, se continuará en la próxima ejecución.")
+                return None
+            time.sleep(1)
+        except Exception:
+            conn.rollback()
+            raise
+
+def compact_table(conn, table, cutoff, dry_run=False):
+    """Mueve a agregados/archivo las filas anteriores a cutoff, lote a lote. Devuelve el informe de la tabla."""
+    with conn.cursor() as cur:
+        before = relation_sizes(cur, table)
+        if dry_run:
+            cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE timestamp < %s;").format(sql.Identifier(table)), (cutoff,))
+            candidates = cur.fetchone()[0]
+            conn.rollback()
+            return {"table": table, "rows_moved": 0, "candidates": candidates, "before": before}
+
+    schema = archive_schema(table)
+    report = {"table": table, "rows_moved": 0, "batches": 0, "archive_bytes": 0, "archive_files": 0,
+              "lock_timeouts": 0, "before": before}
+    started = time.monotonic()
+
+    def move_query(batch):
+        return sql.SQL(MOVE_BATCH_SQL).format(table=sql.Identifier(table),
+                                              batch=sql.SQL(batch).format(table=sql.Identifier(table)))
+
+    if schema is None:
+        query = move_query(OLD_ROWS_BATCH)
+        params = {"cutoff": cutoff, "batch_rows": LAKE_COMPACT_BATCH_ROWS, "table_name": table}
+        while True:
+            moved = move_batch(conn, query, params, report, table)
+            if not moved:
+                break
+            report["rows_moved"] += moved
+            report["batches"] += 1
+            if moved < LAKE_COMPACT_BATCH_ROWS:
+                break
+            time.sleep(LAKE_COMPACT_PAUSE_SECONDS)
+    else:
+        query = move_query(ARCHIVED_ROWS_BATCH)
+        after_id = 0
+        while True:
+            batches, path = archive_file(conn, table, schema, cutoff, after_id)
+            if path is None:
+                break
+            report["archive_bytes"] += os.path.getsize(path)
+            report["archive_files"] += 1
+            complete = True
+            for ids in batches:
+                moved = move_batch(conn, query, {"ids": ids, "table_name": table}, report, table)
+                if moved is None:
+                    complete = False
+                    break
+                report["rows_moved"] += moved
+                report["batches"] += 1
+                time.sleep(LAKE_COMPACT_PAUSE_SECONDS)
+            # Un archivo sin llenar significa que ya no quedan filas viejas
+            if not complete or sum(len(ids) for ids in batches) < LAKE_ARCHIVE_FILE_ROWS:
+                break
+            after_id = batches[-1][-1]
+
+    report["seconds"] = time.monotonic() - started
+    if report["rows_moved"]:
+        reindex = LAKE_COMPACT_REINDEX and \
+            report["rows_moved"] >= LAKE_COMPACT_REINDEX_MIN_FRACTION * before["rows_estimate"]
+        reclaim_space(conn, table, reindex)
+        report["reindexed"] = reindex
+    with conn.cursor() as cur:
+        report["after"] = relation_sizes(cur, table)
+    conn.rollback()
+    return report
+
+def reclaim_space(conn, table, reindex=False):
+    """
+    VACUUM deja el espacio de las filas borradas disponible para nuevas inserciones (sin bloquear escrituras)
+    y, con reindex, REINDEX CONCURRENTLY reconstruye los índices ya sin las entradas muertas.
+    """
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("VACUUM (ANALYZE) {};").format(sql.Identifier(table)))
+            if reindex:
+                cur.execute(
+                    "SELECT indexrelid::regclass::text FROM pg_index "
+                    "WHERE indrelid = %s::regclass AND NOT indisprimary;",
+                    (table,),
+                )
+                for (index,) in cur.fetchall():
+                    # regclass::text ya viene calificado y entrecomillado si hace falta
+                    cur.execute(sql.SQL("REINDEX INDEX CONCURRENTLY {};").format(sql.SQL(index)))
+    finally:
+        conn.autocommit = previous_autocommit
+
+def print_report(report, cutoff):
+    table = report["table"]
+    before = report["before"]
+    if "candidates" in report:
+        print(f"🔎 {table}: {report['candidates']} filas anteriores a {cutoff:%Y-%m-%d %H:%M} "
+              f"(heap {format_bytes(before['heap'])}, índices {format_bytes(before['indexes'])}).")
+        return
+    after = report["after"]
+    print(f"\n📦 {table}: {report['rows_moved']} filas movidas en {report['batches']} lotes ({report['seconds']:.1f}s)")
+    if report["archive_files"]:
+        print(f"   🗄️ Archivo Parquet: {report['archive_files']} archivos, {format_bytes(report['archive_bytes'])}")
+    # El heap no se encoge con VACUUM: el espacio de las filas borradas queda libre para reutilizarse
+    avg_row = before["heap"] / before["rows_estimate"] if before["rows_estimate"] else 0
+    print(f"   💾 Heap: {format_bytes(before['heap'])} → {format_bytes(after['heap'])} "
+          f"(≈{format_bytes(avg_row * report['rows_moved'])} reutilizables por nuevas inserciones)")
+    print(f"   🌲 Índices: {format_bytes(before['indexes'])} → {format_bytes(after['indexes'])} "
+          f"({format_bytes(before['indexes'] - after['indexes'])} recuperados"
+          f"{', con REINDEX' if report.get('reindexed') else ''})")
+    if report["lock_timeouts"]:
+        print(f"   ⚠️ Lotes abortados por bloqueos: {report['lock_timeouts']}")
+
+def run_compaction(dry_run=False):
+    """Una pasada de compactación sobre todas las tablas configuradas."""
+    print(f"🧹 Compactando tablas del lago: filas con más de {LAKE_RETENTION_DAYS:g} días (horas en {LAKE_TIMEZONE}).")
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(LAKE_ROLLUP_SQL)
+        conn.commit()
+        # timestamp es TIMESTAMP sin zona: su DEFAULT CURRENT_TIMESTAMP guardaría la hora en la TimeZone de
+        # la sesión, pero el subscriber escribe la hora local de su contenedor. El corte se expresa en
+        # LAKE_TIMEZONE (UTC por defecto, la de los contenedores) para no depender de la sesión.
+        with conn.cursor() as cur:
+            cur.execute("SELECT now() AT TIME ZONE %s;", (LAKE_TIMEZONE,))
+            cutoff = cur.fetchone()[0] - timedelta(days=LAKE_RETENTION_DAYS)
+        conn.rollback()
+
+        for table in LAKE_COMPACT_TABLES:
+            try:
+                print_report(compact_table(conn, table, cutoff, dry_run=dry_run), cutoff)
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ Error compactando {table}: {e}")
+    finally:
+        conn.close()
+    print(f"\n✨ Compactación finalizada ({datetime.now():%Y-%m-%d %H:%M:%S}).")
+    return True
+
+def main():
+    """Punto de entrada: una ejecución, un bucle cada LAKE_COMPACT_INTERVAL_SECONDS o --dry-run."""
+    if "--dry-run" in sys.argv:
+        run_compaction(dry_run=True)
+        return
+
+    if LAKE_COMPACT_INTERVAL_SECONDS <= 0:
+        if not run_compaction():
+            sys.exit(1)
+        return
+
+    # Como en run_publisher.py, un fallo (p. ej. un reinicio de Postgres) sólo pierde esa pasada
+    while True:
+        try:
+            if run_compaction():
+                print(f"⏳ Esperando {LAKE_COMPACT_INTERVAL_SECONDS}s para la próxima compactación.")
+            else:
+                print(f"⚠️ Compactación sin conexión a la base de datos, se reintenta en {LAKE_COMPACT_INTERVAL_SECONDS}s.")
+        except Exception:
+            traceback.print_exc()
+            print(f"❌ La compactación falló, se reintenta en {LAKE_COMPACT_INTERVAL_SECONDS}s.")
+        time.sleep(LAKE_COMPACT_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    main()
@@ -20,21 +20,287 @@ CREATE TABLE IF NOT EXISTS dim_stations (
     longitude DOUBLE PRECISION
 );
 
+-- 2b. Registro de Sensores (Basado en /v3/locations/{id}/sensors de OpenAQ)
+-- Relaciona cada sensor de OpenAQ con su estación y parámetro. El job de ingesta lee de aquí qué sensores descargar.
+CREATE TABLE IF NOT EXISTS dim_sensors (
+    id INT PRIMARY KEY,
+    station_id INT NOT NULL REFERENCES dim_stations(id),
+    parameter_id INT NOT NULL REFERENCES dim_parameters(id),
+    active BOOLEAN NOT NULL DEFAULT TRUE
+);
+
 -- 3. Tabla de Hechos: Mediciones
 -- Tabla principal que almacena cada medición individual. Optimizada para inserciones rápidas y consultas de series de tiempo.
+-- Particionada por mes sobre timestamp_utc: las consultas por rango sólo tocan los meses necesarios
+-- y la retención se hace separando y borrando particiones completas en lugar de DELETE masivos.
+--
+-- Migración de bases creadas con el esquema anterior (fact_measurements como tabla normal): CREATE TABLE IF NOT
+-- EXISTS la dejaría sin particionar. Se aparta como fact_measurements_legacy, con sus restricciones, índice y
+-- secuencia renombrados para que no choquen con los de la tabla nueva; sus filas se copian más abajo, una vez
+-- creadas la tabla particionada y sus particiones. Basta con volver a ejecutar este script sobre la base existente
+-- (psql -f init.sql); si se interrumpe, la siguiente ejecución retoma la copia desde fact_measurements_legacy.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('fact_measurements') AND relkind = 'r') THEN
+        ALTER TABLE fact_measurements RENAME TO fact_measurements_legacy;
+        ALTER TABLE fact_measurements_legacy RENAME CONSTRAINT fact_measurements_pkey TO fact_measurements_legacy_pkey;
+        ALTER TABLE fact_measurements_legacy RENAME CONSTRAINT unique_measurement TO unique_measurement_legacy;
+        ALTER INDEX IF EXISTS idx_measurements_time RENAME TO idx_measurements_legacy_time;
+        ALTER SEQUENCE IF EXISTS fact_measurements_id_seq RENAME TO fact_measurements_legacy_id_seq;
+        RAISE NOTICE 'fact_measurements sin particionar renombrada a fact_measurements_legacy para migrarla';
+    END IF;
+END;
+$$;
+
 CREATE TABLE IF NOT EXISTS fact_measurements (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     station_id INT REFERENCES dim_stations(id),
     parameter_id INT REFERENCES dim_parameters(id),
     value FLOAT NOT NULL,
     timestamp_utc TIMESTAMPTZ NOT NULL,
     ingested_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-    -- Restricción para evitar duplicados en la ingesta incremental
+    -- La clave de partición debe formar parte de toda restricción única
+    PRIMARY KEY (id, timestamp_utc),
+    -- Restricción para evitar duplicados en la ingesta incremental (la usa ON CONFLICT)
     CONSTRAINT unique_measurement UNIQUE(station_id, parameter_id, timestamp_utc)
+) PARTITION BY RANGE (timestamp_utc);
+
+-- Índice BRIN para rangos de tiempo: ocupa unas pocas páginas porque los datos llegan en orden cronológico.
+-- Las consultas por (estación, parámetro, rango) usan el índice único.
+CREATE INDEX IF NOT EXISTS idx_measurements_time_brin ON fact_measurements USING BRIN (timestamp_utc);
+
+-- Partición DEFAULT: recoge las lecturas que caen fuera de los meses creados (llegadas tardías, backfill antiguo,
+-- relojes desajustados) para que una sola fila no haga fallar la inserción de todo el lote.
+-- ensure_measurement_partitions mueve esas filas a su partición mensual cuando la crea.
+CREATE TABLE IF NOT EXISTS fact_measurements_default PARTITION OF fact_measurements DEFAULT;
+
+-- Crea las particiones mensuales (fact_measurements_yYYYYmMM) desde el mes de from_ts hasta months_ahead meses
+-- después del mes actual. Es idempotente; el job de ingesta la llama antes de cada ejecución.
+-- PostgreSQL no deja crear una partición si la DEFAULT ya tiene filas de su rango: se sacan antes a una tabla
+-- temporal y se reinsertan por la tabla padre, que ya las encamina a la partición nueva.
+CREATE OR REPLACE FUNCTION ensure_measurement_partitions(from_ts TIMESTAMPTZ, months_ahead INT DEFAULT 2)
+RETURNS INT AS $$
+DECLARE
+    month_start TIMESTAMPTZ := date_trunc('month', from_ts, 'UTC');
+    last_month TIMESTAMPTZ := date_trunc('month', NOW(), 'UTC') + make_interval(months => months_ahead);
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'fact_measurements_' || to_char(month_start AT TIME ZONE 'UTC', '"y"YYYY"m"MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            CREATE TEMP TABLE IF NOT EXISTS pending_default_rows (LIKE fact_measurements) ON COMMIT DROP;
+            WITH moved AS (
+                DELETE FROM fact_measurements_default
+                WHERE timestamp_utc >= month_start AND timestamp_utc < month_start + INTERVAL '1 month'
+                RETURNING *
+            )
+            INSERT INTO pending_default_rows SELECT * FROM moved;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF fact_measurements FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + INTERVAL '1 month'
+            );
+            INSERT INTO fact_measurements SELECT * FROM pending_default_rows;
+            TRUNCATE pending_default_rows;
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Retención: separa y elimina las particiones cuyo mes terminó hace más de keep_months meses.
+-- DETACH + DROP libera el espacio al instante, sin VACUUM ni bloqueos largos sobre la tabla padre.
+-- La partición DEFAULT no entra en la retención: sus filas pasan a una mensual cuando ésta se crea.
+CREATE OR REPLACE FUNCTION drop_old_measurement_partitions(keep_months INT)
+RETURNS INT AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => keep_months))::date;
+    partition_month DATE;
+    child RECORD;
+    dropped INT := 0;
+BEGIN
+    FOR child IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'fact_measurements'::regclass
+          AND c.relname ~ '^fact_measurements_y[0-9]{4}m[0-9]{2}$'
+    LOOP
+        partition_month := to_date(substring(child.relname FROM 'y([0-9]{4}m[0-9]{2})$'), 'YYYY"m"MM');
+        IF partition_month + INTERVAL '1 month' <= cutoff THEN
+            EXECUTE format('ALTER TABLE fact_measurements DETACH PARTITION %I', child.relname);
+            EXECUTE format('DROP TABLE %I', child.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Particiones iniciales: cubren la ventana de backfill inicial y los próximos meses
+SELECT ensure_measurement_partitions(NOW() - INTERVAL '1 month');
+
+-- Fin de la migración: crea las particiones que cubren las filas de fact_measurements_legacy, las copia
+-- conservando sus id, ajusta la secuencia para que los nuevos id sigan a los copiados y elimina la tabla antigua.
+-- Todo el bloque es una única transacción: o se migra completo o la tabla antigua queda intacta.
+DO $$
+DECLARE
+    oldest TIMESTAMPTZ;
+BEGIN
+    IF to_regclass('fact_measurements_legacy') IS NOT NULL THEN
+        SELECT MIN(timestamp_utc) INTO oldest FROM fact_measurements_legacy;
+        IF oldest IS NOT NULL THEN
+            PERFORM ensure_measurement_partitions(oldest);
+        END IF;
+        INSERT INTO fact_measurements (id, station_id, parameter_id, value, timestamp_utc, ingested_at)
+        SELECT id, station_id, parameter_id, value, timestamp_utc, ingested_at FROM fact_measurements_legacy
+        ON CONFLICT (station_id, parameter_id, timestamp_utc) DO NOTHING;
+        PERFORM setval(
+            pg_get_serial_sequence('fact_measurements', 'id'),
+            GREATEST((SELECT MAX(id) FROM fact_measurements), 1)
+        );
+        DROP TABLE fact_measurements_legacy;
+        RAISE NOTICE 'fact_measurements migrada a la tabla particionada';
+    END IF;
+END;
+$$;
+
+-- 3b. Agregados precalculados por hora y por día (UTC) para cada (estación, parámetro).
+-- Los mantiene el job de ingesta en la misma transacción que cada inserción; el dashboard los usa en rangos largos.
+-- Guardan count/sum/sumsq/min/max, suficiente para promedio, desviación estándar y extremos de cualquier unión de buckets.
+CREATE TABLE IF NOT EXISTS agg_measurements_hourly (
+    station_id INT NOT NULL,
+    parameter_id INT NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    sample_count INT NOT NULL,
+    value_sum DOUBLE PRECISION NOT NULL,
+    value_sumsq DOUBLE PRECISION NOT NULL,
+    value_min DOUBLE PRECISION NOT NULL,
+    value_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (station_id, parameter_id, bucket_start)
+);
+
+CREATE TABLE IF NOT EXISTS agg_measurements_daily (
+    station_id INT NOT NULL,
+    parameter_id INT NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    sample_count INT NOT NULL,
+    value_sum DOUBLE PRECISION NOT NULL,
+    value_sumsq DOUBLE PRECISION NOT NULL,
+    value_min DOUBLE PRECISION NOT NULL,
+    value_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (station_id, parameter_id, bucket_start)
+);
+
+-- 3c. Perfil día de la semana × hora (UTC) por (estación, parámetro, día): hasta 24 celdas por día, así el
+-- dashboard combina exactamente los días del rango elegido (ver get_weekday_hour_profile).
+-- Además de count/sum/sumsq/min/max cada celda guarda un boceto de cuantiles: histograma con buckets
+-- logarítmicos (clave = techo de log base 1.02 del valor, 'z' para valores <= 0) que se combina sumando
+-- conteos, así el diagrama de caja usa cuartiles precalculados (error relativo ~1%) en lugar de las filas crudas.
+CREATE TABLE IF NOT EXISTS agg_profile_weekday_hour (
+    station_id INT NOT NULL,
+    parameter_id INT NOT NULL,
+    period_start TIMESTAMPTZ NOT NULL, -- inicio del día (UTC)
+    day_of_week SMALLINT NOT NULL, -- ISODOW: 1=Lunes, 7=Domingo
+    hour_of_day SMALLINT NOT NULL,
+    sample_count INT NOT NULL,
+    value_sum DOUBLE PRECISION NOT NULL,
+    value_sumsq DOUBLE PRECISION NOT NULL,
+    value_min DOUBLE PRECISION NOT NULL,
+    value_max DOUBLE PRECISION NOT NULL,
+    value_sketch JSONB NOT NULL, -- {clave_bucket: conteo}
+    PRIMARY KEY (station_id, parameter_id, period_start, day_of_week, hour_of_day)
 );
 
--- Índice para acelerar los gráficos de series de tiempo del Dashboard
-CREATE INDEX IF NOT EXISTS idx_measurements_time ON fact_measurements (timestamp_utc DESC);
+-- Bucket del boceto de cuantiles; la base (1.02) debe coincidir con PROFILE_SKETCH_GAMMA del dashboard.
+-- Buckets logarítmicos con signo: 'k' para v > 0, 'nk' para v < 0 (mismo k que |v|) y 'z' para v = 0
+CREATE OR REPLACE FUNCTION profile_sketch_bin(v DOUBLE PRECISION) RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN v > 0 THEN CEIL(LN(v) / LN(1.02))::INT::TEXT
+        WHEN v < 0 THEN 'n' || CEIL(LN(-v) / LN(1.02))::INT::TEXT
+        ELSE 'z'
+    END;
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Suma dos bocetos {clave_bucket: conteo}; permite acumular filas nuevas sin recalcular la celda
+CREATE OR REPLACE FUNCTION profile_sketch_merge(a JSONB, b JSONB) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::JSONB)
+    FROM (
+        SELECT key, SUM(value::BIGINT) AS total
+        FROM (
+            SELECT key, value FROM jsonb_each_text(COALESCE(a, '{}'::JSONB))
+            UNION ALL
+            SELECT key, value FROM jsonb_each_text(COALESCE(b, '{}'::JSONB))
+        ) kv
+        GROUP BY key
+    ) t;
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- 4. Marcas de Agua de Ingesta
+-- Último timestamp ingerido por (estación, parámetro). Se actualiza en la misma transacción que cada inserción,
+-- de modo que el job lee todas las marcas en una sola consulta sin recorrer fact_measurements.
+CREATE TABLE IF NOT EXISTS ingestion_watermarks (
+    station_id INT NOT NULL,
+    parameter_id INT NOT NULL,
+    last_timestamp_utc TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (station_id, parameter_id)
+);
+
+-- 5. Checkpoints de Ingesta
+-- Cada tramo temporal descargado por sensor. Los tramos 'pending' se reintentan en la siguiente ejecución.
+CREATE TABLE IF NOT EXISTS ingestion_checkpoints (
+    sensor_id INT NOT NULL,
+    chunk_start TIMESTAMPTZ NOT NULL,
+    chunk_end TIMESTAMPTZ NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending', -- 'pending' | 'done'
+    rows_inserted INT,
+    completed_at TIMESTAMPTZ,
+    PRIMARY KEY (sensor_id, chunk_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_checkpoints_pending ON ingestion_checkpoints (sensor_id) WHERE status = 'pending';
+
+-- 6. Alertas de Detección en Streaming
+-- Niveles de alerta por parámetro: el detector avisa cuando una medición cruza uno de ellos (en cualquier sentido).
+CREATE TABLE IF NOT EXISTS alert_thresholds (
+    parameter_id INT NOT NULL REFERENCES dim_parameters(id),
+    threshold_value DOUBLE PRECISION NOT NULL,
+    label VARCHAR(50),
+    PRIMARY KEY (parameter_id, threshold_value)
+);
+
+-- Eventos detectados por el subscriber MQTT ('subscriber') y por el job de ingesta ('ingestion').
+-- El dashboard consulta este conjunto pequeño en lugar de recorrer el histórico.
+CREATE TABLE IF NOT EXISTS alert_events (
+    id BIGSERIAL PRIMARY KEY,
+    source VARCHAR(20) NOT NULL,
+    series_key VARCHAR(255) NOT NULL, -- 'mqtt:<tópico>' o 'station:<id>:parameter:<id>'
+    station_id INT,
+    parameter_id INT,
+    observed_at TIMESTAMPTZ NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    kind VARCHAR(20) NOT NULL, -- 'spike' | 'quantile' | 'threshold_up' | 'threshold_down'
+    score DOUBLE PRECISION, -- z-score (spike) o distancia en IQRs al cuartil más cercano (quantile)
+    threshold DOUBLE PRECISION, -- nivel cruzado (threshold_*)
+    baseline_mean DOUBLE PRECISION,
+    baseline_std DOUBLE PRECISION,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Reprocesar las mismas mediciones no duplica alertas
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alert_events_unique
+    ON alert_events (series_key, observed_at, kind, COALESCE(threshold, 'NaN'::DOUBLE PRECISION));
+CREATE INDEX IF NOT EXISTS idx_alert_events_series_time ON alert_events (station_id, parameter_id, observed_at DESC);
+
+-- Estado del detector por serie (EWMA y bocetos de cuantiles en JSON) para no recalentarlo tras un reinicio
+CREATE TABLE IF NOT EXISTS anomaly_detector_state (
+    series_key VARCHAR(255) PRIMARY KEY,
+    state JSONB NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
 
 -- --- PRE-POBLACIÓN DE DATOS DIMENSIONALES ---
 
@@ -57,5 +323,23 @@ INSERT INTO dim_stations (id, name, city, country_code, latitude, longitude) VAL
 (17, 'R K Puram, Delhi - DPCC', 'Delhi', 'IN', 28.563262, 77.186937)
 ON CONFLICT (id) DO NOTHING;
 
+-- Sensores de la estación 17 (sensor de OpenAQ -> parámetro)
+INSERT INTO dim_sensors (id, station_id, parameter_id) VALUES
+(12234782, 17, 102),
+(12234783, 17, 24),
+(12234784, 17, 15),
+(14340713, 17, 23),
+(12234785, 17, 3),
+(399, 17, 1),
+(12234787, 17, 2),
+(12234789, 17, 101)
+ON CONFLICT (id) DO NOTHING;
+
+-- Niveles de alerta de partículas: los mismos cortes que las bandas del indicador del dashboard
+INSERT INTO alert_thresholds (parameter_id, threshold_value, label) VALUES
+(2, 50, 'Moderado'), (2, 100, 'Dañino para grupos sensibles'), (2, 150, 'Dañino'), (2, 200, 'Muy dañino'), (2, 300, 'Peligroso'),
+(1, 50, 'Moderado'), (1, 100, 'Dañino para grupos sensibles'), (1, 150, 'Dañino'), (1, 200, 'Muy dañino'), (1, 300, 'Peligroso')
+ON CONFLICT (parameter_id, threshold_value) DO NOTHING;
+
 -- Mensaje final de éxito
 SELECT '✅ Esquema de base de datos creado y poblado exitosamente.' as status;
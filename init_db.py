@@ -46,6 +46,22 @@ CREATE INDEX IF NOT EXISTS idx_timestamp_int ON lake_raw_data_int(timestamp DESC
 CREATE INDEX IF NOT EXISTS idx_timestamp_float ON lake_raw_data_float(timestamp DESC);
 """
 
+# Agregados horarios de las filas que compact_lake.py retira de las tablas del lago (una fila por tabla, topic y hora)
+LAKE_ROLLUP_SQL = """
+CREATE TABLE IF NOT EXISTS lake_raw_rollup_hourly (
+    source_table VARCHAR(63) NOT NULL,
+    topic VARCHAR(255) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    row_count BIGINT NOT NULL,
+    sample_count BIGINT NOT NULL,
+    value_sum DOUBLE PRECISION NOT NULL,
+    value_sumsq DOUBLE PRECISION NOT NULL,
+    value_min DOUBLE PRECISION,
+    value_max DOUBLE PRECISION,
+    PRIMARY KEY (source_table, topic, bucket_start)
+);
+"""
+
 def main():
     print("🔧 Inicializando base de datos PostgreSQL...\n")
     print(f"📍 Conectando a: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
@@ -59,6 +75,7 @@ def main():
         # Ejecutar script SQL
         print("📝 Creando tablas...")
         cur.execute(SQL_SCRIPT)
+        cur.execute(LAKE_ROLLUP_SQL)
         conn.commit()
         print("✅ Tablas creadas exitosamente\n")
         
@@ -68,7 +85,7 @@ def main():
             SELECT table_name 
             FROM information_schema.tables 
             WHERE table_schema = 'public'
-            AND table_name IN ('lake_raw_data_int', 'lake_raw_data_float')
+            AND table_name IN ('lake_raw_data_int', 'lake_raw_data_float', 'lake_raw_rollup_hourly')
         """)
         
         tables = cur.fetchall()
@@ -7,8 +7,14 @@ from datetime import datetime, timedelta, timezone
 import sys
 import io
 import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 
+from subscriber.metrics import Counter, Gauge, Histogram, start_metrics_server
+from subscriber.anomaly import AnomalyDetector, count_alerts, load_detector_states, save_detector_states, write_alerts
+
 # Configurar encoding UTF-8 para Windows
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -24,14 +30,100 @@ DB_NAME = os.getenv("DB_NAME", "sensordata")
 DB_USER = os.getenv("DB_USER", "user")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 
+# Configuración por defecto si dim_sensors no existe o está vacía
 LOCATION_ID = 17
 SENSOR_PARAMETER_MAPPING = {
     12234782: 102, 12234783: 24, 12234784: 15, 14340713: 23,
     12234785: 3, 399: 1, 12234787: 2, 12234789: 101
 }
 
+# A partir de este número de filas se usa COPY + tabla de staging en lugar de execute_values
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "5000"))
+# Los tramos descargados se acumulan hasta este número de filas y se insertan juntos en una transacción
+INSERT_BATCH_ROWS = int(os.getenv("INSERT_BATCH_ROWS", str(BULK_COPY_THRESHOLD)))
+
+# Concurrencia contra la API de OpenAQ (la cuota por defecto es de 60 peticiones/minuto)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+OPENAQ_REQUESTS_PER_MINUTE = int(os.getenv("OPENAQ_REQUESTS_PER_MINUTE", "60"))
+# Reintentos ante errores de cuota de la API, con espera exponencial hasta OPENAQ_BACKOFF_MAX_SECONDS
+OPENAQ_RATE_LIMIT_RETRIES = int(os.getenv("OPENAQ_RATE_LIMIT_RETRIES", "5"))
+OPENAQ_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAQ_BACKOFF_MAX_SECONDS", "60"))
+
+# Backfill: tamaño de página de la API, tamaño de cada tramo temporal y ventana inicial
+API_PAGE_LIMIT = int(os.getenv("API_PAGE_LIMIT", "1000"))
+BACKFILL_CHUNK_HOURS = int(os.getenv("BACKFILL_CHUNK_HOURS", "24"))
+INITIAL_BACKFILL_DAYS = int(os.getenv("INITIAL_BACKFILL_DAYS", "7"))
+CHECKPOINT_RETENTION_DAYS = int(os.getenv("CHECKPOINT_RETENTION_DAYS", "30"))
+
+# Particiones mensuales de fact_measurements: meses futuros a crear y meses a conservar (0 = sin límite)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+MEASUREMENTS_RETENTION_MONTHS = int(os.getenv("MEASUREMENTS_RETENTION_MONTHS", "0"))
+
+# Endpoint /metrics (0 = desactivado; docker-compose lo publica en 9101) y ejecución en bucle dentro del proceso (0 = una sola ejecución)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Detección de anomalías en streaming sobre las filas nuevas de cada ejecución (ver subscriber/anomaly.py)
+ANOMALY_DETECTION = os.getenv("ANOMALY_DETECTION", "true").lower() == "true"
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "4"))
+ANOMALY_IQR_FENCE = float(os.getenv("ANOMALY_IQR_FENCE", "3"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.05"))
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "30"))
+ANOMALY_QUANTILE_WINDOW = int(os.getenv("ANOMALY_QUANTILE_WINDOW", "1000"))
+ANOMALY_MIN_SCALE = float(os.getenv("ANOMALY_MIN_SCALE", "0.001"))
+ANOMALY_KEY_PREFIX = "station:"
+INGEST_INTERVAL_SECONDS = int(os.getenv("INGEST_INTERVAL_SECONDS", "0"))
+
+# --- Métricas ---
+API_REQUEST_SECONDS = Histogram("openaq_request_seconds", "Latencia de cada página pedida a la API de OpenAQ", ["sensor_id"])
+API_ROWS_FETCHED = Counter("openaq_rows_fetched_total", "Mediciones recibidas de la API de OpenAQ", ["sensor_id"])
+ROWS_INSERTED = Counter("ingest_rows_inserted_total", "Filas nuevas insertadas en fact_measurements", ["sensor_id"])
+CHUNK_FAILURES = Counter("ingest_chunk_failures_total", "Tramos que fallaron y quedan pendientes", ["sensor_id"])
+DB_INSERT_SECONDS = Histogram("ingest_db_insert_seconds", "Tiempo de inserción de un DataFrame (incluye agregados y commit)")
+LAST_RUN_TIMESTAMP = Gauge("ingest_last_run_timestamp_seconds", "Fin de la última ejecución (epoch)")
+LAST_RUN_ROWS = Gauge("ingest_last_run_rows_inserted", "Filas nuevas de la última ejecución")
+
 # --- Funciones ---
 
+class RateLimiter:
+    """
+    Token bucket compartido entre hilos para respetar la cuota de la API.
+    La ráfaga inicial (burst) se descuenta de la tasa de recarga, así en ninguna ventana
+    de 60 s se superan requests_per_minute peticiones.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        requests_per_minute = max(1, requests_per_minute)
+        self.capacity = max(1, min(burst, requests_per_minute // 2))
+        self.rate = max(1, requests_per_minute - self.capacity) / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Detiene a todos los hilos durante seconds y vacía el bucket (la API indicó cuota agotada)."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+
 def get_db_connection():
     """Establece conexión a la BD con reintentos."""
     for i in range(5):
@@ -47,92 +139,672 @@ def get_db_connection():
             time.sleep(5)
     return None
 
-def get_latest_timestamp(conn, station_id, parameter_id):
-    """Obtiene el timestamp más reciente para un sensor."""
+def get_latest_timestamps(conn, sensors):
+    """
+    Obtiene en una sola consulta el timestamp más reciente de cada (estación, parámetro).
+    Lee la tabla ingestion_watermarks; sólo los pares sin marca recurren a MAX(timestamp_utc),
+    que se resuelve con el índice único (station_id, parameter_id, timestamp_utc).
+    """
+    pairs = sorted({(station_id, parameter_id) for _, station_id, parameter_id in sensors})
+    if not pairs:
+        return {}
+    with conn.cursor() as cur:
+        rows = extras.execute_values(
+            cur,
+            """
+            SELECT s.station_id, s.parameter_id,
+                   COALESCE(w.last_timestamp_utc, (
+                       SELECT MAX(fm.timestamp_utc) FROM fact_measurements fm
+                       WHERE fm.station_id = s.station_id AND fm.parameter_id = s.parameter_id
+                   ))
+            FROM (VALUES %s) AS s(station_id, parameter_id)
+            LEFT JOIN ingestion_watermarks w
+                ON w.station_id = s.station_id AND w.parameter_id = s.parameter_id;
+            """,
+            pairs,
+            fetch=True,
+        )
+    conn.commit()
+    return {(station_id, parameter_id): latest_ts for station_id, parameter_id, latest_ts in rows}
+
+def get_time_ranges(df):
+    """Devuelve [(station_id, parameter_id, min_ts, max_ts)] de las filas del DataFrame."""
+    ranges = (
+        df.assign(timestamp_utc=pd.to_datetime(df['timestamp_utc'], utc=True))
+        .groupby(['station_id', 'parameter_id'])['timestamp_utc'].agg(['min', 'max'])
+    )
+    return [
+        (int(station_id), int(parameter_id), row['min'].to_pydatetime(), row['max'].to_pydatetime())
+        for (station_id, parameter_id), row in ranges.iterrows()
+    ]
+
+def update_watermarks(cur, ranges):
+    """
+    Avanza la marca de agua de cada (estación, parámetro) con el máximo de su rango.
+    Se ejecuta con el mismo cursor que la inserción para que ambas queden en la misma transacción.
+    """
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO ingestion_watermarks (station_id, parameter_id, last_timestamp_utc)
+        VALUES %s
+        ON CONFLICT (station_id, parameter_id) DO UPDATE SET
+            last_timestamp_utc = GREATEST(ingestion_watermarks.last_timestamp_utc, EXCLUDED.last_timestamp_utc),
+            updated_at = NOW();
+        """,
+        [(station_id, parameter_id, max_ts) for station_id, parameter_id, _, max_ts in ranges],
+    )
+
+def refresh_rollups(cur, ranges, rebuild=False):
+    """
+    Recalcula los buckets horarios y diarios que cubren cada rango recién insertado
+    desde fact_measurements, así que repetir la operación es idempotente.
+    El perfil día×hora acumula sólo las filas insertadas en la transacción actual (ver merge_profile);
+    con rebuild=True se recalculan completos los días que contienen cada rango.
+    """
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO agg_measurements_hourly
+            (station_id, parameter_id, bucket_start, sample_count, value_sum, value_sumsq, value_min, value_max)
+        SELECT fm.station_id, fm.parameter_id, date_trunc('hour', fm.timestamp_utc, 'UTC'),
+               COUNT(*), SUM(fm.value), SUM(fm.value * fm.value), MIN(fm.value), MAX(fm.value)
+        FROM (VALUES %s) AS r(station_id, parameter_id, range_start, range_end)
+        JOIN fact_measurements fm
+            ON fm.station_id = r.station_id AND fm.parameter_id = r.parameter_id
+            AND fm.timestamp_utc >= date_trunc('hour', r.range_start, 'UTC')
+            AND fm.timestamp_utc < date_trunc('hour', r.range_end, 'UTC') + INTERVAL '1 hour'
+        GROUP BY 1, 2, 3
+        ON CONFLICT (station_id, parameter_id, bucket_start) DO UPDATE SET
+            sample_count = EXCLUDED.sample_count, value_sum = EXCLUDED.value_sum, value_sumsq = EXCLUDED.value_sumsq,
+            value_min = EXCLUDED.value_min, value_max = EXCLUDED.value_max;
+        """,
+        ranges,
+    )
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO agg_measurements_daily
+            (station_id, parameter_id, bucket_start, sample_count, value_sum, value_sumsq, value_min, value_max)
+        SELECT h.station_id, h.parameter_id, date_trunc('day', h.bucket_start, 'UTC'),
+               SUM(h.sample_count), SUM(h.value_sum), SUM(h.value_sumsq), MIN(h.value_min), MAX(h.value_max)
+        FROM (VALUES %s) AS r(station_id, parameter_id, range_start, range_end)
+        JOIN agg_measurements_hourly h
+            ON h.station_id = r.station_id AND h.parameter_id = r.parameter_id
+            AND h.bucket_start >= date_trunc('day', r.range_start, 'UTC')
+            AND h.bucket_start < date_trunc('day', r.range_end, 'UTC') + INTERVAL '1 day'
+        GROUP BY 1, 2, 3
+        ON CONFLICT (station_id, parameter_id, bucket_start) DO UPDATE SET
+            sample_count = EXCLUDED.sample_count, value_sum = EXCLUDED.value_sum, value_sumsq = EXCLUDED.value_sumsq,
+            value_min = EXCLUDED.value_min, value_max = EXCLUDED.value_max;
+        """,
+        ranges,
+    )
+    if rebuild:
+        rebuild_profile(cur, ranges)
+    else:
+        merge_profile(cur, ranges)
+
+def rebuild_profile(cur, ranges):
+    """
+    Recalcula desde fact_measurements las celdas del perfil día×hora de los días que contienen cada rango.
+    Antes borra las celdas del rango desde el inicio de su mes: así también desaparecen las celdas mensuales
+    de versiones anteriores, que se sumarían a las diarias.
+    """
+    extras.execute_values(
+        cur,
+        """
+        DELETE FROM agg_profile_weekday_hour p
+        USING (VALUES %s) AS r(station_id, parameter_id, range_start, range_end)
+        WHERE p.station_id = r.station_id AND p.parameter_id = r.parameter_id
+            AND p.period_start >= date_trunc('month', r.range_start, 'UTC')
+            AND p.period_start < date_trunc('day', r.range_end, 'UTC') + INTERVAL '1 day';
+        """,
+        ranges,
+    )
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO agg_profile_weekday_hour
+            (station_id, parameter_id, period_start, day_of_week, hour_of_day,
+             sample_count, value_sum, value_sumsq, value_min, value_max, value_sketch)
+        SELECT c.station_id, c.parameter_id, c.period_start, c.day_of_week, c.hour_of_day,
+               SUM(c.n), SUM(c.s), SUM(c.ss), MIN(c.mn), MAX(c.mx), jsonb_object_agg(c.bin, c.n)
+        FROM (
+            SELECT fm.station_id, fm.parameter_id,
+                   date_trunc('day', fm.timestamp_utc, 'UTC') AS period_start,
+                   EXTRACT(ISODOW FROM fm.timestamp_utc AT TIME ZONE 'UTC')::SMALLINT AS day_of_week,
+                   EXTRACT(HOUR FROM fm.timestamp_utc AT TIME ZONE 'UTC')::SMALLINT AS hour_of_day,
+                   profile_sketch_bin(fm.value) AS bin,
+                   COUNT(*) AS n, SUM(fm.value) AS s, SUM(fm.value * fm.value) AS ss,
+                   MIN(fm.value) AS mn, MAX(fm.value) AS mx
+            FROM (VALUES %s) AS r(station_id, parameter_id, range_start, range_end)
+            JOIN fact_measurements fm
+                ON fm.station_id = r.station_id AND fm.parameter_id = r.parameter_id
+                AND fm.timestamp_utc >= date_trunc('day', r.range_start, 'UTC')
+                AND fm.timestamp_utc < date_trunc('day', r.range_end, 'UTC') + INTERVAL '1 day'
+            GROUP BY 1, 2, 3, 4, 5, 6
+        ) c
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (station_id, parameter_id, period_start, day_of_week, hour_of_day) DO UPDATE SET
+            sample_count = EXCLUDED.sample_count, value_sum = EXCLUDED.value_sum, value_sumsq = EXCLUDED.value_sumsq,
+            value_min = EXCLUDED.value_min, value_max = EXCLUDED.value_max, value_sketch = EXCLUDED.value_sketch;
+        """,
+        ranges,
+    )
+
+def merge_profile(cur, ranges):
+    """
+    Suma al perfil día×hora las filas de cada rango insertadas en la transacción actual
+    (ingested_at toma la hora de inicio de la transacción), sin volver a recorrer los días completos.
+    Debe ejecutarse una sola vez por transacción de inserción y con un rango por (estación, parámetro).
+    """
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO agg_profile_weekday_hour AS p
+            (station_id, parameter_id, period_start, day_of_week, hour_of_day,
+             sample_count, value_sum, value_sumsq, value_min, value_max, value_sketch)
+        SELECT c.station_id, c.parameter_id, c.period_start, c.day_of_week, c.hour_of_day,
+               SUM(c.n), SUM(c.s), SUM(c.ss), MIN(c.mn), MAX(c.mx), jsonb_object_agg(c.bin, c.n)
+        FROM (
+            SELECT fm.station_id, fm.parameter_id,
+                   date_trunc('day', fm.timestamp_utc, 'UTC') AS period_start,
+                   EXTRACT(ISODOW FROM fm.timestamp_utc AT TIME ZONE 'UTC')::SMALLINT AS day_of_week,
+                   EXTRACT(HOUR FROM fm.timestamp_utc AT TIME ZONE 'UTC')::SMALLINT AS hour_of_day,
+                   profile_sketch_bin(fm.value) AS bin,
+                   COUNT(*) AS n, SUM(fm.value) AS s, SUM(fm.value * fm.value) AS ss,
+                   MIN(fm.value) AS mn, MAX(fm.value) AS mx
+            FROM (VALUES %s) AS r(station_id, parameter_id, range_start, range_end)
+            JOIN fact_measurements fm
+                ON fm.station_id = r.station_id AND fm.parameter_id = r.parameter_id
+                AND fm.timestamp_utc >= r.range_start AND fm.timestamp_utc <= r.range_end
+                AND fm.ingested_at = CURRENT_TIMESTAMP
+            GROUP BY 1, 2, 3, 4, 5, 6
+        ) c
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (station_id, parameter_id, period_start, day_of_week, hour_of_day) DO UPDATE SET
+            sample_count = p.sample_count + EXCLUDED.sample_count,
+            value_sum = p.value_sum + EXCLUDED.value_sum,
+            value_sumsq = p.value_sumsq + EXCLUDED.value_sumsq,
+            value_min = LEAST(p.value_min, EXCLUDED.value_min),
+            value_max = GREATEST(p.value_max, EXCLUDED.value_max),
+            value_sketch = profile_sketch_merge(p.value_sketch, EXCLUDED.value_sketch);
+        """,
+        ranges,
+    )
+
+def rebuild_rollups(conn):
+    """Reconstruye las tablas de agregados a partir de todo fact_measurements."""
+    print("🧮 Reconstruyendo agregados horarios, diarios y perfil día×hora...")
     with conn.cursor() as cur:
         cur.execute(
-            "SELECT MAX(timestamp_utc) FROM fact_measurements WHERE station_id = %s AND parameter_id = %s;",
-            (station_id, parameter_id)
+            """
+            SELECT station_id, parameter_id, MIN(timestamp_utc), MAX(timestamp_utc)
+            FROM fact_measurements GROUP BY station_id, parameter_id;
+            """
         )
-        return cur.fetchone()[0]
+        ranges = cur.fetchall()
+        if ranges:
+            refresh_rollups(cur, ranges, rebuild=True)
+    conn.commit()
+    print(f"✅ Agregados reconstruidos para {len(ranges)} series.")
+
+def load_sensors(conn):
+    """
+    Devuelve la lista de sensores a ingerir como tuplas (sensor_id, station_id, parameter_id).
+    Se leen de dim_sensors; si la tabla no existe o está vacía se usa la configuración por defecto.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, station_id, parameter_id FROM dim_sensors WHERE active ORDER BY id;")
+            sensors = [tuple(row) for row in cur.fetchall()]
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"⚠️ No se pudo leer dim_sensors ({e}); usando la configuración por defecto.")
+        conn.rollback()
+        sensors = []
+    if not sensors:
+        sensors = [(sensor_id, LOCATION_ID, parameter_id) for sensor_id, parameter_id in SENSOR_PARAMETER_MAPPING.items()]
+    return sensors
+
+def get_pending_chunks(conn):
+    """Obtiene los tramos que quedaron sin completar en ejecuciones anteriores, por sensor."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT sensor_id, chunk_start, chunk_end FROM ingestion_checkpoints WHERE status = 'pending';")
+        pending = {}
+        for sensor_id, chunk_start, chunk_end in cur.fetchall():
+            pending.setdefault(sensor_id, []).append((chunk_start, chunk_end))
+    conn.commit()
+    return pending
+
+def plan_chunks(conn, sensors):
+    """
+    Divide el rango pendiente de cada sensor en tramos de BACKFILL_CHUNK_HOURS.
+    Incluye los tramos pendientes de ejecuciones anteriores para no dejar huecos.
+    """
+    now = datetime.now(timezone.utc)
+    chunk_size = timedelta(hours=BACKFILL_CHUNK_HOURS)
+    pending = get_pending_chunks(conn)
+    latest_by_pair = get_latest_timestamps(conn, sensors)
+    chunks = {}
+    for sensor in sensors:
+        sensor_id, station_id, parameter_id = sensor
+        for start, end in pending.get(sensor_id, []):
+            chunks[(sensor_id, start)] = (sensor, start, end)
+
+        latest_ts = latest_by_pair.get((station_id, parameter_id))
+        start = (latest_ts + timedelta(seconds=1)) if latest_ts else (now - timedelta(days=INITIAL_BACKFILL_DAYS))
+        while start < now:
+            end = min(start + chunk_size, now)
+            # Un tramo pendiente que empieza en el mismo instante se amplía en lugar de duplicarse
+            previous_end = chunks.get((sensor_id, start), (None, None, end))[2]
+            chunks[(sensor_id, start)] = (sensor, start, max(end, previous_end))
+            start = end
+    return list(chunks.values())
+
+def mark_chunks_pending(conn, chunks):
+    """Registra los tramos planificados como pendientes antes de descargarlos."""
+    if not chunks:
+        return
+    with conn.cursor() as cur:
+        extras.execute_values(
+            cur,
+            """
+            INSERT INTO ingestion_checkpoints (sensor_id, chunk_start, chunk_end, status)
+            VALUES %s
+            ON CONFLICT (sensor_id, chunk_start)
+            DO UPDATE SET chunk_end = GREATEST(ingestion_checkpoints.chunk_end, EXCLUDED.chunk_end), status = 'pending';
+            """,
+            [(sensor[0], start, end, 'pending') for sensor, start, end in chunks],
+        )
+    conn.commit()
+
+def mark_chunks_done(conn, done):
+    """Marca como completados los tramos [(sensor_id, chunk_start, filas_insertadas)] en una sola sentencia."""
+    if not done:
+        return
+    with conn.cursor() as cur:
+        extras.execute_values(
+            cur,
+            """
+            UPDATE ingestion_checkpoints AS c
+            SET status = 'done', rows_inserted = d.rows_inserted, completed_at = NOW()
+            FROM (VALUES %s) AS d (sensor_id, chunk_start, rows_inserted)
+            WHERE c.sensor_id = d.sensor_id AND c.chunk_start = d.chunk_start;
+            """,
+            done,
+            template="(%s::INT, %s::TIMESTAMPTZ, %s::INT)",
+        )
+    conn.commit()
+
+def purge_old_checkpoints(conn):
+    """Elimina los checkpoints completados más antiguos que CHECKPOINT_RETENTION_DAYS."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM ingestion_checkpoints WHERE status = 'done' AND completed_at < NOW() - %s * INTERVAL '1 day';",
+            (CHECKPOINT_RETENTION_DAYS,),
+        )
+    conn.commit()
+
+def ensure_partitions(conn, chunks):
+    """Crea las particiones mensuales que necesitan los tramos planificados y las de los próximos meses."""
+    from_ts = min((start for _, start, _ in chunks), default=datetime.now(timezone.utc))
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('fact_measurements');")
+        row = cur.fetchone()
+        if row is None or row[0] != 'p':
+            conn.rollback()
+            raise RuntimeError(
+                "fact_measurements no es una tabla particionada (base creada con el esquema anterior): "
+                "vuelve a ejecutar init.sql sobre la base de datos para migrarla."
+            )
+        cur.execute("SELECT ensure_measurement_partitions(%s, %s);", (from_ts, PARTITION_MONTHS_AHEAD))
+        created = cur.fetchone()[0]
+    conn.commit()
+    if created:
+        print(f"🧱 {created} particiones mensuales nuevas en fact_measurements.")
+
+def apply_retention(conn):
+    """Elimina las particiones más antiguas que MEASUREMENTS_RETENTION_MONTHS (los agregados se conservan)."""
+    if MEASUREMENTS_RETENTION_MONTHS <= 0:
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT drop_old_measurement_partitions(%s);", (MEASUREMENTS_RETENTION_MONTHS,))
+        dropped = cur.fetchone()[0]
+    conn.commit()
+    if dropped:
+        print(f"🗑️ {dropped} particiones antiguas eliminadas (retención de {MEASUREMENTS_RETENTION_MONTHS} meses).")
+
+def load_alert_thresholds(cur):
+    """Niveles de alerta por parámetro desde alert_thresholds: {parameter_id: [nivel, ...]}."""
+    cur.execute("SELECT parameter_id, threshold_value FROM alert_thresholds ORDER BY parameter_id, threshold_value;")
+    thresholds = {}
+    for parameter_id, value in cur.fetchall():
+        thresholds.setdefault(parameter_id, []).append(value)
+    return thresholds
+
+def detect_anomalies(conn, frames):
+    """
+    Pasa las mediciones insertadas en esta ejecución por el detector en streaming, en orden temporal por serie,
+    y guarda las alertas y el estado del detector en una sola transacción.
+    Las mediciones anteriores a la última ya vista por la serie (tramos repetidos o atrasados) se omiten.
+    """
+    if not frames:
+        return 0
+    df = pd.concat(frames, ignore_index=True)
+    df['timestamp_utc'] = pd.to_datetime(df['timestamp_utc'], utc=True)
+    df = df.sort_values('timestamp_utc', kind='stable')
+
+    detector = AnomalyDetector(z_threshold=ANOMALY_Z_THRESHOLD, iqr_fence=ANOMALY_IQR_FENCE,
+                               alpha=ANOMALY_EWMA_ALPHA, warmup=ANOMALY_WARMUP,
+                               quantile_window=ANOMALY_QUANTILE_WINDOW, min_scale=ANOMALY_MIN_SCALE)
+    alerts = []
+    with conn.cursor() as cur:
+        try:
+            load_detector_states(cur, detector, ANOMALY_KEY_PREFIX)
+            thresholds = load_alert_thresholds(cur)
+            for (station_id, parameter_id), group in df.groupby(['station_id', 'parameter_id'], sort=False):
+                series_key = f"{ANOMALY_KEY_PREFIX}{station_id}:parameter:{parameter_id}"
+                last_ts = detector.last_timestamp(series_key)
+                levels = thresholds.get(parameter_id, ())
+                for ts, value in zip(group['timestamp_utc'], group['value']):
+                    if last_ts is not None and ts <= last_ts:
+                        continue
+                    alerts.extend(detector.observe(series_key, float(value), ts, levels,
+                                                   station_id=int(station_id), parameter_id=int(parameter_id)))
+            write_alerts(cur, alerts, "ingestion")
+            save_detector_states(cur, detector)
+            conn.commit()
+            count_alerts(alerts, "ingestion")
+        except psycopg2.Error as e:
+            print(f"❌ Error de base de datos en la detección de anomalías: {e}")
+            conn.rollback()
+            return 0
+    if alerts:
+        print(f"🚨 {len(alerts)} alertas detectadas en las mediciones nuevas.")
+    return len(alerts)
+
+MEASUREMENT_KEY = ['station_id', 'parameter_id', 'timestamp_utc']
+
+def _inserted_keys(cur):
+    """Claves (estación, parámetro, timestamp) devueltas por el RETURNING de la inserción."""
+    keys = pd.DataFrame(cur.fetchall(), columns=MEASUREMENT_KEY)
+    keys['timestamp_utc'] = pd.to_datetime(keys['timestamp_utc'], utc=True)
+    return keys
 
 def insert_dataframe_to_db(conn, df):
-    """Inserta un DataFrame de mediciones en la base de datos."""
+    """
+    Inserta un DataFrame de mediciones en la base de datos.
+    Devuelve las claves de las filas nuevas (las duplicadas se omiten), o None si la inserción falló.
+    Las filas sin valor se descartan antes de insertar: value es NOT NULL y ambas rutas (execute_values y COPY)
+    deben tratar igual un valor ausente, con independencia del tamaño del lote.
+    """
+    missing = df['value'].isna()
+    if missing.any():
+        print(f"⚠️ {int(missing.sum())} mediciones sin valor descartadas.")
+        df = df[~missing]
+
     if df.empty:
         print("ℹ️ No hay nuevos datos que insertar.")
-        return 0
-    
+        return pd.DataFrame(columns=MEASUREMENT_KEY)
+
+    if len(df) >= BULK_COPY_THRESHOLD:
+        return bulk_insert_dataframe_to_db(conn, df)
+
     tuples = [tuple(x) for x in df.to_numpy()]
     cols = ','.join(list(df.columns))
-    insert_query = f"INSERT INTO fact_measurements ({cols}) VALUES %s ON CONFLICT (station_id, parameter_id, timestamp_utc) DO NOTHING;"
+    insert_query = (
+        f"INSERT INTO fact_measurements ({cols}) VALUES %s "
+        "ON CONFLICT (station_id, parameter_id, timestamp_utc) DO NOTHING "
+        "RETURNING station_id, parameter_id, timestamp_utc;"
+    )
     
     with conn.cursor() as cur:
         try:
-            extras.execute_values(cur, insert_query, tuples)
+            # Una sola página para que RETURNING devuelva todas las filas insertadas
+            extras.execute_values(cur, insert_query, tuples, page_size=len(tuples))
+            inserted = _inserted_keys(cur)
+            ranges = get_time_ranges(df)
+            update_watermarks(cur, ranges)
+            refresh_rollups(cur, ranges)
             conn.commit()
-            print(f"💾 {cur.rowcount} nuevos registros insertados.")
-            return cur.rowcount
+            print(f"💾 {len(inserted)} nuevos registros insertados.")
+            return inserted
         except psycopg2.Error as e:
             print(f"❌ Error de base de datos durante la inserción: {e}")
             conn.rollback()
-            return 0
+            return None
+
+def bulk_insert_dataframe_to_db(conn, df):
+    """
+    Carga masiva: envía el DataFrame con COPY FROM STDIN a una tabla temporal
+    y la vuelca a fact_measurements con un único INSERT ... SELECT.
+    """
+    cols = ','.join(list(df.columns))
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    with conn.cursor() as cur:
+        try:
+            cur.execute(
+                "CREATE TEMP TABLE staging_measurements ("
+                "station_id INT, parameter_id INT, value FLOAT, timestamp_utc TIMESTAMPTZ"
+                ") ON COMMIT DROP;"
+            )
+            cur.copy_expert(f"COPY staging_measurements ({cols}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cur.execute(
+                f"INSERT INTO fact_measurements ({cols}) "
+                f"SELECT {cols} FROM staging_measurements "
+                "ON CONFLICT (station_id, parameter_id, timestamp_utc) DO NOTHING "
+                "RETURNING station_id, parameter_id, timestamp_utc;"
+            )
+            inserted = _inserted_keys(cur)
+            ranges = get_time_ranges(df)
+            update_watermarks(cur, ranges)
+            refresh_rollups(cur, ranges)
+            conn.commit()
+            print(f"💾 {len(inserted)} nuevos registros insertados (COPY de {len(df)} filas).")
+            return inserted
+        except psycopg2.Error as e:
+            print(f"❌ Error de base de datos durante la carga masiva: {e}")
+            conn.rollback()
+            return None
+
+def insert_chunk_batch(conn, batch):
+    """
+    Inserta juntos los tramos descargados [(sensor, inicio, fin, DataFrame)] y los marca como completados.
+    Con lotes de INSERT_BATCH_ROWS filas la carga pasa por COPY y las marcas de agua y los agregados
+    se actualizan una vez por lote en lugar de una vez por tramo.
+    Devuelve las filas nuevas (con el índice de su tramo en la columna chunk), o None si la inserción falló.
+    """
+    frames = [df.assign(chunk=i) for i, (_, _, _, df) in enumerate(batch) if not df.empty]
+    if frames:
+        rows = pd.concat(frames, ignore_index=True)
+        rows['timestamp_utc'] = pd.to_datetime(rows['timestamp_utc'], utc=True)
+        # Los bordes de tramos contiguos pueden repetir una medición: se atribuye al primer tramo
+        rows = rows.drop_duplicates(subset=MEASUREMENT_KEY)
+        with DB_INSERT_SECONDS.time():
+            keys = insert_dataframe_to_db(conn, rows.drop(columns='chunk'))
+        if keys is None:
+            return None
+        new_rows = rows.merge(keys, on=MEASUREMENT_KEY)
+    else:
+        new_rows = pd.DataFrame(columns=['station_id', 'parameter_id', 'value', 'timestamp_utc', 'chunk'])
+
+    per_chunk = new_rows['chunk'].value_counts()
+    done = []
+    for i, ((sensor_id, _, _), start, _, _) in enumerate(batch):
+        inserted = int(per_chunk.get(i, 0))
+        ROWS_INSERTED.labels(sensor_id).inc(inserted)
+        done.append((sensor_id, start, inserted))
+    mark_chunks_done(conn, done)
+    return new_rows
+
+def fetch_sensor_measurements(api, rate_limiter, sensor, date_from, date_to):
+    """
+    Descarga todas las mediciones de un sensor entre date_from y date_to,
+    recorriendo todas las páginas de la API, y las devuelve como DataFrame.
+    """
+    sensor_id, station_id, parameter_id = sensor
+    rows = []
+    page = 1
+    attempt = 0
+    while True:
+        rate_limiter.acquire()
+        try:
+            with API_REQUEST_SECONDS.labels(sensor_id).time():
+                resp = api.measurements.list(
+                    sensors_id=sensor_id,
+                    datetime_from=date_from,
+                    datetime_to=date_to,
+                    page=page,
+                    limit=API_PAGE_LIMIT
+                )
+        except (openaq.RateLimitError, openaq.HTTPRateLimitError) as e:
+            # Cuota agotada: se pausa el limitador compartido y se reintenta la misma página
+            if attempt >= OPENAQ_RATE_LIMIT_RETRIES:
+                raise
+            wait = min(OPENAQ_BACKOFF_MAX_SECONDS, 2 ** attempt * 5)
+            attempt += 1
+            print(f"⏳ Límite de la API alcanzado (sensor {sensor_id}), reintento {attempt}/{OPENAQ_RATE_LIMIT_RETRIES} en {wait:.0f}s: {e}")
+            rate_limiter.pause(wait)
+            continue
+        attempt = 0
+        API_ROWS_FETCHED.labels(sensor_id).inc(len(resp.results))
+        for r in resp.results:
+            # CORRECCIÓN FINAL: Acceder al timestamp correctamente desde r.period.datetime_from.utc
+            rows.append({
+                'timestamp_utc': r.period.datetime_from.utc,
+                'value': r.value,
+            })
+        if len(resp.results) < API_PAGE_LIMIT:
+            break
+        page += 1
+
+    df = pd.DataFrame(rows, columns=['timestamp_utc', 'value'])
+    df['station_id'] = station_id
+    df['parameter_id'] = parameter_id
+    return df[['station_id', 'parameter_id', 'value', 'timestamp_utc']]
 
 # --- Lógica Principal ---
 
-def main():
-    """Orquesta la ingesta de datos usando la librería oficial openaq."""
+def run_ingestion():
+    """
+    Orquesta una ejecución de la ingesta de datos usando la librería oficial openaq.
+    Devuelve False si no se pudo conectar a la base de datos.
+    """
     print("🚀 Iniciando proceso de ingesta de datos con la librería oficial de OpenAQ...")
+    print(f"⚙️ Peticiones concurrentes: {MAX_CONCURRENT_REQUESTS}, límite: {OPENAQ_REQUESTS_PER_MINUTE}/min")
     conn = get_db_connection()
     if not conn:
-        sys.exit(1)
+        return False
 
     total_inserted = 0
+    # DataFrames insertados con éxito, para la detección de anomalías al final de la ejecución
+    inserted_frames = []
     try:
-        with openaq.OpenAQ(api_key=OPENAQ_API_KEY) as api:
-            for sensor_id, parameter_id in SENSOR_PARAMETER_MAPPING.items():
-                print(f"\n--- Procesando Sensor ID: {sensor_id} (Parámetro: {parameter_id}) ---")
-                
-                latest_ts = get_latest_timestamp(conn, LOCATION_ID, parameter_id)
-                date_from = (latest_ts + timedelta(seconds=1)) if latest_ts else (datetime.now(timezone.utc) - timedelta(days=7))
+        # Las consultas a la BD se hacen en el hilo principal; sólo las llamadas a la API van en paralelo
+        sensors = load_sensors(conn)
+        chunks = plan_chunks(conn, sensors)
+        mark_chunks_pending(conn, chunks)
+        ensure_partitions(conn, chunks)
+        print(f"🗂️ {len(sensors)} sensores, {len(chunks)} tramos de hasta {BACKFILL_CHUNK_HOURS}h por descargar.")
 
-                try:
-                    print(f"📡 Consultando API para sensor {sensor_id} desde {date_from.strftime('%Y-%m-%d')}...")
-                    
-                    resp = api.measurements.list(
-                        sensors_id=sensor_id,
-                        datetime_from=date_from,
-                        limit=1000
-                    )
-                    
-                    if not resp.results:
-                        print("✅ No se encontraron nuevos registros en la API.")
-                        continue
+        rate_limiter = RateLimiter(OPENAQ_REQUESTS_PER_MINUTE, burst=MAX_CONCURRENT_REQUESTS)
+        with openaq.OpenAQ(api_key=OPENAQ_API_KEY) as api, \
+                ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            futures = {
+                executor.submit(fetch_sensor_measurements, api, rate_limiter, sensor, start, end): (sensor, start, end)
+                for sensor, start, end in chunks
+            }
 
-                    rows = []
-                    for r in resp.results:
-                        # CORRECCIÓN FINAL: Acceder al timestamp correctamente desde r.period.datetime_from.utc
-                        rows.append({
-                            'timestamp_utc': r.period.datetime_from.utc,
-                            'value': r.value,
-                        })
-                    
-                    df = pd.DataFrame(rows)
-                    df['station_id'] = LOCATION_ID
-                    df['parameter_id'] = parameter_id
-                    
-                    df_to_insert = df[['station_id', 'parameter_id', 'value', 'timestamp_utc']]
-
-                    total_inserted += insert_dataframe_to_db(conn, df_to_insert)
+            # Tramos descargados pendientes de insertar y su número de filas
+            batch, batch_rows = [], 0
 
+            def flush():
+                nonlocal total_inserted, batch_rows
+                new_rows = insert_chunk_batch(conn, batch)
+                if new_rows is None:
+                    # Los tramos del lote quedan pendientes y se reintentan en la próxima ejecución
+                    for (sensor_id, _, _), _, _, _ in batch:
+                        CHUNK_FAILURES.labels(sensor_id).inc()
+                elif not new_rows.empty:
+                    total_inserted += len(new_rows)
+                    inserted_frames.append(new_rows.drop(columns='chunk'))
+                batch.clear()
+                batch_rows = 0
+
+            for future in as_completed(futures):
+                sensor, start, end = futures[future]
+                sensor_id, station_id, parameter_id = sensor
+                print(f"\n--- Sensor ID: {sensor_id} (Estación: {station_id}, Parámetro: {parameter_id}) "
+                      f"{start.strftime('%Y-%m-%d %H:%M')} → {end.strftime('%Y-%m-%d %H:%M')} ---")
+                try:
+                    df_fetched = future.result()
                 except Exception as e:
+                    CHUNK_FAILURES.labels(sensor_id).inc()
                     print(f"❌ Ocurrió un error procesando el sensor {sensor_id}: {e}")
+                    continue
+                if df_fetched.empty:
+                    print("✅ No se encontraron nuevos registros en la API.")
+                else:
+                    print(f"📥 {len(df_fetched)} registros descargados.")
+                batch.append((sensor, start, end, df_fetched))
+                batch_rows += len(df_fetched)
+                if batch_rows >= INSERT_BATCH_ROWS:
+                    flush()
+            if batch:
+                flush()
+
+        if ANOMALY_DETECTION:
+            detect_anomalies(conn, inserted_frames)
+        purge_old_checkpoints(conn)
+        apply_retention(conn)
 
     finally:
         if conn:
             conn.close()
             print("\n🔌 Conexión a la base de datos cerrada.")
 
+    LAST_RUN_TIMESTAMP.set(time.time())
+    LAST_RUN_ROWS.set(total_inserted)
     print(f"\n✨ Proceso de ingesta finalizado. Total de registros nuevos: {total_inserted}")
+    return True
+
+def main():
+    """Punto de entrada: una ejecución, un bucle cada INGEST_INTERVAL_SECONDS o --rebuild-rollups."""
+    if "--rebuild-rollups" in sys.argv:
+        conn = get_db_connection()
+        if not conn:
+            sys.exit(1)
+        try:
+            rebuild_rollups(conn)
+        finally:
+            conn.close()
+        return
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    if INGEST_INTERVAL_SECONDS <= 0:
+        if not run_ingestion():
+            sys.exit(1)
+        return
+
+    # En bucle el proceso sigue vivo entre ejecuciones, así /metrics conserva los acumulados.
+    # Un fallo (API de OpenAQ, reinicio de Postgres, ...) sólo pierde esa ejecución: los tramos quedan pendientes
+    while True:
+        try:
+            if run_ingestion():
+                print(f"⏳ Ingesta completada, esperando {INGEST_INTERVAL_SECONDS}s para la próxima ejecución.")
+            else:
+                print(f"⚠️ Ingesta sin conexión a la base de datos, se reintenta en {INGEST_INTERVAL_SECONDS}s.")
+        except Exception:
+            traceback.print_exc()
+            print(f"❌ La ejecución de la ingesta falló, se reintenta en {INGEST_INTERVAL_SECONDS}s.")
+        time.sleep(INGEST_INTERVAL_SECONDS)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
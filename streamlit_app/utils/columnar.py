@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# Cabecera del formato binario de COPY: firma de 11 bytes, flags (int32) y longitud de la extensión (int32)
+PGCOPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# Postgres cuenta los timestamps en microsegundos desde 2000-01-01 UTC
+PG_EPOCH_OFFSET_US = 946684800 * 1_000_000
+
+NS_PER_HOUR = 3_600 * 1_000_000_000
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# Tipos de ancho fijo soportados: tipo de Postgres -> dtype big-endian del valor en el stream
+PG_BINARY_TYPES = {
+    "int2": ">i2",
+    "int4": ">i4",
+    "int8": ">i8",
+    "float4": ">f4",
+    "float8": ">f8",
+    "timestamptz": ">i8",
+}
+
+
+def read_copy_binary(data, fields):
+    """
+    Decodifica la salida de COPY ... TO STDOUT WITH (FORMAT binary) directamente a arrays de NumPy.
+    fields es una lista de (nombre, tipo_pg) en el orden del SELECT; sólo se admiten tipos de ancho fijo
+    y columnas sin NULL, de modo que cada fila ocupa los mismos bytes y todo el buffer se lee con un
+    único np.frombuffer (sin objetos Python por celda). Devuelve {nombre: array}; los timestamptz
+    se devuelven como datetime64[ns] en UTC.
+    """
+    if not data.startswith(PGCOPY_SIGNATURE):
+        raise ValueError("La salida no está en el formato binario de COPY")
+    header_len = len(PGCOPY_SIGNATURE) + 8 + int.from_bytes(data[15:19], "big")
+    # El stream termina con un contador de campos -1 (2 bytes)
+    body = memoryview(data)[header_len:len(data) - 2]
+
+    dtype = [("field_count", ">i2")]
+    for name, pg_type in fields:
+        dtype += [(f"{name}__len", ">i4"), (name, PG_BINARY_TYPES[pg_type])]
+    dtype = np.dtype(dtype)
+    if len(body) % dtype.itemsize:
+        raise ValueError("Filas de ancho variable en COPY binario (¿columnas NULL o de tipo no soportado?)")
+
+    records = np.frombuffer(body, dtype=dtype)
+    if len(records) and (records["field_count"] != len(fields)).any():
+        raise ValueError("Número de columnas inesperado en COPY binario")
+
+    columns = {}
+    for name, pg_type in fields:
+        values = records[name]
+        if pg_type == "timestamptz":
+            values = ((values.astype(np.int64) + PG_EPOCH_OFFSET_US) * 1000).view("datetime64[ns]")
+        else:
+            values = values.astype(values.dtype.newbyteorder("="))
+        columns[name] = values
+    return columns
+
+
+def add_time_parts(df, ts_col="timestamp_utc"):
+    """
+    Añade day_of_week (ISO, 1=Lunes … 7=Domingo), hour_of_day (ambos int8) y date_only a partir de una
+    columna datetime64 en UTC, con aritmética entera sobre los nanosegundos (equivale a
+    EXTRACT(ISODOW/HOUR ...) y ::date en Postgres con zona horaria UTC).
+    """
+    ns = df[ts_col].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    days = ns // NS_PER_DAY
+    # 1970-01-01 fue jueves (ISODOW 4)
+    day_of_week = ((days + 3) % 7 + 1).astype(np.int8)
+    hour_of_day = ((ns // NS_PER_HOUR) % 24).astype(np.int8)
+    date_only = pd.to_datetime((days * NS_PER_DAY).view("datetime64[ns]"), utc=True)
+    return df.assign(day_of_week=day_of_week, hour_of_day=hour_of_day, date_only=date_only)
+
+
+def pivot_to_grid(timestamps, column_idx, values, grid, n_columns):
+    """
+    Coloca observaciones en formato largo (timestamp, índice de columna, valor) en una matriz ancha
+    float32 de len(grid) × n_columns, con NaN donde no hay dato. grid es un array datetime64[ns] con
+    paso regular; la fila de cada observación se calcula con aritmética entera sobre los nanosegundos
+    y todas las celdas se asignan con una sola indexación vectorizada (sin pivot_table ni groupby).
+    """
+    matrix = np.full((len(grid), n_columns), np.nan, dtype=np.float32)
+    if not len(grid) or not len(values):
+        return matrix
+    grid_ns = np.asarray(grid, dtype="datetime64[ns]").view(np.int64)
+    step_ns = grid_ns[1] - grid_ns[0] if len(grid_ns) > 1 else 1
+    rows = (np.asarray(timestamps, dtype="datetime64[ns]").view(np.int64) - grid_ns[0]) // step_ns
+    valid = (rows >= 0) & (rows < len(grid)) & (column_idx >= 0) & (column_idx < n_columns)
+    matrix[rows[valid], column_idx[valid]] = values[valid]
+    return matrix
@@ -1,44 +1,276 @@
+import io
 import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool
 import pandas as pd
 from dotenv import load_dotenv
 import streamlit as st
 from datetime import datetime
 
+from utils.columnar import add_time_parts, pivot_to_grid, read_copy_binary
+from utils.range_cache import RangeCache, to_utc
+from utils.sql_explorer import normalize_explorer_query
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+# Tamaño del pool compartido por todas las sesiones y tiempo máximo de espera por una conexión.
+# Con DB_POOL_MIN=0 las conexiones se abren a demanda: el pool se crea aunque Postgres no esté disponible
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "0"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Las conexiones inactivas más de este tiempo se verifican con SELECT 1 antes de usarse
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
+# Límite por defecto de cada consulta (ms)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+# Explorador SQL: tiempo máximo por consulta, filas máximas navegables y filas por página
+SQL_EXPLORER_TIMEOUT_MS = int(os.getenv("SQL_EXPLORER_TIMEOUT_MS", "10000"))
+SQL_EXPLORER_MAX_ROWS = int(os.getenv("SQL_EXPLORER_MAX_ROWS", "10000"))
+SQL_EXPLORER_PAGE_SIZE = int(os.getenv("SQL_EXPLORER_PAGE_SIZE", "500"))
+# Caché de mediciones por (estación, parámetro, día): memoria máxima, cada cuánto se completan los días
+# recientes y cuántas horas tras el fin de un día se lo considera cerrado (llegan datos con retraso)
+MEASUREMENT_CACHE_MAX_MB = float(os.getenv("MEASUREMENT_CACHE_MAX_MB", "256"))
+MEASUREMENT_CACHE_REFRESH_SECONDS = float(os.getenv("MEASUREMENT_CACHE_REFRESH_SECONDS", "60"))
+MEASUREMENT_CACHE_SETTLE_HOURS = float(os.getenv("MEASUREMENT_CACHE_SETTLE_HOURS", "6"))
+# Los días cerrados también caducan tras este tiempo (red de seguridad además de la detección por ingested_at)
+MEASUREMENT_CACHE_COMPLETE_TTL_SECONDS = float(os.getenv("MEASUREMENT_CACHE_COMPLETE_TTL_SECONDS", "3600"))
+# A partir de este número de días los datos se leen de los agregados diarios/horarios
+ROLLUP_MIN_DAYS = int(os.getenv("ROLLUP_MIN_DAYS", "14"))
+
+
+class DatabasePool:
+    """
+    Pool de conexiones acotado y seguro entre hilos.
+    Bloquea (hasta DB_POOL_TIMEOUT) cuando todas las conexiones están en uso,
+    descarta las conexiones rotas y deja cada conexión limpia al devolverla.
+    Las conexiones libres se conservan (hasta maxconn) y minconn se abren al crear el pool.
+    Cuando una conexión resulta estar rota (p. ej. tras reiniciar Postgres) se cierran también todas
+    las libres, que se abrieron antes del fallo: la siguiente petición usa una conexión nueva.
+    """
+
+    def __init__(self, minconn, maxconn, **conn_params):
+        self._conn_params = conn_params
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # Última conexión rota detectada: las devueltas antes de esa hora se verifican siempre
+        self._failed_at = 0.0
+        # Conexiones libres con la hora (monotónica) en que se devolvieron
+        self._idle = [(self._connect(), time.monotonic()) for _ in range(minconn)]
+
+    def _connect(self):
+        return psycopg2.connect(**self._conn_params)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise pool.PoolError(f"No hay conexiones libres tras {DB_POOL_TIMEOUT}s")
+        try:
+            while True:
+                with self._lock:
+                    conn, last_used = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    return self._connect()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken=False):
+        try:
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        """Cierra una conexión rota y todas las libres: si una se perdió, las anteriores al fallo también."""
+        with self._lock:
+            self._failed_at = time.monotonic()
+            stale, self._idle = self._idle, []
+        for c in [conn] + [c for c, _ in stale]:
+            try:
+                c.close()
+            except psycopg2.Error:
+                pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if last_used > self._failed_at and time.monotonic() - last_used < DB_POOL_PING_AFTER:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
 @st.cache_resource
-def get_db_connection():
+def get_db_pool():
+    """
+    Crea y cachea el pool de conexiones compartido por todas las sesiones.
+    Si falla (DB_POOL_MIN > 0 con Postgres caído) la excepción se propaga: st.cache_resource
+    no cachea excepciones, así que la próxima ejecución vuelve a intentarlo.
+    """
+    return DatabasePool(
+        DB_POOL_MIN,
+        DB_POOL_MAX,
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+        user=os.getenv("DB_USER", "user"),
+        password=os.getenv("DB_PASSWORD", "password"),
+        dbname=os.getenv("DB_NAME", "sensordata"),
+        connect_timeout=5,
+        options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+    )
+
+@contextmanager
+def db_connection():
     """
-    Obtiene y cachea una conexión a la base de datos PostgreSQL.
+    Toma una conexión del pool y la devuelve al terminar.
+    Si la conexión se rompe durante su uso se descarta en lugar de volver al pool.
     """
+    db_pool = get_db_pool()
+    conn = db_pool.getconn()
+    broken = False
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432"),
-            user=os.getenv("DB_USER", "user"),
-            password=os.getenv("DB_PASSWORD", "password"),
-            dbname=os.getenv("DB_NAME", "sensordata"),
-            connect_timeout=5
-        )
-        return conn
-    except Exception as e:
-        st.error(f"❌ Error conectando a la base de datos: {e}")
-        return None
+        yield conn
+    except psycopg2.extensions.QueryCanceledError:
+        # statement_timeout: la conexión sigue siendo válida
+        raise
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, broken=broken)
+
+# OID de timestamptz: esas columnas se devuelven en UTC, como hacía pd.read_sql_query
+TIMESTAMPTZ_OID = 1184
 
-def query_data(query, params=None):
+def query_data(query, params=None, timeout_ms=None):
     """
     Función genérica para ejecutar consultas y devolver un DataFrame.
+    timeout_ms sustituye el statement_timeout por defecto sólo para esta consulta.
+    Reintenta una vez con una conexión nueva si la actual se perdió (p. ej. tras reiniciar Postgres).
+    La consulta se ejecuta con un cursor de psycopg2 y no con pd.read_sql_query: antes de pandas 3 éste
+    envuelve cualquier error en pandas.errors.DatabaseError, y entonces ni el reintento ni db_connection()
+    reconocerían una conexión perdida.
     """
-    conn = get_db_connection()
-    if conn is None:
-        return pd.DataFrame()
-    try:
-        return pd.read_sql_query(query, conn, params=params)
-    except Exception as e:
-        st.error(f"❌ Error ejecutando consulta SQL: {e}")
-        return pd.DataFrame()
+    for attempt in range(2):
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    if timeout_ms is not None:
+                        cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+                    cur.execute(query, params)
+                    rows = cur.fetchall()
+                    description = cur.description
+            df = pd.DataFrame.from_records(rows, columns=[col.name for col in description], coerce_float=True)
+            for col in description:
+                if col.type_code == TIMESTAMPTZ_OID:
+                    df[col.name] = pd.to_datetime(df[col.name], utc=True)
+            return df
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == 0 and not isinstance(e, psycopg2.extensions.QueryCanceledError):
+                continue
+            st.error(f"❌ Error ejecutando consulta SQL: {e}")
+            return pd.DataFrame()
+        except Exception as e:
+            st.error(f"❌ Error ejecutando consulta SQL: {e}")
+            return pd.DataFrame()
+
+def query_columnar(query, params, fields):
+    """
+    Ejecuta la consulta como COPY (...) TO STDOUT en formato binario y la decodifica con NumPy
+    (ver utils/columnar.py), sin pasar por un objeto Python por celda como query_data.
+    fields describe las columnas del SELECT: [(nombre, tipo_pg), ...], de ancho fijo y sin NULL.
+    Devuelve {nombre: array}, o None si la consulta falló. Reintenta una vez si la conexión se perdió.
+    """
+    for attempt in range(2):
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    # COPY no admite parámetros del servidor: se enlazan del lado del cliente
+                    sql = cur.mogrify(query, params).decode("utf-8")
+                    buffer = io.BytesIO()
+                    cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", buffer)
+            return read_copy_binary(buffer.getvalue(), fields)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == 0 and not isinstance(e, psycopg2.extensions.QueryCanceledError):
+                continue
+            st.error(f"❌ Error ejecutando consulta SQL: {e}")
+            return None
+        except Exception as e:
+            st.error(f"❌ Error ejecutando consulta SQL: {e}")
+            return None
+
+def run_explorer_query(query, page=0, page_size=SQL_EXPLORER_PAGE_SIZE,
+                       max_rows=SQL_EXPLORER_MAX_ROWS, timeout_ms=SQL_EXPLORER_TIMEOUT_MS):
+    """
+    Ejecuta una consulta del Explorador SQL de forma acotada y devuelve una página de resultados.
+    - Transacción READ ONLY con statement_timeout propio: Postgres rechaza cualquier escritura.
+    - Cursor con nombre (del lado del servidor): sólo viajan al cliente las filas de la página,
+      el resto se salta con MOVE; nunca se navega más allá de max_rows.
+    Devuelve un dict con df, has_more, duration_s, bytes (tamaño del resultado en memoria) y row_offset.
+    Los errores de Postgres (timeout, escritura en sólo lectura, sintaxis) se propagan al llamador.
+    """
+    query = normalize_explorer_query(query)
+    offset = page * page_size
+    if offset >= max_rows:
+        raise ValueError(f"Se alcanzó el límite de {max_rows} filas navegables.")
+    limit = min(page_size, max_rows - offset)
+
+    started = time.perf_counter()
+    # La transacción se descarta (rollback) al devolver la conexión al pool
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # Debe ser la primera sentencia de la transacción
+            cur.execute("SET TRANSACTION READ ONLY;")
+            cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+        with conn.cursor(name="sql_explorer") as cur:
+            cur.execute(query)
+            if offset:
+                cur.scroll(offset, mode="relative")
+            # Una fila extra indica si existe una página siguiente
+            rows = cur.fetchmany(limit + 1)
+            columns = [col.name for col in cur.description] if cur.description else []
+    duration_s = time.perf_counter() - started
+
+    has_more = len(rows) > limit and offset + limit < max_rows
+    df = pd.DataFrame(rows[:limit], columns=columns).infer_objects()
+    return {
+        "df": df,
+        "has_more": has_more,
+        "duration_s": duration_s,
+        "bytes": int(df.memory_usage(deep=True).sum()),
+        "row_offset": offset,
+    }
+
+def explain_explorer_query(query, timeout_ms=SQL_EXPLORER_TIMEOUT_MS):
+    """
+    Plan de ejecución (EXPLAIN sin ANALYZE: la consulta no se ejecuta) en la misma transacción de sólo lectura.
+    """
+    query = normalize_explorer_query(query)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY;")
+            cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+            cur.execute("EXPLAIN " + query)
+            return "\n".join(row[0] for row in cur.fetchall())
 
 # --- Funciones para el Dashboard ---
 
@@ -49,6 +281,17 @@ def get_station_info(station_id=17):
     df = query_data(query, (station_id,))
     return df.iloc[0] if not df.empty else None
 
+@st.cache_data(ttl=3600)
+def get_stations():
+    """Estaciones con sensores registrados, para el modo de comparación."""
+    query = """
+    SELECT s.id, s.name, s.city, s.country_code
+    FROM dim_stations s
+    WHERE EXISTS (SELECT 1 FROM dim_sensors se WHERE se.station_id = s.id)
+    ORDER BY s.name;
+    """
+    return query_data(query)
+
 @st.cache_data(ttl=3600)
 def get_available_parameters():
     """Obtiene los parámetros (contaminantes) con datos disponibles."""
@@ -61,47 +304,280 @@ def get_available_parameters():
     """
     return query_data(query)
 
-@st.cache_data(ttl=60)
-def get_summary_stats(parameter_id, start_date, end_date, station_id=17):
-    """Calcula estadísticas y obtiene el último valor para un parámetro y rango de fechas."""
+def uses_rollups(start_date, end_date):
+    """Indica si el rango es lo bastante largo para leer de los agregados en lugar de las filas crudas."""
+    return (end_date - start_date).days >= ROLLUP_MIN_DAYS
+
+def _fetch_measurement_rows(station_id, parameter_id, lower, upper):
+    """
+    Filas de un tramo para la caché de mediciones (lower <= timestamp_utc < upper).
+    Sólo viajan value y timestamp_utc por COPY binario; value se guarda como float32.
+    Devuelve None si la consulta falló.
+    """
     query = """
-    SELECT 
-        COUNT(fm.value) as total_records,
-        AVG(fm.value) as average_value,
-        MIN(fm.value) as min_value,
-        MAX(fm.value) as max_value,
-        (SELECT value FROM fact_measurements 
-         WHERE station_id = %(station_id)s AND parameter_id = %(parameter_id)s 
-         ORDER BY timestamp_utc DESC LIMIT 1) as latest_value
+    SELECT fm.value::float8, fm.timestamp_utc
     FROM fact_measurements fm
     WHERE 
         fm.station_id = %(station_id)s AND
         fm.parameter_id = %(parameter_id)s AND
-        fm.timestamp_utc BETWEEN %(start_date)s AND %(end_date)s;
+        fm.timestamp_utc >= %(lower)s AND
+        fm.timestamp_utc < %(upper)s
+    ORDER BY fm.timestamp_utc ASC
+    """
+    params = {"station_id": station_id, "parameter_id": parameter_id,
+              "lower": lower.to_pydatetime(), "upper": upper.to_pydatetime()}
+    columns = query_columnar(query, params, [("value", "float8"), ("timestamp_utc", "timestamptz")])
+    if columns is None:
+        return None
+    return pd.DataFrame({
+        "value": columns["value"].astype("float32"),
+        "timestamp_utc": pd.to_datetime(columns["timestamp_utc"], utc=True),
+    })
+
+def _fetch_changed_days(station_id, parameter_id, since, lower, upper):
+    """
+    Días UTC de [lower, upper) con filas ingeridas (ingested_at) después de since, con el primer
+    timestamp_utc de esas filas en cada día, y la hora actual del servidor; since=None devuelve sólo
+    la hora. Recorre por índice las filas del rango sin transferirlas.
+    Devuelve (hora, {día: primer_timestamp}) o None si la consulta falló.
+    """
+    query = """
+    SELECT NOW(),
+           COALESCE(array_agg(c.day ORDER BY c.day), '{}'),
+           COALESCE(array_agg(c.first_ts ORDER BY c.day), '{}')
+    FROM (
+        SELECT date_trunc('day', fm.timestamp_utc, 'UTC') AS day, MIN(fm.timestamp_utc) AS first_ts
+        FROM fact_measurements fm
+        WHERE
+            %(since)s::timestamptz IS NOT NULL AND
+            fm.station_id = %(station_id)s AND
+            fm.parameter_id = %(parameter_id)s AND
+            fm.timestamp_utc >= %(lower)s AND
+            fm.timestamp_utc < %(upper)s AND
+            fm.ingested_at > %(since)s::timestamptz
+        GROUP BY 1
+    ) c;
+    """
+    params = {"station_id": station_id, "parameter_id": parameter_id,
+              "since": since.to_pydatetime() if since is not None else None,
+              "lower": lower.to_pydatetime(), "upper": upper.to_pydatetime()}
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                server_now, days, first_ts = cur.fetchone()
+        return pd.Timestamp(server_now), dict(zip(days, first_ts))
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_measurement_cache():
+    """
+    Caché de mediciones compartida por todas las sesiones (ver utils/range_cache.py).
+    """
+    return RangeCache(
+        _fetch_measurement_rows,
+        max_bytes=int(MEASUREMENT_CACHE_MAX_MB * 1024 * 1024),
+        refresh_seconds=MEASUREMENT_CACHE_REFRESH_SECONDS,
+        settle=pd.Timedelta(hours=MEASUREMENT_CACHE_SETTLE_HOURS),
+        changed_days=_fetch_changed_days,
+        complete_ttl=MEASUREMENT_CACHE_COMPLETE_TTL_SECONDS,
+    )
+
+def get_latest_value(parameter_id, station_id=17):
+    """Último valor registrado (consulta indexada de una fila, sin caché para que siempre esté al día)."""
+    query = """
+    SELECT value FROM fact_measurements
+    WHERE station_id = %(station_id)s AND parameter_id = %(parameter_id)s
+    ORDER BY timestamp_utc DESC LIMIT 1;
+    """
+    df = query_data(query, {"station_id": station_id, "parameter_id": parameter_id})
+    return df.iloc[0]["value"] if not df.empty else None
+
+def get_summary_stats(parameter_id, start_date, end_date, station_id=17, refresh=False):
+    """
+    Calcula estadísticas y obtiene el último valor para un parámetro y rango de fechas.
+    En rangos largos se calculan sobre agg_measurements_daily (días completos en UTC);
+    en rangos cortos sobre las filas de la caché de mediciones.
+    refresh=True revalida en el momento los días cacheados del rango antes de calcular.
+    """
+    if uses_rollups(start_date, end_date):
+        return _get_rollup_summary_stats(parameter_id, start_date, end_date, station_id)
+
+    df = get_enriched_measurements(parameter_id, start_date, end_date, station_id, refresh=refresh)
+    values = df["value"] if "value" in df.columns else pd.Series(dtype=float)
+    return pd.Series({
+        "total_records": int(values.count()),
+        "average_value": values.mean() if values.count() else None,
+        "min_value": values.min() if values.count() else None,
+        "max_value": values.max() if values.count() else None,
+        "latest_value": get_latest_value(parameter_id, station_id),
+    })
+
+@st.cache_data(ttl=60)
+def _get_rollup_summary_stats(parameter_id, start_date, end_date, station_id=17):
+    """Estadísticas de rangos largos desde agg_measurements_daily."""
+    query = """
+    SELECT
+        SUM(d.sample_count) as total_records,
+        SUM(d.value_sum) / NULLIF(SUM(d.sample_count), 0) as average_value,
+        MIN(d.value_min) as min_value,
+        MAX(d.value_max) as max_value,
+        (SELECT value FROM fact_measurements
+         WHERE station_id = %(station_id)s AND parameter_id = %(parameter_id)s
+         ORDER BY timestamp_utc DESC LIMIT 1) as latest_value
+    FROM agg_measurements_daily d
+    WHERE
+        d.station_id = %(station_id)s AND
+        d.parameter_id = %(parameter_id)s AND
+        d.bucket_start BETWEEN %(start_date)s AND %(end_date)s;
     """
     params = {"station_id": station_id, "parameter_id": parameter_id, "start_date": start_date, "end_date": end_date}
     df = query_data(query, params)
     return df.iloc[0] if not df.empty else None
 
-@st.cache_data(ttl=60)
-def get_enriched_measurements(parameter_id, start_date, end_date, station_id=17):
+def get_enriched_measurements(parameter_id, start_date, end_date, station_id=17, refresh=False):
     """
     Función principal para análisis: Obtiene mediciones y extrae partes de la fecha.
-    EXTRACT(ISODOW FROM ...): 1=Lunes, 7=Domingo.
+    Las filas salen de la caché compartida por (estación, parámetro, día): un cambio de rango sólo
+    consulta los días que faltan, al día en curso sólo se le añaden las filas nuevas y los días con
+    filas ingeridas tarde se vuelven a descargar. refresh=True fuerza esa revalidación en el momento.
+    day_of_week (1=Lunes, 7=Domingo), hour_of_day y date_only se derivan en el cliente, vectorizados.
+    """
+    df = get_measurement_cache().get_range(station_id, parameter_id, start_date, end_date, refresh=refresh)
+    return add_time_parts(df)
+
+@st.cache_data(ttl=60)
+def get_rollup_measurements(parameter_id, start_date, end_date, station_id=17, granularity="daily"):
+    """
+    Serie agregada por bucket ('hourly' o 'daily') con la misma forma que get_enriched_measurements:
+    value es el promedio del bucket y timestamp_utc su inicio. Añade min_value, max_value y sample_count.
+    """
+    table = {"hourly": "agg_measurements_hourly", "daily": "agg_measurements_daily"}[granularity]
+    query = f"""
+    SELECT
+        a.value_sum / a.sample_count as value,
+        a.value_min as min_value,
+        a.value_max as max_value,
+        a.sample_count,
+        a.bucket_start as timestamp_utc,
+        EXTRACT(ISODOW FROM a.bucket_start AT TIME ZONE 'UTC') as day_of_week,
+        EXTRACT(HOUR FROM a.bucket_start AT TIME ZONE 'UTC') as hour_of_day,
+        (a.bucket_start AT TIME ZONE 'UTC')::date as date_only
+    FROM {table} a
+    WHERE
+        a.station_id = %(station_id)s AND
+        a.parameter_id = %(parameter_id)s AND
+        a.bucket_start BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY a.bucket_start ASC;
+    """
+    params = {"station_id": station_id, "parameter_id": parameter_id, "start_date": start_date, "end_date": end_date}
+    return query_data(query, params)
+
+@st.cache_data(ttl=60)
+def get_weekday_hour_profile(parameter_id, start_date, end_date, station_id=17):
+    """
+    Perfil día×hora de los días (UTC) que toca el rango, combinado en SQL a partir de las celdas diarias
+    de agg_profile_weekday_hour: count/sum/sumsq/min/max sumados y bocetos de cuantiles fusionados.
+    Devuelve como mucho 7×24 filas sea cual sea el rango.
+    Es la única fuente del Análisis Avanzado (mapa de calor, promedio por día y diagrama de caja).
     """
     query = """
-    SELECT 
-        fm.value,
-        fm.timestamp_utc,
-        EXTRACT(ISODOW FROM fm.timestamp_utc) as day_of_week, -- 1=Lunes, 7=Domingo
-        EXTRACT(HOUR FROM fm.timestamp_utc) as hour_of_day,
-        fm.timestamp_utc::date as date_only
-    FROM fact_measurements fm
-    WHERE 
-        fm.station_id = %(station_id)s AND
-        fm.parameter_id = %(parameter_id)s AND
-        fm.timestamp_utc BETWEEN %(start_date)s AND %(end_date)s
-    ORDER BY fm.timestamp_utc ASC;
+    WITH cells AS (
+        SELECT day_of_week, hour_of_day, sample_count, value_sum, value_sumsq, value_min, value_max, value_sketch
+        FROM agg_profile_weekday_hour
+        WHERE
+            station_id = %(station_id)s AND
+            parameter_id = %(parameter_id)s AND
+            period_start >= date_trunc('day', %(start_date)s::timestamptz, 'UTC') AND
+            period_start <= %(end_date)s
+    ), sketches AS (
+        SELECT day_of_week, hour_of_day, jsonb_object_agg(bin, total) AS value_sketch
+        FROM (
+            SELECT c.day_of_week, c.hour_of_day, kv.key AS bin, SUM(kv.value::BIGINT) AS total
+            FROM cells c, jsonb_each_text(c.value_sketch) kv
+            GROUP BY 1, 2, 3
+        ) b
+        GROUP BY 1, 2
+    )
+    SELECT t.day_of_week, t.hour_of_day, t.sample_count, t.value_sum, t.value_sumsq, t.value_min, t.value_max,
+           COALESCE(s.value_sketch, '{}'::JSONB) AS value_sketch
+    FROM (
+        SELECT day_of_week, hour_of_day, SUM(sample_count) AS sample_count, SUM(value_sum) AS value_sum,
+               SUM(value_sumsq) AS value_sumsq, MIN(value_min) AS value_min, MAX(value_max) AS value_max
+        FROM cells
+        GROUP BY 1, 2
+    ) t
+    LEFT JOIN sketches s USING (day_of_week, hour_of_day)
+    ORDER BY t.day_of_week, t.hour_of_day;
     """
     params = {"station_id": station_id, "parameter_id": parameter_id, "start_date": start_date, "end_date": end_date}
-    return query_data(query, params)
\ No newline at end of file
+    return query_data(query, params)
+
+@st.cache_data(ttl=60)
+def get_alerts(parameter_id, start_date, end_date, station_id=17, limit=500):
+    """
+    Alertas del detector en streaming (alert_events) para un parámetro y rango: conjunto pequeño e indexado,
+    sin recorrer fact_measurements. Las más recientes primero.
+    """
+    query = """
+    SELECT observed_at, value, kind, score, threshold, baseline_mean, baseline_std, source
+    FROM alert_events
+    WHERE
+        station_id = %(station_id)s AND
+        parameter_id = %(parameter_id)s AND
+        observed_at BETWEEN %(start_date)s AND %(end_date)s
+    ORDER BY observed_at DESC
+    LIMIT %(limit)s;
+    """
+    params = {"station_id": station_id, "parameter_id": parameter_id, "start_date": start_date,
+              "end_date": end_date, "limit": limit}
+    return query_data(query, params)
+
+@st.cache_data(ttl=3600)
+def get_alert_thresholds(parameter_id):
+    """Niveles de alerta configurados para un parámetro (alert_thresholds), ordenados."""
+    query = """
+    SELECT threshold_value, label FROM alert_thresholds
+    WHERE parameter_id = %s
+    ORDER BY threshold_value;
+    """
+    return query_data(query, (parameter_id,))
+
+@st.cache_data(ttl=60)
+def get_comparison_frame(station_ids, parameter_ids, start_date, end_date):
+    """
+    Series de N estaciones × M parámetros alineadas a una rejilla común, en una sola consulta.
+    Lee los agregados horarios (o diarios en rangos largos), que ya están alineados al inicio de cada bucket;
+    las combinaciones (estación, parámetro) se numeran en SQL y las filas viajan por COPY binario.
+    Devuelve un DataFrame ancho respaldado por una única matriz float32: índice timestamp_utc (UTC) y
+    columnas MultiIndex (station_id, parameter_id), con NaN en los buckets sin datos.
+    """
+    station_ids, parameter_ids = list(station_ids), list(parameter_ids)
+    pairs = [(s, p) for s in station_ids for p in parameter_ids]
+    columns = pd.MultiIndex.from_tuples(pairs, names=["station_id", "parameter_id"])
+    daily = uses_rollups(start_date, end_date)
+    freq = "D" if daily else "h"
+    grid = pd.date_range(to_utc(start_date).floor(freq), to_utc(end_date), freq=freq, name="timestamp_utc")
+    if not pairs or grid.empty:
+        return pd.DataFrame(index=grid, columns=columns, dtype="float32")
+
+    table = "agg_measurements_daily" if daily else "agg_measurements_hourly"
+    query = f"""
+    SELECT (k.col - 1)::int4 AS col, a.bucket_start, (a.value_sum / a.sample_count)::float8 AS value
+    FROM unnest(%(station_ids)s::int[], %(parameter_ids)s::int[]) WITH ORDINALITY AS k(station_id, parameter_id, col)
+    JOIN {table} a ON a.station_id = k.station_id AND a.parameter_id = k.parameter_id
+    WHERE a.bucket_start >= %(grid_start)s AND a.bucket_start <= %(grid_end)s
+    """
+    params = {
+        "station_ids": [s for s, _ in pairs],
+        "parameter_ids": [p for _, p in pairs],
+        "grid_start": grid[0].to_pydatetime(),
+        "grid_end": grid[-1].to_pydatetime(),
+    }
+    result = query_columnar(query, params, [("col", "int4"), ("bucket_start", "timestamptz"), ("value", "float8")])
+    if result is None:
+        return pd.DataFrame(index=grid, columns=columns, dtype="float32")
+    matrix = pivot_to_grid(result["bucket_start"], result["col"], result["value"].astype("float32"),
+                           grid.tz_localize(None).to_numpy(), len(pairs))
+    return pd.DataFrame(matrix, index=grid, columns=columns, copy=False)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: elige n_out puntos que conservan la forma visual de la serie.
+    x e y son arrays numéricos ordenados por x. Devuelve los índices seleccionados.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 buckets entre el primer y el último punto, que siempre se conservan
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Área (×2) del triángulo formado por el punto anterior, cada candidato y el promedio del siguiente bucket
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_buckets):
+    """
+    Divide la serie en n_buckets tramos de igual número de puntos y conserva el mínimo y el máximo de cada uno,
+    además del primer y último punto. Devuelve los índices ordenados (a lo sumo 2·n_buckets + 2).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return np.arange(n)
+
+    starts = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(starts))
+    # Dentro de cada bucket los índices quedan ordenados por valor: el primero es el mínimo y el último el máximo
+    order = np.lexsort((y, bucket))
+    mins = order[starts[:-1]]
+    maxs = order[starts[1:] - 1]
+    return np.unique(np.concatenate([mins, maxs, [0, n - 1]]))
+
+
+def downsample(df, x_col, y_col, max_points, method="minmax"):
+    """
+    Reduce df a como mucho ~max_points filas para graficar, conservando los picos.
+    method: 'minmax' (mínimo y máximo por bucket) o 'lttb'.
+    """
+    if df.empty or len(df) <= max_points:
+        return df
+    y = df[y_col].to_numpy(dtype=np.float64)
+    if method == "lttb":
+        x = (pd.to_datetime(df[x_col], utc=True) - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy()
+        indices = lttb_indices(x, y, max_points)
+    elif method == "minmax":
+        indices = minmax_indices(y, max(1, (max_points - 2) // 2))
+    else:
+        raise ValueError(f"Método de downsampling desconocido: {method}")
+    return df.iloc[indices]
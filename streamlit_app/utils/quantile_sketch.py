@@ -0,0 +1,72 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Base de los buckets logarítmicos; debe coincidir con profile_sketch_bin() en init.sql
+PROFILE_SKETCH_GAMMA = 1.02
+
+
+def merge_sketches(sketches):
+    """Combina bocetos {clave_bucket: conteo} sumando los conteos de cada bucket."""
+    merged = Counter()
+    for sketch in sketches:
+        merged.update({key: int(count) for key, count in sketch.items()})
+    return merged
+
+
+def _bucket_index(key):
+    """Posición del bucket en el eje de valores: negativos (de mayor a menor magnitud), cero y positivos."""
+    if key == "z":
+        return (0, 0)
+    if key.startswith("n"):
+        return (-1, -int(key[1:]))
+    return (1, int(key))
+
+
+def _bucket_value(key):
+    """Valor representativo del bucket ±(gamma^(k-1), gamma^k]: error relativo <= (gamma-1)/(gamma+1)."""
+    if key == "z":
+        return 0.0
+    sign, k = (-1, key[1:]) if key.startswith("n") else (1, key)
+    return sign * 2 * PROFILE_SKETCH_GAMMA ** int(k) / (PROFILE_SKETCH_GAMMA + 1)
+
+
+def sketch_quantiles(sketch, quantiles):
+    """Cuantiles aproximados de un boceto combinado; None si está vacío."""
+    if not sketch:
+        return [None] * len(quantiles)
+    keys = sorted(sketch, key=_bucket_index)
+    counts = np.cumsum([sketch[k] for k in keys])
+    total = counts[-1]
+    return [_bucket_value(keys[int(np.searchsorted(counts, q * total, side="left"))]) for q in quantiles]
+
+
+def profile_box_stats(profile_df, by="day_of_week"):
+    """
+    Estadísticas de diagrama de caja por grupo a partir de las celdas del perfil día×hora:
+    cuartiles desde los bocetos combinados, extremos, media y desviación estándar desde count/sum/sumsq.
+    """
+    rows = []
+    for key, group in profile_df.groupby(by):
+        count = group["sample_count"].sum()
+        if not count:
+            continue
+        mean = group["value_sum"].sum() / count
+        variance = max(group["value_sumsq"].sum() / count - mean * mean, 0.0)
+        q1, median, q3 = sketch_quantiles(merge_sketches(group["value_sketch"]), (0.25, 0.5, 0.75))
+        value_min, value_max = group["value_min"].min(), group["value_max"].max()
+        rows.append({
+            by: key,
+            "sample_count": int(count),
+            # El boceto redondea al bucket: se acota a los extremos exactos
+            "q1": min(max(q1, value_min), value_max),
+            "median": min(max(median, value_min), value_max),
+            "q3": min(max(q3, value_min), value_max),
+            "min": value_min,
+            "max": value_max,
+            "mean": mean,
+            "sd": math.sqrt(variance),
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+DAY = pd.Timedelta(days=1)
+
+
+def to_utc(ts):
+    """Timestamp en UTC; los valores sin zona horaria se interpretan como UTC."""
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+class _Segment:
+    __slots__ = ("df", "nbytes", "last_ts", "complete", "fetched_at", "checked_at", "verified_at")
+
+    def __init__(self, df, complete, fetched_at, verified_at):
+        self.df = df
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+        # Última medición cacheada: las filas nuevas posteriores se añaden sin volver a descargar el día
+        self.last_ts = df["timestamp_utc"].max() if not df.empty else None
+        self.complete = complete
+        # Reloj local (monotónico) de la descarga y de la última verificación de cambios
+        self.fetched_at = fetched_at
+        self.checked_at = fetched_at
+        # Hora del servidor hasta la que el contenido del día está verificado (None sin detector de cambios)
+        self.verified_at = verified_at
+
+
+class RangeCache:
+    """
+    Caché compartida de mediciones por (estación, parámetro, día UTC).
+
+    Un rango de fechas se arma con los días ya cacheados y sólo se consultan los días que faltan
+    (agrupados en tramos contiguos, una consulta por tramo). Los días cacheados se revalidan cada
+    refresh_seconds (o al forzar un refresco con refresh=True) con changed_days, que indica qué días
+    recibieron filas después de su última verificación y desde qué timestamp. Si todas las filas
+    nuevas de un día son posteriores a la última cacheada (el caso normal del día en curso) sólo se
+    piden esas filas y se añaden al segmento; si hay filas tardías intermedias (tramos en paralelo,
+    reenvíos del spool) el día se vuelve a descargar completo. Sin detector de cambios los días
+    recientes, dentro de la ventana settle, se descargan completos en cada revalidación. Los días
+    cerrados caducan tras complete_ttl segundos. Los segmentos son compartidos entre sesiones y nunca
+    se descartan antes de tener su reemplazo; se desalojan por orden de uso (LRU) cuando la caché
+    supera max_bytes.
+
+    fetch(station_id, parameter_id, lower, upper) debe devolver un DataFrame con una columna
+    timestamp_utc y las filas con lower <= timestamp_utc < upper, o None si la consulta falló.
+    changed_days(station_id, parameter_id, since, lower, upper) debe devolver (hora_del_servidor,
+    {día UTC: primer timestamp_utc ingerido después de since} en [lower, upper)), con since=None sólo
+    la hora, o None si falló. Las filas se marcan con la hora de inicio de su transacción, por eso since
+    se retrocede change_overlap para no perder transacciones que confirmaron después de la verificación.
+    """
+
+    def __init__(self, fetch, max_bytes, refresh_seconds=60, settle=pd.Timedelta(hours=6),
+                 changed_days=None, complete_ttl=3600, change_overlap=pd.Timedelta(minutes=10)):
+        self._fetch = fetch
+        self._changed_days = changed_days
+        self.max_bytes = max_bytes
+        self.refresh_seconds = refresh_seconds
+        self.settle = settle
+        self.complete_ttl = complete_ttl
+        self.change_overlap = change_overlap
+        self._segments = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_range(self, station_id, parameter_id, start, end, refresh=False):
+        """
+        Filas con start <= timestamp_utc <= end, ordenadas por tiempo.
+        refresh=True revalida en el momento todos los días cacheados del rango (sin esperar refresh_seconds).
+        """
+        start, end = to_utc(start), to_utc(end)
+        days = list(pd.date_range(start.floor("D"), end.floor("D"), freq="D"))
+        now = pd.Timestamp.now(tz="UTC")
+        checked_at = time.monotonic()
+
+        with self._lock:
+            cached = {day: self._segments.get((station_id, parameter_id, day)) for day in days}
+        missing = {day for day, segment in cached.items() if segment is None}
+        due = {day: segment for day, segment in cached.items()
+               if segment is not None and (refresh or checked_at - segment.checked_at >= self.refresh_seconds)}
+        expired = {day for day, segment in due.items()
+                   if segment.complete and checked_at - segment.fetched_at >= self.complete_ttl}
+
+        verified_at, changed, tails = None, set(), {}
+        if self._changed_days is None:
+            # Sin detector de cambios los días recientes se descargan completos en cada revalidación
+            changed = {day for day, segment in due.items() if not segment.complete}
+        elif missing or due:
+            # La hora del servidor se toma antes de descargar: lo que llegue después se detecta en la próxima verificación
+            since = min((s.verified_at for s in due.values() if s.verified_at is not None), default=None)
+            if since is not None:
+                since -= self.change_overlap
+            result = self._changed_days(station_id, parameter_id, since, days[0], days[-1] + DAY)
+            if result is not None:
+                verified_at, first_new = result
+                first_new = {to_utc(day).floor("D"): to_utc(ts) for day, ts in first_new.items()}
+                for day, segment in due.items():
+                    if segment.verified_at is None:
+                        # Descargado cuando la verificación falló: no hay punto de partida
+                        changed.add(day)
+                    elif day in first_new:
+                        if segment.last_ts is not None and first_new[day] > segment.last_ts:
+                            tails[day] = segment
+                        else:
+                            changed.add(day)
+            else:
+                # Sin verificación posible se descarga de nuevo todo lo que tocaba revisar
+                changed = set(due)
+
+        to_fetch = sorted(missing | changed | expired)
+        tails = {day: segment for day, segment in tails.items() if day not in to_fetch}
+        failed = set()
+        for run_start, run_end in _contiguous_runs(to_fetch):
+            df = self._fetch(station_id, parameter_id, run_start, run_end + DAY)
+            if df is None:
+                # Error de consulta: no se cachea nada; los días que ya estaban se conservan como estaban
+                failed.update(pd.date_range(run_start, run_end, freq="D"))
+                continue
+            self._store_days(station_id, parameter_id, df, run_start, run_end, now, checked_at, verified_at)
+        for day, segment in tails.items():
+            # Sólo las filas posteriores a la última cacheada
+            df = self._fetch(station_id, parameter_id, segment.last_ts + pd.Timedelta(microseconds=1), day + DAY)
+            if df is None:
+                failed.add(day)
+                continue
+            self._append_day(station_id, parameter_id, day, segment, df, now, checked_at, verified_at)
+
+        with self._lock:
+            frames = []
+            for day in days:
+                key = (station_id, parameter_id, day)
+                segment = self._segments.get(key)
+                if segment is None:
+                    continue
+                if day in due and day not in to_fetch and day not in tails and day not in failed:
+                    # Verificado sin cambios
+                    segment.checked_at = checked_at
+                    if verified_at is not None:
+                        segment.verified_at = verified_at
+                self._segments.move_to_end(key)
+                frames.append(segment.df)
+            self._evict()
+
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return self._empty()
+        result = pd.concat(frames, ignore_index=True)
+        mask = (result["timestamp_utc"] >= start) & (result["timestamp_utc"] <= end)
+        return result.loc[mask].reset_index(drop=True)
+
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self._segments), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _empty(self):
+        return pd.DataFrame({"timestamp_utc": pd.Series(dtype="datetime64[ns, UTC]")})
+
+    def _split_by_day(self, df):
+        if df.empty:
+            return {}
+        df = df.assign(timestamp_utc=pd.to_datetime(df["timestamp_utc"], utc=True))
+        return {day: part.reset_index(drop=True) for day, part in df.groupby(df["timestamp_utc"].dt.floor("D"))}
+
+    def _is_complete(self, day, now):
+        return day + DAY + self.settle <= now
+
+    def _store_days(self, station_id, parameter_id, df, first_day, last_day, now, checked_at, verified_at):
+        by_day = self._split_by_day(df)
+        empty = df.iloc[0:0].assign(timestamp_utc=pd.Series(dtype="datetime64[ns, UTC]"))
+        with self._lock:
+            for day in pd.date_range(first_day, last_day, freq="D"):
+                # Los días sin filas también se guardan para no volver a consultarlos
+                segment = _Segment(by_day.get(day, empty), self._is_complete(day, now), checked_at, verified_at)
+                self._put((station_id, parameter_id, day), segment)
+
+    def _append_day(self, station_id, parameter_id, day, previous, df, now, checked_at, verified_at):
+        key = (station_id, parameter_id, day)
+        with self._lock:
+            if self._segments.get(key) is not previous:
+                # Otra sesión ya reemplazó o desalojó el segmento mientras se consultaba
+                return
+            if not df.empty:
+                df = df.assign(timestamp_utc=pd.to_datetime(df["timestamp_utc"], utc=True))
+                merged = pd.concat([previous.df, df], ignore_index=True)
+            else:
+                merged = previous.df
+            segment = _Segment(merged, self._is_complete(day, now), previous.fetched_at, verified_at)
+            segment.checked_at = checked_at
+            self._put(key, segment)
+
+    def _put(self, key, segment):
+        self._drop(key)
+        self._segments[key] = segment
+        self._bytes += segment.nbytes
+
+    def _drop(self, key):
+        previous = self._segments.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._segments) > 1:
+            _, segment = self._segments.popitem(last=False)
+            self._bytes -= segment.nbytes
+
+
+def _contiguous_runs(days):
+    """Agrupa días ordenados en tramos consecutivos [(inicio, fin), ...]."""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == DAY:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
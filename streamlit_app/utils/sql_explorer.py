@@ -0,0 +1,74 @@
+import re
+
+_DOLLAR_TAG = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+
+
+def _top_level_semicolons(query):
+    """
+    Posiciones de los ';' fuera de literales ('...', E'...', "...", $tag$...$tag$) y comentarios,
+    y posición del último carácter significativo que no es ';'.
+    """
+    semicolons, last_code = [], -1
+    i, n = 0, len(query)
+    while i < n:
+        ch = query[i]
+        if query.startswith("--", i):
+            end = query.find("\n", i)
+            i = n if end == -1 else end + 1
+            continue
+        if query.startswith("/*", i):
+            # Los comentarios de bloque se anidan en Postgres
+            depth, i = 1, i + 2
+            while i < n and depth:
+                if query.startswith("/*", i):
+                    depth, i = depth + 1, i + 2
+                elif query.startswith("*/", i):
+                    depth, i = depth - 1, i + 2
+                else:
+                    i += 1
+            continue
+        if ch in "'\"":
+            escapes = ch == "'" and i > 0 and query[i - 1] in "eE"
+            i += 1
+            while i < n:
+                if escapes and query[i] == "\\":
+                    i += 2
+                elif query[i] == ch:
+                    # Comilla duplicada: se escapa a sí misma
+                    if query.startswith(ch * 2, i):
+                        i += 2
+                    else:
+                        break
+                else:
+                    i += 1
+            last_code = i
+            i += 1
+            continue
+        if ch == "$":
+            tag = _DOLLAR_TAG.match(query, i)
+            if tag and not (i > 0 and (query[i - 1].isalnum() or query[i - 1] == "_")):
+                end = query.find(tag.group(), tag.end())
+                i = n if end == -1 else end + len(tag.group())
+                last_code = i - 1
+                continue
+        if ch == ";":
+            semicolons.append(i)
+        elif not ch.isspace():
+            last_code = i
+        i += 1
+    return semicolons, last_code
+
+
+def normalize_explorer_query(query):
+    """
+    Limpia la consulta del Explorador SQL y exige una única sentencia.
+    Los ';' dentro de literales o comentarios se permiten y los finales se quitan; un ';' entre dos
+    sentencias se rechaza porque psycopg2 envía el texto completo y Postgres ejecutaría todas
+    (p. ej. '...; COMMIT; DROP ...' cerraría la transacción de sólo lectura).
+    """
+    semicolons, last_code = _top_level_semicolons(query)
+    if last_code == -1:
+        raise ValueError("La consulta está vacía.")
+    if any(pos < last_code for pos in semicolons):
+        raise ValueError("Sólo se permite una sentencia por consulta.")
+    return query[:semicolons[0] if semicolons else len(query)].strip()
@@ -0,0 +1,410 @@
+"""Streaming anomaly and threshold detection with O(1) state per series.
+
+Each series (an MQTT topic, or a station/parameter pair in the ingestion
+job) keeps a sample count, an EWMA mean/variance and two P² quantile
+sketches (25th/75th percentile) that restart every ``quantile_window``
+samples so they follow recent data. Every new value is checked before it
+updates the state:
+
+- ``spike``: EWMA z-score above ``z_threshold``
+- ``quantile``: outside the IQR fence ``[q25 - k·IQR, q75 + k·IQR]``
+- ``threshold_up`` / ``threshold_down``: crossed a configured level since the previous value
+
+The standard deviation is floored at ``min_scale`` times the baseline's
+magnitude (at least ``min_scale``), so a series that has been flat and then
+jumps is still flagged instead of dividing by zero. When the quartiles
+coincide (flat or quantised series) the IQR falls back to the spread the EWMA
+sees.
+
+Alerts go to ``alert_events``; detector state is persisted as JSON in
+``anomaly_detector_state`` so restarts do not need a new warm-up. Keys must
+be unique per writer: subscriber replicas in a shared group prefix them with
+their client ID, otherwise they would overwrite each other's rows.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import extras
+
+try:
+    from metrics import Counter
+except ImportError:
+    # Imported as subscriber.anomaly from run_publisher.py
+    from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ALERTS = Counter('anomaly_alerts_total', 'Alerts raised by the streaming detector', ['source', 'kind'])
+
+Alert = namedtuple('Alert', [
+    'series_key', 'station_id', 'parameter_id', 'observed_at', 'value',
+    'kind', 'score', 'threshold', 'baseline_mean', 'baseline_std',
+])
+
+INSERT_ALERTS_SQL = (
+    "INSERT INTO alert_events (source, series_key, station_id, parameter_id, observed_at, value, "
+    "kind, score, threshold, baseline_mean, baseline_std) VALUES %s ON CONFLICT DO NOTHING"
+)
+UPSERT_STATE_SQL = (
+    "INSERT INTO anomaly_detector_state (series_key, state, updated_at) VALUES %s "
+    "ON CONFLICT (series_key) DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at"
+)
+
+
+class P2Quantile:
+    """P² (Jain & Chlamtac) estimate of one quantile with five markers."""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        self.count += 1
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'p': self.p, 'count': self.count, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['p'])
+        sketch.count = data['count']
+        sketch.heights = data['heights']
+        sketch.positions = data['positions']
+        sketch.desired = data['desired']
+        return sketch
+
+
+class RollingQuantile:
+    """P² sketch restarted every ``window`` samples; the previous estimate is used while the new one warms up."""
+
+    MIN_SAMPLES = 50
+
+    def __init__(self, p: float, window: int):
+        self.p = p
+        self.window = window
+        self.current = P2Quantile(p)
+        self.previous = None
+
+    def add(self, x: float):
+        self.current.add(x)
+        if self.current.count >= self.window:
+            self.previous = self.current.value()
+            self.current = P2Quantile(self.p)
+
+    def value(self):
+        if self.previous is not None and self.current.count < self.MIN_SAMPLES:
+            return self.previous
+        return self.current.value()
+
+    def to_dict(self):
+        return {'current': self.current.to_dict(), 'previous': self.previous}
+
+    @classmethod
+    def from_dict(cls, data, p, window):
+        rolling = cls(p, window)
+        rolling.current = P2Quantile.from_dict(data['current'])
+        rolling.previous = data['previous']
+        return rolling
+
+
+class SeriesState:
+    """Running statistics of one series."""
+
+    def __init__(self, quantile_window: int):
+        self.count = 0
+        self.ewma_mean = None
+        self.ewma_var = 0.0
+        self.last_value = None
+        self.last_ts = None
+        self.q25 = RollingQuantile(0.25, quantile_window)
+        self.q75 = RollingQuantile(0.75, quantile_window)
+
+    def update(self, value: float, ts, alpha: float):
+        self.count += 1
+        # EWMA mean/variance
+        if self.ewma_mean is None:
+            self.ewma_mean = value
+        else:
+            diff = value - self.ewma_mean
+            increment = alpha * diff
+            self.ewma_mean += increment
+            self.ewma_var = (1 - alpha) * (self.ewma_var + diff * increment)
+        self.q25.add(value)
+        self.q75.add(value)
+        self.last_value = value
+        self.last_ts = ts
+
+    def to_dict(self):
+        return {
+            'count': self.count, 'ewma_mean': self.ewma_mean, 'ewma_var': self.ewma_var,
+            'last_value': self.last_value,
+            'last_ts': self.last_ts.isoformat() if self.last_ts is not None else None,
+            'q25': self.q25.to_dict(), 'q75': self.q75.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data, quantile_window):
+        state = cls(quantile_window)
+        # States saved by older versions also carry a Welford mean/m2, which nothing reads
+        for key in ('count', 'ewma_mean', 'ewma_var', 'last_value'):
+            setattr(state, key, data[key])
+        state.last_ts = datetime.fromisoformat(data['last_ts']) if data['last_ts'] else None
+        state.q25 = RollingQuantile.from_dict(data['q25'], 0.25, quantile_window)
+        state.q75 = RollingQuantile.from_dict(data['q75'], 0.75, quantile_window)
+        return state
+
+
+# IQR of a normal distribution in standard deviations
+IQR_PER_STD = 1.349
+
+
+class AnomalyDetector:
+    """Per-series detector; ``observe`` returns the alerts raised by one value."""
+
+    def __init__(self, z_threshold: float = 4.0, iqr_fence: float = 3.0, alpha: float = 0.05,
+                 warmup: int = 30, quantile_window: int = 1000, min_scale: float = 1e-3):
+        self.z_threshold = z_threshold
+        self.min_scale = min_scale
+        self.iqr_fence = iqr_fence
+        self.alpha = alpha
+        self.warmup = warmup
+        self.quantile_window = quantile_window
+        self.states = {}
+        # observe() runs on the message thread while AlertSink exports the state from its own thread
+        self._lock = threading.Lock()
+
+    def observe(self, series_key: str, value: float, ts, thresholds=(), station_id=None, parameter_id=None) -> list:
+        # NaN/Infinity would poison the running statistics for good (and JSONB rejects them on save)
+        if not math.isfinite(value):
+            return []
+        with self._lock:
+            return self._observe(series_key, value, ts, thresholds, station_id, parameter_id)
+
+    def _observe(self, series_key, value, ts, thresholds, station_id, parameter_id) -> list:
+        state = self.states.get(series_key)
+        if state is None:
+            state = self.states[series_key] = SeriesState(self.quantile_window)
+        alerts = []
+
+        def alert(kind, score=None, threshold=None):
+            std = math.sqrt(state.ewma_var) if state.ewma_var > 0 else None
+            alerts.append(Alert(series_key, station_id, parameter_id, ts, value,
+                                kind, score, threshold, state.ewma_mean, std))
+
+        if state.count >= self.warmup:
+            floor = self.min_scale * max(abs(state.ewma_mean), 1.0)
+            std = max(math.sqrt(state.ewma_var), floor)
+            z = (value - state.ewma_mean) / std
+            if abs(z) >= self.z_threshold:
+                alert('spike', score=z)
+            else:
+                q25, q75 = state.q25.value(), state.q75.value()
+                iqr = q75 - q25
+                if iqr < floor:
+                    iqr = IQR_PER_STD * std
+                if not q25 - self.iqr_fence * iqr <= value <= q75 + self.iqr_fence * iqr:
+                    # Score: distance to the nearest quartile in IQR units
+                    alert('quantile', score=(value - q75) / iqr if value > q75 else (value - q25) / iqr)
+
+        previous = state.last_value
+        if previous is not None:
+            for threshold in thresholds:
+                if previous < threshold <= value:
+                    alert('threshold_up', threshold=threshold)
+                elif value < threshold <= previous:
+                    alert('threshold_down', threshold=threshold)
+
+        state.update(value, ts, self.alpha)
+        return alerts
+
+    def last_timestamp(self, series_key: str):
+        with self._lock:
+            state = self.states.get(series_key)
+            return state.last_ts if state is not None else None
+
+    def export_states(self) -> dict:
+        """Consistent snapshot of every series state, taken under the lock."""
+        with self._lock:
+            return {key: state.to_dict() for key, state in self.states.items()}
+
+    def load_states(self, states: dict):
+        loaded = {key: SeriesState.from_dict(data, self.quantile_window) for key, data in states.items()}
+        with self._lock:
+            self.states.update(loaded)
+
+
+def load_detector_states(cur, detector: AnomalyDetector, key_prefix: str) -> int:
+    """Load persisted state for every series whose key starts with ``key_prefix``."""
+    cur.execute("SELECT series_key, state FROM anomaly_detector_state WHERE series_key LIKE %s",
+                (key_prefix.replace('%', r'\%').replace('_', r'\_') + '%',))
+    rows = cur.fetchall()
+    detector.load_states({key: state if isinstance(state, dict) else json.loads(state) for key, state in rows})
+    return len(rows)
+
+
+def save_detector_states(cur, detector: AnomalyDetector):
+    now = datetime.now().astimezone()
+    rows = [(key, json.dumps(state), now) for key, state in detector.export_states().items()]
+    if rows:
+        extras.execute_values(cur, UPSERT_STATE_SQL, rows, page_size=len(rows))
+
+
+def write_alerts(cur, alerts: list, source: str):
+    """Insert alerts; replays of the same (series, time, kind, threshold) are ignored.
+    Call ``count_alerts`` once the transaction commits."""
+    if not alerts:
+        return
+    extras.execute_values(cur, INSERT_ALERTS_SQL, [(source,) + tuple(a) for a in alerts], page_size=len(alerts))
+
+
+def count_alerts(alerts: list, source: str):
+    """Count written alerts in ``anomaly_alerts_total``."""
+    for a in alerts:
+        ALERTS.labels(source, a.kind).inc()
+
+
+class AlertSink:
+    """Buffers alerts from the hot path and writes them, with the detector state, from a background thread.
+
+    Every alert is stored, but a series is logged at most once per ``log_interval``
+    seconds, with the number of alerts left out of the log since its last line.
+    """
+
+    def __init__(self, db_config: dict, detector: AnomalyDetector, source: str, key_prefix: str,
+                 flush_interval: float = 5.0, state_interval: float = 60.0, log_interval: float = 60.0):
+        self.db_config = db_config
+        self.detector = detector
+        self.source = source
+        self.key_prefix = key_prefix
+        self.flush_interval = flush_interval
+        self.state_interval = state_interval
+        self.log_interval = log_interval
+        self._pending = []
+        # series_key -> [monotonic time of its last log line, alerts not logged since]
+        self._logged = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._stop = threading.Event()
+        self._load_states()
+        self._thread = threading.Thread(target=self._run, name='alert-sink', daemon=True)
+        self._thread.start()
+
+    def add(self, alerts: list):
+        now = time.monotonic()
+        with self._lock:
+            self._pending.extend(alerts)
+            to_log = []
+            for a in alerts:
+                entry = self._logged.get(a.series_key)
+                if entry is not None and now - entry[0] < self.log_interval:
+                    entry[1] += 1
+                    continue
+                to_log.append((a, entry[1] if entry is not None else 0))
+                self._logged[a.series_key] = [now, 0]
+        for a, suppressed in to_log:
+            logger.warning('🚨 %s on %s: value=%s score=%s threshold=%s (+%d suppressed)',
+                           a.kind, a.series_key, a.value, a.score, a.threshold, suppressed)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._flush(save_state=True)
+        if self._conn is not None:
+            self._conn.close()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**self.db_config)
+        return self._conn
+
+    def _load_states(self):
+        try:
+            with self._connection().cursor() as cur:
+                loaded = load_detector_states(cur, self.detector, self.key_prefix)
+            self._conn.rollback()
+            if loaded:
+                logger.info(f'🧮 Loaded detector state for {loaded} series')
+        except psycopg2.Error as e:
+            logger.warning(f'⚠️ Could not load detector state, starting cold: {e}')
+            self._conn = None
+
+    def _run(self):
+        elapsed = 0.0
+        while not self._stop.wait(self.flush_interval):
+            elapsed += self.flush_interval
+            save_state = elapsed >= self.state_interval
+            if save_state:
+                elapsed = 0.0
+            self._flush(save_state)
+
+    def _flush(self, save_state: bool):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending and not save_state:
+            return
+        try:
+            conn = self._connection()
+            with conn.cursor() as cur:
+                write_alerts(cur, pending, self.source)
+                if save_state:
+                    save_detector_states(cur, self.detector)
+            conn.commit()
+            count_alerts(pending, self.source)
+        except psycopg2.Error as e:
+            logger.error(f'❌ Could not write {len(pending)} alerts: {e}')
+            if self._conn is not None and not self._conn.closed:
+                self._conn.rollback()
+            self._conn = None if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) else self._conn
+            # Keep them for the next flush, bounded so an outage cannot grow memory without limit
+            with self._lock:
+                self._pending = (pending + self._pending)[-10000:]
@@ -0,0 +1,247 @@
+"""asyncio runtime for the MQTT subscriber.
+
+Alternative entrypoint to ``subscriber.py`` (``python async_subscriber.py``)
+built on aiomqtt and an asyncpg connection pool instead of paho's network
+thread and psycopg2. Configuration, routing, validation and metrics are
+shared with ``subscriber.py``; only the I/O pipeline differs:
+
+    MQTT messages -> decode_message -> batch per table
+        -> bounded queue of batches -> N writer tasks (COPY via the pool)
+
+Up to ``ASYNC_WRITERS`` batches are written concurrently while new messages
+keep arriving, and the bounded batch queue pushes back on the MQTT reader
+when the database falls behind. Rows the database rejects are isolated and
+left out of their batch; batches that cannot be written for any other reason
+(database unreachable, schema errors) go to the same on-disk spool as the
+threaded mode.
+"""
+import asyncio
+import logging
+import os
+import signal
+import ssl
+import time
+from datetime import datetime
+
+import aiomqtt
+import asyncpg
+
+import subscriber
+from batch_writer import BATCH_ROWS, FLUSH_FAILURES, FLUSH_SECONDS, REJECTED_ROWS, ROWS_WRITTEN
+from metrics import Gauge, start_metrics_server
+from spool import Spool, SpoolDrainer
+from anomaly import AnomalyDetector, AlertSink
+
+logger = logging.getLogger('async_subscriber')
+
+# Concurrent batch writers (and pool size); batches allowed to wait behind them before reads pause
+ASYNC_WRITERS = int(os.environ.get('ASYNC_WRITERS', '4'))
+ASYNC_MAX_PENDING_BATCHES = int(os.environ.get('ASYNC_MAX_PENDING_BATCHES', '8'))
+MQTT_RECONNECT_SECONDS = float(os.environ.get('MQTT_RECONNECT_SECONDS', '5'))
+
+COLUMNS = ('topic', 'payload', 'value', 'timestamp')
+
+PENDING_BATCHES = Gauge('subscriber_async_pending_batches', 'Batches waiting for a free writer task')
+INFLIGHT_BATCHES = Gauge('subscriber_async_inflight_batches', 'Batches currently being written')
+
+# Errors that mean the database is unreachable (as opposed to rejecting the data)
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+# Errors caused by the contents of a row; the rest of its batch is still written
+DATA_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class AsyncIngest:
+    """Accumulates validated rows into per-table batches and writes them through the pool."""
+
+    def __init__(self, pool, spool: Spool):
+        self.pool = pool
+        self.spool = spool
+        self.batches = asyncio.Queue(maxsize=ASYNC_MAX_PENDING_BATCHES)
+        self.inflight = 0
+        self._pending = {}
+        self._pending_rows = 0
+        PENDING_BATCHES.set_function(self.batches.qsize)
+        INFLIGHT_BATCHES.set_function(lambda: self.inflight)
+
+    async def add(self, table: str, row: tuple):
+        self._pending.setdefault(table, []).append(row)
+        self._pending_rows += 1
+        if self._pending_rows >= subscriber.BATCH_MAX_ROWS:
+            await self.flush()
+
+    async def flush(self):
+        """Hand the current batch to the writers; waits while the batch queue is full."""
+        if not self._pending:
+            return
+        pending, self._pending, self._pending_rows = self._pending, {}, 0
+        await self.batches.put(pending)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(subscriber.BATCH_FLUSH_SECONDS)
+            await self.flush()
+
+    async def writer(self):
+        while True:
+            pending = await self.batches.get()
+            self.inflight += 1
+            try:
+                await self._write(pending)
+            finally:
+                self.inflight -= 1
+                self.batches.task_done()
+
+    async def _write(self, pending: dict):
+        total = sum(len(rows) for rows in pending.values())
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    written = {table: await self._copy_isolating(conn, table, rows) for table, rows in pending.items()}
+        except CONNECTION_ERRORS as e:
+            FLUSH_FAILURES.inc()
+            logger.warning(f'⚠️ Database unavailable, spooling batch of {total} rows: {e}')
+            await self._spool(pending)
+            return
+        except Exception as e:
+            # Not caused by a row (those are isolated): keep the batch for the spool drainer to retry
+            FLUSH_FAILURES.inc()
+            logger.error(f'❌ Error flushing batch of {total} rows, spooling it: {e}')
+            await self._spool(pending)
+            return
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
+        BATCH_ROWS.observe(total)
+        for table, count in written.items():
+            ROWS_WRITTEN.labels(table).inc(count)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('💾 Flushed %d rows', sum(written.values()))
+
+    async def _copy_isolating(self, conn, table: str, rows: list) -> int:
+        """COPY ``rows`` under a savepoint, splitting them in halves on data errors to leave out only the bad rows."""
+        try:
+            async with conn.transaction():
+                await conn.copy_records_to_table(table, records=rows, columns=COLUMNS)
+            return len(rows)
+        except DATA_ERRORS as e:
+            if len(rows) == 1:
+                REJECTED_ROWS.labels(table).inc()
+                logger.error(f'☠️ Dead letter for {table}: {e} | row={rows[0]!r:.500}')
+                return 0
+            middle = len(rows) // 2
+            return (await self._copy_isolating(conn, table, rows[:middle])
+                    + await self._copy_isolating(conn, table, rows[middle:]))
+
+    async def _spool(self, pending: dict):
+        items = [(table, row) for table, rows in pending.items() for row in rows]
+        await asyncio.to_thread(self.spool.append, items)
+
+
+def mqtt_client() -> aiomqtt.Client:
+    tls_context = None
+    if subscriber.PORT == 8883:
+        tls_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        tls_context.check_hostname = False
+        tls_context.verify_mode = ssl.CERT_NONE
+    return aiomqtt.Client(
+        subscriber.BROKER, subscriber.PORT,
+        username=subscriber.USERNAME or None,
+        password=subscriber.PASSWORD or None,
+        client_id=subscriber.CLIENT_ID,
+        clean_session=not subscriber.PERSISTENT_SESSION,
+        protocol=aiomqtt.ProtocolVersion.V311,
+        tls_context=tls_context,
+        keepalive=60,
+    )
+
+
+async def consume(ingest: AsyncIngest):
+    """Read messages until cancelled, reconnecting to the broker when the connection drops."""
+    while True:
+        try:
+            async with mqtt_client() as client:
+                logger.info('✅ Connected to MQTT Broker successfully')
+                async with client.messages() as messages:
+                    subscriptions = subscriber.subscription_list()
+                    await client.subscribe(subscriptions)
+                    logger.info(f'📡 Subscribed to: {", ".join(f"{f} (QoS {q})" for f, q in subscriptions)}')
+                    async for message in messages:
+                        topic = message.topic.value
+                        try:
+                            decoded = subscriber.decode_message(topic, message.payload)
+                        except Exception as e:
+                            logger.error(f'❌ Error processing message: {e}')
+                            continue
+                        if decoded is not None:
+                            route, payload_json, value = decoded
+                            received_at = datetime.now()
+                            await ingest.add(route.table, (topic, payload_json, value, received_at))
+                            if subscriber.detector is not None:
+                                subscriber.detect_anomalies(route, topic, value, received_at)
+        except aiomqtt.MqttError as e:
+            logger.warning(f'⚠️ MQTT connection lost: {e}, reconnecting in {MQTT_RECONNECT_SECONDS:g}s')
+            await asyncio.sleep(MQTT_RECONNECT_SECONDS)
+
+
+async def run():
+    logger.info('🚀 Starting MQTT Subscriber (asyncio)...')
+    logger.info(f'📍 Broker: {subscriber.BROKER}:{subscriber.PORT}')
+    logger.info(f"👤 Database: {subscriber.DB_CONFIG['database']}@{subscriber.DB_CONFIG['host']}")
+    logger.info(f'📦 Batching: {subscriber.BATCH_MAX_ROWS} rows / {subscriber.BATCH_FLUSH_SECONDS}s, '
+                f'{ASYNC_WRITERS} writers, {ASYNC_MAX_PENDING_BATCHES} pending batches')
+
+    spool_dir = subscriber.claim_spool_dir()
+    logger.info(f'📼 Spool: {spool_dir}, client ID: {subscriber.CLIENT_ID}')
+    spool = Spool(spool_dir, segment_bytes=subscriber.SPOOL_SEGMENT_BYTES,
+                  max_bytes=subscriber.SPOOL_MAX_BYTES, fsync_interval=subscriber.SPOOL_FSYNC_SECONDS)
+    drainer = SpoolDrainer(spool, subscriber.DB_CONFIG, batch_rows=subscriber.SPOOL_REPLAY_BATCH_ROWS,
+                           rows_per_second=subscriber.SPOOL_REPLAY_ROWS_PER_SEC)
+    # min_size=0: connections are opened on demand, so startup does not depend on the database
+    db_config = {k: v for k, v in subscriber.DB_CONFIG.items() if k != 'connect_timeout'}
+    pool = await asyncpg.create_pool(min_size=0, max_size=ASYNC_WRITERS,
+                                     timeout=subscriber.DB_CONFIG['connect_timeout'], **db_config)
+    if subscriber.METRICS_PORT:
+        start_metrics_server(subscriber.METRICS_PORT)
+    if subscriber.ANOMALY_DETECTION:
+        # The sink writes from its own thread; observe() runs on the event loop like on_message does on paho's thread
+        subscriber.detector = AnomalyDetector(
+            z_threshold=subscriber.ANOMALY_Z_THRESHOLD, iqr_fence=subscriber.ANOMALY_IQR_FENCE,
+            alpha=subscriber.ANOMALY_EWMA_ALPHA, warmup=subscriber.ANOMALY_WARMUP,
+            quantile_window=subscriber.ANOMALY_QUANTILE_WINDOW, min_scale=subscriber.ANOMALY_MIN_SCALE)
+        subscriber.alert_sink = AlertSink(subscriber.DB_CONFIG, subscriber.detector, source='subscriber',
+                                          key_prefix=subscriber.ANOMALY_KEY_PREFIX,
+                                          flush_interval=subscriber.ALERT_FLUSH_SECONDS)
+
+    ingest = AsyncIngest(pool, spool)
+    writers = [asyncio.create_task(ingest.writer(), name=f'db-writer-{i}') for i in range(ASYNC_WRITERS)]
+    ticker = asyncio.create_task(ingest.flush_periodically(), name='batch-flush')
+    consumer = asyncio.create_task(consume(ingest), name='mqtt-consumer')
+
+    # docker stop sends SIGTERM: stop reading, then write what is buffered before exiting
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, consumer.cancel)
+
+    try:
+        await consumer
+    except asyncio.CancelledError:
+        logger.info('⛔ Subscriber stopping')
+    finally:
+        ticker.cancel()
+        await ingest.flush()
+        await ingest.batches.join()
+        for task in writers:
+            task.cancel()
+        await asyncio.gather(*writers, ticker, return_exceptions=True)
+        await pool.close()
+        await asyncio.to_thread(drainer.close)
+        if subscriber.alert_sink is not None:
+            await asyncio.to_thread(subscriber.alert_sink.close)
+        spool.close()
+        logger.info('👋 Subscriber stopped')
+
+
+if __name__ == '__main__':
+    # Wait for PostgreSQL to be ready
+    logger.info('⏳ Waiting for database to be ready...')
+    time.sleep(5)
+    asyncio.run(run())
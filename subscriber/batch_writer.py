@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extras
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = Histogram('subscriber_db_flush_seconds', 'Time to write one batch, including commit')
+BATCH_ROWS = Histogram('subscriber_db_batch_rows', 'Rows per flushed batch',
+                       buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+ROWS_WRITTEN = Counter('subscriber_db_rows_written_total', 'Rows committed to the lake tables', ['table'])
+FLUSH_FAILURES = Counter('subscriber_db_flush_failures_total', 'Batches that could not be written')
+RECONNECTS = Counter('subscriber_db_reconnects_total', 'Database connections re-opened after the first one')
+REJECTED_ROWS = Counter('subscriber_db_rejected_rows_total', 'Rows rejected by PostgreSQL and left out of their batch', ['table'])
+
+INSERT_SQL = "INSERT INTO {table} (topic, payload, value, timestamp) VALUES %s"
+
+# Errors caused by the contents of a row (out-of-range value, invalid JSONB, constraint); anything
+# else (missing table, permissions, ...) is not the rows' fault and must not discard them
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+def insert_rows(cur, table: str, rows: list) -> int:
+    """Insert ``rows`` into ``table``, leaving out only the rows the database rejects.
+
+    The rows are inserted together under a savepoint. On a data error the
+    savepoint is rolled back and the rows are split in halves until each
+    offending row is isolated; those are logged as dead letters and counted in
+    ``REJECTED_ROWS``, the rest is inserted. Must run inside a transaction.
+    Returns the number of rows inserted.
+    """
+    cur.execute('SAVEPOINT insert_rows')
+    try:
+        extras.execute_values(cur, INSERT_SQL.format(table=table), rows, page_size=len(rows))
+        inserted = len(rows)
+    except DATA_ERRORS as e:
+        cur.execute('ROLLBACK TO SAVEPOINT insert_rows')
+        if len(rows) == 1:
+            REJECTED_ROWS.labels(table).inc()
+            logger.error(f'☠️ Dead letter for {table}: {str(e).strip()} | row={rows[0]!r:.500}')
+            inserted = 0
+        else:
+            middle = len(rows) // 2
+            inserted = insert_rows(cur, table, rows[:middle]) + insert_rows(cur, table, rows[middle:])
+    cur.execute('RELEASE SAVEPOINT insert_rows')
+    return inserted
+
+
+class BatchWriter:
+    """Buffer rows for the lake tables and write them in batches.
+
+    Rows are appended with ``add`` and written when a table buffer reaches
+    ``max_rows`` or every ``flush_interval`` seconds, whichever comes first.
+    Each flush is a single transaction over one long-lived connection that is
+    re-opened when it breaks. Table names come from the validated routing
+    config and must share the lake schema (topic, payload, value, timestamp).
+    Rows the database rejects are isolated and left out without losing the
+    rest of the batch (see ``insert_rows``). When the database stays
+    unreachable, or fails for a reason unrelated to the rows, batches go to
+    ``spool`` (if given) instead of being dropped, and a ``SpoolDrainer``
+    replays them later. After a failed connection attempt, batches go straight
+    to the spool without reconnecting for ``retry_interval`` seconds, so
+    writers keep draining the queue during an outage.
+    """
+
+    def __init__(self, db_config: dict, max_rows: int = 500, flush_interval: float = 1.0, spool=None,
+                 retry_interval: float = 5.0):
+        self.db_config = db_config
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self._offline_until = 0.0
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._buffers = {}
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._conn = None
+        self._has_connected = False
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._flush_periodically, name='batch-writer', daemon=True)
+        self._timer.start()
+
+    def add(self, table: str, row: tuple):
+        """Queue a ``(topic, payload_json, value, timestamp)`` row for ``table``."""
+        with self._buffer_lock:
+            buffer = self._buffers.setdefault(table, [])
+            buffer.append(row)
+            is_full = len(buffer) >= self.max_rows
+        if is_full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered row in one transaction. Returns rows written."""
+        with self._write_lock:
+            with self._buffer_lock:
+                pending, self._buffers = self._buffers, {}
+            if not pending:
+                return 0
+            return self._write(pending)
+
+    def close(self):
+        """Stop the flush timer, write what is left and close the connection."""
+        self._stop.set()
+        self._timer.join(timeout=self.flush_interval + 1)
+        self.flush()
+        self._disconnect()
+        logger.info('🔌 Batch writer closed')
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'❌ Error in periodic flush: {e}')
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**self.db_config)
+            if self._has_connected:
+                RECONNECTS.inc()
+            self._has_connected = True
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+    def _rollback(self):
+        # The connection may already be gone after the error; drop it so the next write reconnects
+        try:
+            self._conn.rollback()
+        except (psycopg2.Error, AttributeError):
+            self._disconnect()
+
+    def _write(self, pending: dict) -> int:
+        total = sum(len(rows) for rows in pending.values())
+        if self.spool is not None and time.monotonic() < self._offline_until:
+            return self._spool(pending, total)
+        # One retry covers a connection that went stale (e.g. Postgres restart)
+        for attempt in range(2):
+            try:
+                with FLUSH_SECONDS.time():
+                    conn = self._connection()
+                    with conn.cursor() as cur:
+                        written = {table: insert_rows(cur, table, rows) for table, rows in pending.items()}
+                    conn.commit()
+                BATCH_ROWS.observe(total)
+                for table, count in written.items():
+                    ROWS_WRITTEN.labels(table).inc(count)
+                counts = ', '.join(f'{table}={count}' for table, count in written.items())
+                logger.info(f'💾 Flushed {sum(written.values())} rows ({counts})')
+                return sum(written.values())
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logger.warning(f'⚠️ Database connection lost during flush (attempt {attempt + 1}/2): {e}')
+                self._disconnect()
+                if attempt == 1 and self.spool is not None:
+                    self._offline_until = time.monotonic() + self.retry_interval
+                    logger.warning(f'📼 Database unreachable, spooling batches for {self.retry_interval:g}s before retrying')
+            except psycopg2.Error as e:
+                # Not caused by a row (bad rows are isolated by insert_rows): keep the batch for later
+                logger.error(f'❌ Error flushing batch of {total} rows: {e}')
+                self._rollback()
+                break
+        FLUSH_FAILURES.inc()
+        if self.spool is not None:
+            return self._spool(pending, total)
+        logger.error(f'❌ Dropped batch of {total} rows that could not be written')
+        return 0
+
+    def _spool(self, pending: dict, total: int) -> int:
+        items = [(table, row) for table, rows in pending.items() for row in rows]
+        if self.spool.append(items) and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('📼 Spooled batch of %d rows to disk until it can be written', total)
+        return 0
@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+
+from batch_writer import BatchWriter
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+DROPPED = Counter('subscriber_queue_dropped_total', 'Queued rows discarded by the drop_oldest policy')
+SPILLED = Counter('subscriber_queue_spilled_total', 'Rows written to the spool because the queue was full')
+
+# Backpressure policies applied when the queue is full
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_SPILL = 'spill'
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL)
+
+
+class IngestQueue:
+    """Bounded hand-off between the MQTT callback and the writer threads.
+
+    Items are ``(table, row)`` tuples. When the queue is full ``put`` applies
+    the configured policy: ``block`` waits for room, ``drop_oldest`` discards
+    the oldest queued item and ``spill`` appends the item to the on-disk
+    ``Spool``, whose drainer replays it into the database.
+    """
+
+    def __init__(self, maxsize: int = 10000, policy: str = POLICY_BLOCK, spool=None):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown backpressure policy: {policy} (expected one of {POLICIES})')
+        if policy == POLICY_SPILL and spool is None:
+            raise ValueError('spill policy requires a spool')
+        self.policy = policy
+        self.spool = spool
+        self.dropped = 0
+        self.spilled = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def put(self, item: tuple):
+        if self.policy == POLICY_BLOCK:
+            self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        with self._lock:
+            if self.policy == POLICY_SPILL:
+                self._spill(item)
+                return
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                    DROPPED.inc()
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    continue
+
+    def get(self, timeout: float):
+        """Return the next item, or ``None`` if nothing arrived within ``timeout``."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {'depth': self.depth(), 'dropped': self.dropped, 'spilled': self.spilled}
+
+    def _spill(self, item: tuple):
+        if self.spool.append([item]):
+            self.spilled += 1
+            SPILLED.inc()
+
+
+class WriterPool:
+    """Pool of threads draining an ``IngestQueue`` into their own ``BatchWriter``.
+
+    Each worker owns a connection, so a slow flush on one worker does not hold
+    up the others and never reaches the MQTT network thread.
+    """
+
+    def __init__(self, ingest_queue: IngestQueue, db_config: dict, workers: int = 2,
+                 max_rows: int = 500, flush_interval: float = 1.0, spool=None, retry_interval: float = 5.0):
+        self.queue = ingest_queue
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._writers = [BatchWriter(db_config, max_rows=max_rows, flush_interval=flush_interval, spool=spool,
+                                     retry_interval=retry_interval)
+                         for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(w,), name=f'db-writer-{i}', daemon=True)
+            for i, w in enumerate(self._writers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Drain the queue, stop the workers and flush their writers."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        for writer in self._writers:
+            writer.close()
+        logger.info('🔌 Writer pool closed')
+
+    def _work(self, writer: BatchWriter):
+        while True:
+            item = self.queue.get(timeout=self.flush_interval)
+            if item is None:
+                if self._stop.is_set():
+                    return
+                continue
+            table, row = item
+            try:
+                writer.add(table, row)
+            except Exception as e:
+                logger.error(f'❌ Error writing queued row: {e}')
@@ -0,0 +1,209 @@
+"""Minimal Prometheus text-format metrics (stdlib only).
+
+Metrics register themselves in a module-level registry when created; the
+``/metrics`` endpoint started with ``start_metrics_server`` renders all of
+them. Labelled metrics are used through ``.labels(value, ...)``.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond inserts to slow API calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        # Children are cached so hot paths do not rebuild them on every call
+        self._children = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            child = self._children.setdefault(values, _Child(self, tuple(str(v) for v in values)))
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.extend(self._render_sample(labelvalues, value))
+        return lines
+
+    def _render_sample(self, labelvalues, value):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}']
+
+
+class _Child:
+    """A metric bound to one set of label values."""
+
+    def __init__(self, metric, labelvalues):
+        for attr in ('inc', 'set', 'observe', 'time'):
+            method = getattr(metric, f'_{attr}', None)
+            if method is not None:
+                setattr(self, attr, functools.partial(method, labelvalues))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def _inc(self, labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value):
+        self._set((), value)
+
+    def set_function(self, function):
+        """Read the value from ``function()`` at scrape time (unlabelled gauges only)."""
+        self._function = function
+
+    def _set(self, labelvalues, value):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self):
+        if self._function is not None:
+            self._set((), self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        self._observe((), value)
+
+    @contextmanager
+    def time(self):
+        with self._time(()):
+            yield
+
+    def _observe(self, labelvalues, value):
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def _time(self, labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(labelvalues, time.perf_counter() - started)
+
+    def _render_sample(self, labelvalues, state):
+        bucket_counts, count, total = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, labelvalues, [('le', '+Inf')])
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        plain = _format_labels(self.labelnames, labelvalues)
+        lines.append(f'{self.name}_count{plain} {count}')
+        lines.append(f'{self.name}_sum{plain} {_format_value(total)}')
+        return lines
+
+    def render(self):
+        # Copy the mutable per-label state under the lock before formatting
+        with self._lock:
+            items = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labelvalues, state in items:
+            lines.extend(self._render_sample(labelvalues, state))
+        return lines
+
+
+def render_metrics() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+
+def start_metrics_server(port: int, addr: str = '0.0.0.0'):
+    """Serve ``/metrics`` from a daemon thread. Returns the HTTP server."""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f'📈 Metrics available on http://{addr}:{port}/metrics')
+    return server
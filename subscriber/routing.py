@@ -0,0 +1,142 @@
+import json
+import math
+import re
+
+# Table names end up in SQL text, so only plain identifiers are accepted
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+VALUE_TYPES = ('int', 'float')
+
+# 'int' routes write to INTEGER columns; anything outside INT4 would fail the whole insert
+INT4_MIN, INT4_MAX = -2**31, 2**31 - 1
+
+# Used when no ROUTES_FILE is configured: the two raw lake topics
+DEFAULT_ROUTES = [
+    {'filter': 'lake/raw/int', 'table': 'lake_raw_data_int', 'value_type': 'int'},
+    {'filter': 'lake/raw/float', 'table': 'lake_raw_data_float', 'value_type': 'float'},
+]
+
+
+def filter_to_regex(topic_filter: str) -> str:
+    """Translate an MQTT topic filter (``+``/``#`` wildcards) to a regex fragment."""
+    levels = topic_filter.split('/')
+    parts = []
+    for i, level in enumerate(levels):
+        if level == '#':
+            if i != len(levels) - 1:
+                raise ValueError(f"'#' must be the last level in topic filter: {topic_filter}")
+            # 'a/#' also matches 'a' itself
+            return ('/'.join(parts) + '(?:/.*)?') if parts else '.*'
+        if level == '+':
+            parts.append('[^/]*')
+        elif '+' in level or '#' in level:
+            raise ValueError(f'Wildcards must occupy a whole level in topic filter: {topic_filter}')
+        else:
+            parts.append(re.escape(level))
+    return '/'.join(parts)
+
+
+class Route:
+    """One routing rule: topic filter -> target table, value type and bounds."""
+
+    def __init__(self, filter: str, table: str, value_type: str, min_value=None, max_value=None, qos: int = 0,
+                 thresholds=()):
+        if not _IDENTIFIER.match(table):
+            raise ValueError(f'Invalid table name in route {filter}: {table}')
+        if value_type not in VALUE_TYPES:
+            raise ValueError(f'Invalid value_type in route {filter}: {value_type} (expected one of {VALUE_TYPES})')
+        filter_to_regex(filter)
+        self.filter = filter
+        self.table = table
+        self.value_type = value_type
+        self.min_value = min_value
+        self.max_value = max_value
+        self.qos = qos
+        # Alert levels for the anomaly detector (crossings in either direction)
+        self.thresholds = tuple(sorted(float(t) for t in thresholds))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            data['filter'], data['table'], data['value_type'],
+            min_value=data.get('min'), max_value=data.get('max'), qos=int(data.get('qos', 0)),
+            thresholds=data.get('thresholds', ()),
+        )
+
+    def coerce(self, value):
+        """Return the value converted to the route's type, or ``None`` if it is not valid."""
+        if self.value_type == 'int':
+            if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+                value = int(value)
+            else:
+                return None
+            if not INT4_MIN <= value <= INT4_MAX:
+                return None
+        elif isinstance(value, (int, float)):
+            try:
+                value = float(value)
+            except OverflowError:
+                return None
+            # NaN/Infinity (accepted by the stdlib json fallback) are not measurements
+            if not math.isfinite(value):
+                return None
+        else:
+            return None
+        if self.min_value is not None and value < self.min_value:
+            return None
+        if self.max_value is not None and value > self.max_value:
+            return None
+        return value
+
+
+class Router:
+    """Match topics against the routes, first declared route wins.
+
+    All filters are compiled into one regex alternation; results are cached
+    per topic because a deployment only ever sees a bounded set of topics.
+    """
+
+    CACHE_SIZE = 10000
+
+    def __init__(self, routes: list):
+        if not routes:
+            raise ValueError('At least one route is required')
+        self.routes = routes
+        alternatives = []
+        for i, route in enumerate(routes):
+            fragment = filter_to_regex(route.filter)
+            # Wildcards at the first level must not match $SYS-style topics
+            if route.filter[:1] in ('+', '#'):
+                fragment = r'(?!\$)' + fragment
+            alternatives.append(f'(?P<r{i}>{fragment})')
+        self._pattern = re.compile('^(?:' + '|'.join(alternatives) + ')$')
+        self._cache = {}
+
+    def match(self, topic: str):
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        m = self._pattern.match(topic)
+        route = self.routes[int(m.lastgroup[1:])] if m else None
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[topic] = route
+        return route
+
+    def subscriptions(self) -> list:
+        """``(filter, qos)`` pairs to subscribe to, one per distinct filter."""
+        seen = {}
+        for route in self.routes:
+            seen[route.filter] = max(seen.get(route.filter, 0), route.qos)
+        return list(seen.items())
+
+
+def load_routes(path: str = None) -> list:
+    """Load routes from a JSON file (a list of route objects), or the defaults when no path is given."""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    else:
+        data = DEFAULT_ROUTES
+    return [Route.from_dict(item) for item in data]
@@ -0,0 +1,327 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2
+
+from batch_writer import insert_rows
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SPOOLED_ROWS = Counter('subscriber_spool_rows_total', 'Rows written to the on-disk spool')
+SPOOL_REJECTED = Counter('subscriber_spool_rejected_total', 'Rows dropped because the spool reached its size limit')
+REPLAYED_ROWS = Counter('subscriber_spool_replayed_total', 'Spooled rows replayed into PostgreSQL')
+REPLAY_FAILURES = Counter('subscriber_spool_replay_failures_total', 'Spooled rows discarded because PostgreSQL rejected them')
+SPOOL_CORRUPT_LINES = Counter('subscriber_spool_corrupt_lines_total', 'Spool lines skipped because they could not be decoded')
+SPOOL_BYTES = Gauge('subscriber_spool_bytes', 'Bytes currently held in spool segments')
+SPOOL_QUARANTINE_BYTES = Gauge('subscriber_spool_quarantine_bytes', 'Bytes held in quarantined spool segments')
+
+
+# Lock files of the spool directories claimed by this process, held until it exits
+_CLAIMED = []
+
+
+def claim_directory(root: str) -> tuple:
+    """Lock a spool directory under ``root`` that no other process is using; returns ``(path, slot)``.
+
+    Replicas sharing one volume each get their own directory: ``root`` itself
+    first (where a single instance keeps its segments), then ``root/replica-N``.
+    The lock goes away with the process, so a restarted or new replica takes
+    over, and replays, whatever a previous one left behind.
+    """
+    n = 0
+    while True:
+        path = root if n == 0 else os.path.join(root, f'replica-{n}')
+        os.makedirs(path, exist_ok=True)
+        fd = os.open(os.path.join(path, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            n += 1
+            continue
+        _CLAIMED.append(fd)
+        return path, n
+
+
+class Spool:
+    """Append-only, segmented on-disk buffer of ``(table, row)`` items.
+
+    Items are written as JSON lines to the current segment, which is sealed
+    once it reaches ``segment_bytes``. Writes are flushed to the OS on every
+    append and fsync'ed at most every ``fsync_interval`` seconds, on rotation
+    and on close. When the segments, quarantined ones included, add up to
+    ``max_bytes`` new items are rejected, so quarantined files have to be
+    inspected and removed to free their space. Segments left over from a
+    previous run are picked up on start.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, fsync_interval: float = 1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith('segment-') and name.endswith('.jsonl.tmp'):
+                # Left by a crash inside rewrite_segment before the rename; the original segment is intact
+                os.remove(os.path.join(directory, name))
+        self._sealed = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith('segment-') and name.endswith('.jsonl')
+        )
+        self._bytes = sum(os.path.getsize(path) for path in self._sealed)
+        self._quarantine_bytes = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+            if name.startswith('quarantine-') and name.endswith('.jsonl')
+        )
+        self._next_seq = (int(os.path.basename(self._sealed[-1])[8:20]) + 1) if self._sealed else 0
+        self._current = None
+        self._current_path = None
+        self._current_bytes = 0
+        self._last_fsync = time.monotonic()
+        self._full = False
+        SPOOL_BYTES.set_function(lambda: self._bytes)
+        SPOOL_QUARANTINE_BYTES.set_function(lambda: self._quarantine_bytes)
+        if self._sealed:
+            logger.info(f'📼 Found {len(self._sealed)} spool segments ({self._bytes} bytes) to replay')
+
+    def append(self, items: list) -> int:
+        """Write items to the spool. Returns how many were accepted."""
+        data = ''.join(self._encode(item) for item in items).encode('utf-8')
+        with self._lock:
+            if self._bytes + self._quarantine_bytes + len(data) > self.max_bytes:
+                SPOOL_REJECTED.inc(len(items))
+                if not self._full:
+                    # Logged once per episode; SPOOL_REJECTED counts every dropped row
+                    logger.error(f'❌ Spool full ({self._bytes} bytes, {self._quarantine_bytes} quarantined), '
+                                 f'dropping rows until it drains')
+                    self._full = True
+                return 0
+            self._full = False
+            if self._current is None:
+                self._open_segment()
+            self._current.write(data)
+            self._current.flush()
+            self._current_bytes += len(data)
+            self._bytes += len(data)
+            if self._current_bytes >= self.segment_bytes:
+                self._seal()
+            elif time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+        SPOOLED_ROWS.inc(len(items))
+        return len(items)
+
+    def oldest_segment(self):
+        """Path of the oldest segment ready for replay, sealing the current one if needed."""
+        with self._lock:
+            if not self._sealed and self._current is not None:
+                self._seal()
+            return self._sealed[0] if self._sealed else None
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._sealed) or self._current is not None
+
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def quarantine_bytes(self) -> int:
+        return self._quarantine_bytes
+
+    def read_segment(self, path: str) -> list:
+        """Decode a segment. Lines that cannot be decoded are logged as dead letters and skipped,
+        so one corrupt line cannot block the replay of everything spooled after it."""
+        items = []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith('\n'):
+                    # Torn last line from a crash mid-write
+                    break
+                try:
+                    table, topic, payload_json, value, ts = json.loads(line)
+                    items.append((table, (topic, payload_json, value, datetime.fromisoformat(ts))))
+                except (ValueError, TypeError) as e:
+                    SPOOL_CORRUPT_LINES.inc()
+                    logger.error(f'☠️ Dead letter in {os.path.basename(path)}:{number}: {e} | line={line!r:.500}')
+        return items
+
+    def remove_segment(self, path: str):
+        with self._lock:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._sealed.remove(path)
+            self._bytes -= size
+
+    def quarantine_segment(self, path: str) -> str:
+        """Move a segment that keeps failing out of the replay queue (renamed to quarantine-*.jsonl).
+
+        Segment numbers start over when the spool restarts empty, so the name gets a
+        timestamp and a random suffix; an earlier quarantined file is never
+        overwritten. Its bytes still count against ``max_bytes``.
+        """
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        target = os.path.join(self.directory, f'quarantine-{stamp}-{uuid.uuid4().hex[:8]}-{os.path.basename(path)}')
+        with self._lock:
+            size = os.path.getsize(path)
+            os.rename(path, target)
+            self._sealed.remove(path)
+            self._bytes -= size
+            self._quarantine_bytes += size
+        return target
+
+    def rewrite_segment(self, path: str, items: list):
+        """Replace a sealed segment with the items that are still unreplayed."""
+        data = ''.join(self._encode(item) for item in items).encode('utf-8')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            size = os.path.getsize(path)
+            os.replace(tmp, path)
+            self._bytes += len(data) - size
+
+    def close(self):
+        with self._lock:
+            if self._current is not None:
+                self._seal()
+
+    @staticmethod
+    def _encode(item: tuple) -> str:
+        table, (topic, payload_json, value, ts) = item
+        return json.dumps([table, topic, payload_json, value, ts.isoformat()]) + '\n'
+
+    def _open_segment(self):
+        self._current_path = os.path.join(self.directory, f'segment-{self._next_seq:012d}.jsonl')
+        self._next_seq += 1
+        self._current = open(self._current_path, 'ab')
+        self._current_bytes = 0
+
+    def _fsync(self):
+        os.fsync(self._current.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _seal(self):
+        self._fsync()
+        self._current.close()
+        self._sealed.append(self._current_path)
+        self._current = None
+        self._current_path = None
+
+
+class SpoolDrainer:
+    """Replays spool segments into PostgreSQL once it is reachable again.
+
+    Segments are replayed oldest first in batches of ``batch_rows``, each
+    batch in its own transaction; a segment is deleted after its last batch
+    commits. ``rows_per_second`` caps the replay rate so catch-up does not
+    starve live ingest. On shutdown or a lost connection the unreplayed tail
+    of the segment is written back; a crash mid-segment replays the whole
+    segment again. Rows the database rejects are isolated and left out as
+    ``BatchWriter`` does for live batches, and undecodable lines are skipped;
+    any other error keeps the rest of the segment on disk and the replay is
+    retried later. A segment that fails ``max_attempts`` times in a row while
+    the database is reachable is moved aside as ``quarantine-*.jsonl``.
+    """
+
+    def __init__(self, spool: Spool, db_config: dict, batch_rows: int = 1000,
+                 rows_per_second: float = 5000, idle_interval: float = 5.0, max_attempts: int = 5):
+        self.spool = spool
+        self.db_config = db_config
+        self.batch_rows = batch_rows
+        self.rows_per_second = rows_per_second
+        self.idle_interval = idle_interval
+        self.max_attempts = max_attempts
+        self._conn = None
+        # Consecutive non-connection failures of the oldest segment
+        self._failed_path = None
+        self._failures = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.spool.has_pending():
+                self._stop.wait(self.idle_interval)
+                continue
+            path = None
+            try:
+                # Connect before sealing the live segment, so an outage does not leave a trail of tiny segments
+                if self._conn is None or self._conn.closed:
+                    self._conn = psycopg2.connect(**self.db_config)
+                path = self.spool.oldest_segment()
+                if path is not None:
+                    self._replay(path)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logger.warning(f'⚠️ Spool replay paused, database unavailable: {e}')
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = None
+                self._stop.wait(self.idle_interval)
+            except Exception as e:
+                logger.error(f'❌ Error replaying spool segment {path}: {e}')
+                self._record_failure(path)
+                self._stop.wait(self.idle_interval)
+            else:
+                self._failed_path, self._failures = None, 0
+
+    def _record_failure(self, path):
+        """After max_attempts failures in a row, quarantine the segment so later ones are not blocked."""
+        if path is None or not os.path.exists(path):
+            return
+        self._failures = self._failures + 1 if path == self._failed_path else 1
+        self._failed_path = path
+        if self._failures >= self.max_attempts:
+            target = self.spool.quarantine_segment(path)
+            logger.error(f'☠️ Spool segment failed {self._failures} times, moved to {target} for inspection')
+            self._failed_path, self._failures = None, 0
+
+    def _replay(self, path: str):
+        items = self.spool.read_segment(path)
+        for start in range(0, len(items), self.batch_rows):
+            if self._stop.is_set():
+                self.spool.rewrite_segment(path, items[start:])
+                return
+            started = time.monotonic()
+            batch = items[start:start + self.batch_rows]
+            by_table = {}
+            for table, row in batch:
+                by_table.setdefault(table, []).append(row)
+            try:
+                with self._conn.cursor() as cur:
+                    inserted = sum(insert_rows(cur, table, rows) for table, rows in by_table.items())
+                self._conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.spool.rewrite_segment(path, items[start:])
+                raise
+            except psycopg2.Error:
+                # Not caused by the rows: keep them on disk and retry the segment later
+                self._conn.rollback()
+                self.spool.rewrite_segment(path, items[start:])
+                raise
+            REPLAYED_ROWS.inc(inserted)
+            if inserted < len(batch):
+                REPLAY_FAILURES.inc(len(batch) - inserted)
+            # Rate limit: each batch takes at least len(batch) / rows_per_second seconds
+            remaining = len(batch) / self.rows_per_second - (time.monotonic() - started)
+            if remaining > 0:
+                self._stop.wait(remaining)
+        self.spool.remove_segment(path)
+        logger.info(f'📼 Replayed {len(items)} spooled rows from {os.path.basename(path)}')
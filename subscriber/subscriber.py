@@ -2,11 +2,26 @@ import ssl
 import json
 import time
 import os
+import signal
+import socket
 import logging
+import threading
 import paho.mqtt.client as mqtt
-import psycopg2
 from datetime import datetime
 
+try:
+    # Optional faster parser; the stdlib json module is used when it is not installed
+    import orjson
+    parse_json = orjson.loads
+except ImportError:
+    parse_json = json.loads
+
+from ingest_queue import IngestQueue, WriterPool
+from spool import Spool, SpoolDrainer, claim_directory
+from anomaly import AnomalyDetector, AlertSink
+from routing import Router, load_routes
+from metrics import Counter, Gauge, start_metrics_server
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -15,7 +30,23 @@ BROKER = os.environ.get('MQTT_BROKER', 'mosquitto')
 PORT = int(os.environ.get('MQTT_PORT', '1883'))
 USERNAME = os.environ.get('MQTT_USER', '')
 PASSWORD = os.environ.get('MQTT_PASS', '')
-TOPIC = os.environ.get('MQTT_TOPIC', '#')
+
+# Scale-out - replicas sharing SUBSCRIBER_GROUP subscribe via $share/<group>/<filter> and the broker
+# splits messages between them. Client IDs must be unique per replica; the container hostname is.
+SUBSCRIBER_GROUP = os.environ.get('SUBSCRIBER_GROUP', '')
+CLIENT_ID = os.environ.get('MQTT_CLIENT_ID', f'iot_subscriber-{socket.gethostname()}')
+# Scaled compose replicas get a new hostname on every recreation; with this set (and no MQTT_CLIENT_ID) the
+# client ID follows the replica's spool slot instead, so its persistent session and detector state survive
+CLIENT_ID_FROM_SPOOL = 'MQTT_CLIENT_ID' not in os.environ and \
+    os.environ.get('MQTT_CLIENT_ID_FROM_SPOOL', 'false').lower() == 'true'
+# Persistent sessions keep our subscriptions and queue QoS>=1 messages on the broker while we restart
+PERSISTENT_SESSION = os.environ.get('MQTT_PERSISTENT_SESSION', 'true' if SUBSCRIBER_GROUP else 'false').lower() == 'true'
+MIN_QOS = int(os.environ.get('MQTT_MIN_QOS', '1' if PERSISTENT_SESSION else '0'))
+
+# Topic routing - JSON list of {filter, table, value_type[, min, max, qos, thresholds]}; defaults to lake/raw/int + lake/raw/float.
+# Only the routed filters are subscribed, so unrouted traffic is never delivered.
+ROUTES_FILE = os.environ.get('ROUTES_FILE', '')
+router = Router(load_routes(ROUTES_FILE or None))
 
 # PostgreSQL Configuration
 DB_CONFIG = {
@@ -23,199 +54,101 @@ DB_CONFIG = {
     'port': int(os.environ.get('DB_PORT', '5432')),
     'database': os.environ.get('DB_NAME', 'sensordata'),
     'user': os.environ.get('DB_USER', 'user'),
-    'password': os.environ.get('DB_PASSWORD', 'password')
+    'password': os.environ.get('DB_PASSWORD', 'password'),
+    # Bounded connect so writers fall back to the spool quickly instead of hanging while Postgres is down
+    'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
 }
+# After a failed connection, batches go straight to the spool for this long before the next attempt
+DB_RETRY_SECONDS = float(os.environ.get('DB_RETRY_SECONDS', '5'))
 
-def get_db_connection():
-    """Create and return a PostgreSQL connection"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        logger.error(f"❌ Database connection error: {e}")
-        raise
+# Batch writer Configuration - flush on whichever threshold is hit first
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', '500'))
+BATCH_FLUSH_SECONDS = float(os.environ.get('BATCH_FLUSH_SECONDS', '1.0'))
 
-def insert_int(topic: str, payload: dict, value: int):
-    """Insert integer value into lake_raw_data_int table"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO lake_raw_data_int (topic, payload, value, timestamp)
-            VALUES (%s, %s, %s, %s)
-            """,
-            (topic, json.dumps(payload), value, datetime.now()),
-        )
-        conn.commit()
-        logger.info(f'✅ INT inserted: topic={topic}, value={value}')
-        cur.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f'❌ Error inserting INT: {e}')
+# Queue between on_message and the DB writer threads
+QUEUE_MAX_SIZE = int(os.environ.get('QUEUE_MAX_SIZE', '10000'))
+QUEUE_POLICY = os.environ.get('QUEUE_POLICY', 'block')  # block | drop_oldest | spill
+WRITER_WORKERS = int(os.environ.get('WRITER_WORKERS', '2'))
+STATS_INTERVAL_SECONDS = float(os.environ.get('STATS_INTERVAL_SECONDS', '30'))
 
-def insert_float(topic: str, payload: dict, value: float):
-    """Insert float value into lake_raw_data_float table"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO lake_raw_data_float (topic, payload, value, timestamp)
-            VALUES (%s, %s, %s, %s)
-            """,
-            (topic, json.dumps(payload), value, datetime.now()),
-        )
-        conn.commit()
-        logger.info(f'✅ FLOAT inserted: topic={topic}, value={value}')
-        cur.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f'❌ Error inserting FLOAT: {e}')
-
-def on_connect(client, userdata, flags, rc):
-    """Callback for when the client connects"""
-    if rc == 0:
-        logger.info('✅ Connected to MQTT Broker successfully')
-        client.subscribe(TOPIC)
-        logger.info(f'📡 Subscribed to topic: {TOPIC}')
-    else:
-        logger.error(f'❌ Connection failed with code {rc}')
-
-def on_disconnect(client, userdata, rc):
-    """Callback for when the client disconnects"""
-    if rc != 0:
-        logger.warning(f'⚠️ Unexpected disconnection: {rc}')
-    else:
-        logger.info('👋 Disconnected from MQTT Broker')
+# Durable spool - rows that cannot reach PostgreSQL (or overflow the queue with QUEUE_POLICY=spill) are
+# appended to segment files in SPOOL_DIR and replayed at a bounded rate once the database is back.
+# SPOOL_DIR must outlive the container (docker-compose.yml mounts the subscriber_spool volume there)
+SPOOL_DIR = os.environ.get('SPOOL_DIR', '/var/lib/subscriber/spool')
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', str(1024 * 1024 * 1024)))
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SPOOL_FSYNC_SECONDS = float(os.environ.get('SPOOL_FSYNC_SECONDS', '1.0'))
+SPOOL_REPLAY_ROWS_PER_SEC = float(os.environ.get('SPOOL_REPLAY_ROWS_PER_SEC', '5000'))
+SPOOL_REPLAY_BATCH_ROWS = int(os.environ.get('SPOOL_REPLAY_BATCH_ROWS', '1000'))
 
-def on_message(client, userdata, msg):
-    """Callback for when a message is received"""
-    try:
-        payload_str = msg.payload.decode('utf-8')
-        payload = json.loads(payload_str)
-        value = payload.get('value')
-        
-        if value is None:
-            logger.warning(f"⚠️ No 'value' key in payload: {payload}")
-            return
-        
-        # Route to appropriate table based on topic
-        if msg.topic == "lake/raw/int":
-            if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
-                insert_int(msg.topic, payload, int(value))
-            else:
-                logger.warning(f"⚠️ Expected INT but got {type(value).__name__}: {value}")
-        
-        elif msg.topic == "lake/raw/float":
-            if isinstance(value, (int, float)):
-                insert_float(msg.topic, payload, float(value))
-            else:
-                logger.warning(f"⚠️ Expected FLOAT but got {type(value).__name__}: {value}")
-        else:
-            logger.debug(f'📨 Message from {msg.topic}: {value}')
-    
-    except Exception as e:
-        logger.error(f'❌ Error processing message: {e}')
+# Streaming anomaly detection per topic - alerts go to alert_events (see anomaly.py)
+ANOMALY_DETECTION = os.environ.get('ANOMALY_DETECTION', 'true').lower() == 'true'
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', '4'))
+ANOMALY_IQR_FENCE = float(os.environ.get('ANOMALY_IQR_FENCE', '3'))
+ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', '0.05'))
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', '30'))
+ANOMALY_QUANTILE_WINDOW = int(os.environ.get('ANOMALY_QUANTILE_WINDOW', '1000'))
+# Floor for the std/IQR as a fraction of the baseline, so flat series that jump are still flagged
+ANOMALY_MIN_SCALE = float(os.environ.get('ANOMALY_MIN_SCALE', '0.001'))
+ALERT_FLUSH_SECONDS = float(os.environ.get('ALERT_FLUSH_SECONDS', '5'))
+# Detector state keys are 'mqtt:<topic>', kept apart from the ingestion job's 'station:<id>:parameter:<id>'.
+# In a SUBSCRIBER_GROUP each replica only sees its share of every topic, so state is kept per replica as
+# 'mqtt:<client id>:<topic>'; persistent sessions already need a stable MQTT_CLIENT_ID per replica.
+ANOMALY_KEY_PREFIX = f'mqtt:{CLIENT_ID}:' if SUBSCRIBER_GROUP else 'mqtt:'
 
-def on_log(client, userdata, level, buf):
-    """Callback for logging"""
-    logger.debug(f'🔍 MQTT LOG: {buf}')
+# Hot-path warnings (bad payloads) are logged for the first occurrence and then once every N
+LOG_SAMPLE_EVERY = max(1, int(os.environ.get('LOG_SAMPLE_EVERY', '100')))
 
-def main():
-    """Main function to start MQTT subscriber"""
-    logger.info("🚀 Starting MQTT Subscriber...")
-    logger.info(f"📍 Broker: {BROKER}:{PORT}")
-    logger.info(f"👤 Database: {DB_CONFIG['database']}@{DB_CONFIG['host']}")
-    
-    client = mqtt.Client(protocol=mqtt.MQTTv311, client_id="iot_subscriber")
-    
-    # Set credentials if provided
-    if USERNAME and PASSWORD:
-        client.username_pw_set(USERNAME, PASSWORD)
-    
-    # Set callbacks
-    client.on_connect = on_connect
-    client.on_disconnect = on_disconnect
-    client.on_message = on_message
-    client.on_log = on_log
-    
-    try:
-        logger.info(f"🔗 Connecting to {BROKER}:{PORT}...")
-        client.connect(BROKER, PORT, keepalive=60)
-        logger.info("🔄 Starting network loop...")
-        client.loop_forever()
-    except KeyboardInterrupt:
-        logger.info("⛔ Subscriber interrupted by user")
-        client.disconnect()
-    except Exception as e:
-        logger.error(f"❌ Error: {e}")
-        client.disconnect()
+# Prometheus-style /metrics endpoint (0 disables it)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9100'))
 
-if __name__ == '__main__':
-    # Wait for PostgreSQL to be ready
-    logger.info("⏳ Waiting for database to be ready...")
-    time.sleep(5)
-    main()
+# Shared ingest queue, spool and anomaly detector, created in main()
+ingest_queue = None
+spool = None
+detector = None
+alert_sink = None
 
+# Labelled by route filter, not by topic: with +/# filters the topics are unbounded, the routes are not
+UNROUTED = '(unrouted)'
+MESSAGES_RECEIVED = Counter('subscriber_messages_received_total', 'MQTT messages received', ['route'])
+PARSE_FAILURES = Counter('subscriber_parse_failures_total', 'Messages whose payload could not be decoded', ['route'])
+INVALID_VALUES = Counter('subscriber_invalid_values_total', 'Messages rejected by value validation', ['route'])
+QUEUE_DEPTH = Gauge('subscriber_queue_depth', 'Rows waiting in the ingest queue')
 
-def get_db_connection():
-    """Create and return a PostgreSQL connection"""
+def enqueue_row(table: str, topic: str, payload_json: str, value, received_at: datetime = None):
+    """Queue a validated value for its route's table"""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
+        ingest_queue.put((table, (topic, payload_json, value, received_at or datetime.now())))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('📥 Queued: table=%s, topic=%s, value=%s', table, topic, value)
     except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+        logger.error(f'❌ Error queuing row for {table}: {e}')
 
-def insert_int(topic: str, payload: dict, value: int):
-    """Insert integer value into lake_raw_data_int table"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO lake_raw_data_int (topic, payload, value, timestamp)
-            VALUES (%s, %s, %s, %s)
-            """,
-            (topic, json.dumps(payload), value, datetime.now()),
-        )
-        conn.commit()
-        logger.info(f'✅ INT inserted: topic={topic}, value={value}')
-        cur.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f'Error inserting INT: {e}')
+_warning_counts = {}
 
-def insert_float(topic: str, payload: dict, value: float):
-    """Insert float value into lake_raw_data_float table"""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO lake_raw_data_float (topic, payload, value, timestamp)
-            VALUES (%s, %s, %s, %s)
-            """,
-            (topic, json.dumps(payload), value, datetime.now()),
-        )
-        conn.commit()
-        logger.info(f'✅ FLOAT inserted: topic={topic}, value={value}')
-        cur.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f'Error inserting FLOAT: {e}')
+def warn_sampled(kind: str, message: str, *args):
+    """Log a hot-path warning lazily, only on the 1st and every LOG_SAMPLE_EVERY-th occurrence per kind"""
+    count = _warning_counts.get(kind, 0) + 1
+    _warning_counts[kind] = count
+    if count % LOG_SAMPLE_EVERY == 1 or LOG_SAMPLE_EVERY == 1:
+        logger.warning(message + ' (occurrence #%d)', *args, count)
+
+def subscription_list():
+    """Routed filters with their QoS, wrapped in $share/<group>/ when running as a group member"""
+    subscriptions = []
+    for topic_filter, qos in router.subscriptions():
+        if SUBSCRIBER_GROUP:
+            topic_filter = f'$share/{SUBSCRIBER_GROUP}/{topic_filter}'
+        subscriptions.append((topic_filter, max(qos, MIN_QOS)))
+    return subscriptions
 
 def on_connect(client, userdata, flags, rc):
     """Callback for when the client connects"""
     if rc == 0:
         logger.info('✅ Connected to MQTT Broker successfully')
-        client.subscribe(TOPIC)
-        logger.info(f'📡 Subscribed to topic: {TOPIC}')
+        subscriptions = subscription_list()
+        client.subscribe(subscriptions)
+        logger.info(f'📡 Subscribed to: {", ".join(f"{f} (QoS {q})" for f, q in subscriptions)}')
     else:
         logger.error(f'❌ Connection failed with code {rc}')
 
@@ -226,51 +159,124 @@ def on_disconnect(client, userdata, rc):
     else:
         logger.info('👋 Disconnected from MQTT Broker')
 
+def decode_message(topic: str, raw: bytes):
+    """Apply the routing and value validation rules to one message.
+
+    Every message is counted under its route's filter (not its topic, which
+    wildcard routes leave unbounded). Returns ``(route, payload_json, value)``
+    for a valid message, or ``None`` after counting and logging why it was
+    rejected.
+    """
+    route = router.match(topic)
+    MESSAGES_RECEIVED.labels(route.filter if route is not None else UNROUTED).inc()
+    if route is None:
+        # Only reachable if the broker delivers outside our subscriptions
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('📨 Unrouted message from %s', topic)
+        return None
+
+    try:
+        payload = parse_json(raw)
+        # The original text goes to the JSONB column as-is, no re-serialization
+        payload_json = raw.decode('utf-8')
+    except ValueError as e:
+        PARSE_FAILURES.labels(route.filter).inc()
+        warn_sampled('parse', '⚠️ Could not decode payload from %s: %s', topic, e)
+        return None
+    value = payload.get('value')
+
+    if value is None:
+        INVALID_VALUES.labels(route.filter).inc()
+        warn_sampled('missing', "⚠️ No 'value' key in payload: %s", payload_json)
+        return None
+
+    converted = route.coerce(value)
+    if converted is None:
+        INVALID_VALUES.labels(route.filter).inc()
+        warn_sampled(route.filter, '⚠️ Invalid %s value on %s: %r', route.value_type.upper(), topic, value)
+        return None
+    return route, payload_json, converted
+
+def detect_anomalies(route, topic: str, value, received_at: datetime):
+    """Run the streaming detector on a validated value and hand any alerts to the sink"""
+    alerts = detector.observe(ANOMALY_KEY_PREFIX + topic, value, received_at, route.thresholds)
+    if alerts:
+        alert_sink.add(alerts)
+
 def on_message(client, userdata, msg):
     """Callback for when a message is received"""
+    topic = msg.topic
     try:
-        payload_str = msg.payload.decode('utf-8')
-        payload = json.loads(payload_str)
-        value = payload.get('value')
-        
-        if value is None:
-            logger.warning(f"⚠️ No 'value' key in payload: {payload}")
-            return
-        
-        # Route to appropriate table based on topic
-        if msg.topic == "lake/raw/int":
-            if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
-                insert_int(msg.topic, payload, int(value))
-            else:
-                logger.warning(f"⚠️ Expected INT but got {type(value).__name__}: {value}")
-        
-        elif msg.topic == "lake/raw/float":
-            if isinstance(value, (int, float)):
-                insert_float(msg.topic, payload, float(value))
-            else:
-                logger.warning(f"⚠️ Expected FLOAT but got {type(value).__name__}: {value}")
-        else:
-            logger.debug(f'Message from {msg.topic}: {value}')
-    
+        decoded = decode_message(topic, msg.payload)
+        if decoded is not None:
+            route, payload_json, value = decoded
+            received_at = datetime.now()
+            enqueue_row(route.table, topic, payload_json, value, received_at)
+            if detector is not None:
+                detect_anomalies(route, topic, value, received_at)
     except Exception as e:
-        logger.error(f'Error processing message: {e}')
+        logger.error(f'❌ Error processing message: {e}')
 
 def on_log(client, userdata, level, buf):
     """Callback for logging"""
-    logger.debug(f'MQTT LOG: {buf}')
+    logger.debug('🔍 MQTT LOG: %s', buf)
+
+def report_queue_stats(stop: threading.Event):
+    """Periodically log queue depth and backpressure counters"""
+    while not stop.wait(STATS_INTERVAL_SECONDS):
+        stats = ingest_queue.stats()
+        logger.info(f"📊 Queue depth={stats['depth']} dropped={stats['dropped']} spilled={stats['spilled']}"
+                    f" spool_bytes={spool.size_bytes()}")
+
+def claim_spool_dir() -> str:
+    """Claim this replica's own directory in the shared spool volume (and its client ID, see CLIENT_ID_FROM_SPOOL)"""
+    global CLIENT_ID, ANOMALY_KEY_PREFIX
+    spool_dir, slot = claim_directory(SPOOL_DIR)
+    if CLIENT_ID_FROM_SPOOL:
+        CLIENT_ID = f"iot_subscriber-{SUBSCRIBER_GROUP or 'single'}-{slot}"
+        ANOMALY_KEY_PREFIX = f'mqtt:{CLIENT_ID}:' if SUBSCRIBER_GROUP else 'mqtt:'
+    return spool_dir
 
 def main():
     """Main function to start MQTT subscriber"""
+    global ingest_queue, spool, detector, alert_sink
+
     logger.info("🚀 Starting MQTT Subscriber...")
     logger.info(f"📍 Broker: {BROKER}:{PORT}")
+    logger.info(f"🧭 Routes: {', '.join(f'{r.filter} -> {r.table} ({r.value_type})' for r in router.routes)}")
     logger.info(f"👤 Database: {DB_CONFIG['database']}@{DB_CONFIG['host']}")
-    
-    client = mqtt.Client(protocol=mqtt.MQTTv311, client_id="iot_subscriber")
-    
-    # Set credentials
+    logger.info(f"📦 Batching: {BATCH_MAX_ROWS} rows / {BATCH_FLUSH_SECONDS}s")
+    logger.info(f"🧵 Writers: {WRITER_WORKERS}, queue: {QUEUE_MAX_SIZE} ({QUEUE_POLICY})")
+    spool_dir = claim_spool_dir()
+    logger.info(f"📼 Spool: {spool_dir} (max {SPOOL_MAX_BYTES} bytes, replay {SPOOL_REPLAY_ROWS_PER_SEC:g} rows/s)")
+
+    spool = Spool(spool_dir, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES,
+                  fsync_interval=SPOOL_FSYNC_SECONDS)
+    drainer = SpoolDrainer(spool, DB_CONFIG, batch_rows=SPOOL_REPLAY_BATCH_ROWS,
+                           rows_per_second=SPOOL_REPLAY_ROWS_PER_SEC)
+    ingest_queue = IngestQueue(maxsize=QUEUE_MAX_SIZE, policy=QUEUE_POLICY, spool=spool)
+    pool = WriterPool(ingest_queue, DB_CONFIG, workers=WRITER_WORKERS,
+                      max_rows=BATCH_MAX_ROWS, flush_interval=BATCH_FLUSH_SECONDS, spool=spool,
+                      retry_interval=DB_RETRY_SECONDS)
+    QUEUE_DEPTH.set_function(ingest_queue.depth)
+    if ANOMALY_DETECTION:
+        detector = AnomalyDetector(z_threshold=ANOMALY_Z_THRESHOLD, iqr_fence=ANOMALY_IQR_FENCE,
+                                   alpha=ANOMALY_EWMA_ALPHA, warmup=ANOMALY_WARMUP,
+                                   quantile_window=ANOMALY_QUANTILE_WINDOW, min_scale=ANOMALY_MIN_SCALE)
+        alert_sink = AlertSink(DB_CONFIG, detector, source='subscriber', key_prefix=ANOMALY_KEY_PREFIX,
+                               flush_interval=ALERT_FLUSH_SECONDS)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    stop_stats = threading.Event()
+    threading.Thread(target=report_queue_stats, args=(stop_stats,), name='queue-stats', daemon=True).start()
+
+    logger.info(f"🪪 Client ID: {CLIENT_ID}, group: {SUBSCRIBER_GROUP or '-'}, persistent session: {PERSISTENT_SESSION}")
+    client = mqtt.Client(protocol=mqtt.MQTTv311, client_id=CLIENT_ID, clean_session=not PERSISTENT_SESSION)
+
+    # Set credentials if provided
     if USERNAME and PASSWORD:
         client.username_pw_set(USERNAME, PASSWORD)
-    
+
     # Configure TLS/SSL for CloudAMQP
     if int(PORT) == 8883:
         client.tls_set(
@@ -278,14 +284,20 @@ def main():
             cert_reqs=ssl.CERT_NONE
         )
         client.tls_insecure_set(True)
-    
+
     # Set callbacks
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
     client.on_message = on_message
-    client.on_log = on_log
-    
+    # paho calls on_log for every packet; only attach it when the output is visible
+    if logger.isEnabledFor(logging.DEBUG):
+        client.on_log = on_log
+
+    # docker stop sends SIGTERM: leave loop_forever so the buffer gets flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
+
     try:
+        logger.info(f"🔗 Connecting to {BROKER}:{PORT}...")
         client.connect(BROKER, PORT, keepalive=60)
         logger.info("🔄 Starting network loop...")
         client.loop_forever()
@@ -295,7 +307,17 @@ def main():
     except Exception as e:
         logger.error(f"❌ Error: {e}")
         client.disconnect()
+    finally:
+        stop_stats.set()
+        pool.close()
+        if alert_sink is not None:
+            alert_sink.close()
+        # Whatever the drainer has not replayed stays on disk for the next start
+        drainer.close()
+        spool.close()
 
 if __name__ == '__main__':
+    # Wait for PostgreSQL to be ready
+    logger.info("⏳ Waiting for database to be ready...")
+    time.sleep(5)
     main()
-
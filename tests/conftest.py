@@ -0,0 +1,19 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The dashboard runs from streamlit_app/ (imports utils.*); the subscriber modules are imported
+# as the subscriber package, as run_publisher.py does
+for path in (ROOT, os.path.join(ROOT, "streamlit_app")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Inside the container the subscriber runs from subscriber/ and its modules import each other flat
+# (from metrics import ...). Bind `subscriber` to the package first, so subscriber/subscriber.py does not
+# shadow it once that directory is on the path, then let tests import those modules the same way.
+import subscriber  # noqa: E402,F401
+
+SUBSCRIBER_DIR = os.path.join(ROOT, "subscriber")
+if SUBSCRIBER_DIR not in sys.path:
+    sys.path.append(SUBSCRIBER_DIR)
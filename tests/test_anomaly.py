@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from subscriber.anomaly import AnomalyDetector  # noqa: E402
+
+T0 = datetime(2024, 1, 1)
+
+
+def feed(detector, values, key="s", thresholds=()):
+    alerts = []
+    for i, value in enumerate(values):
+        alerts += detector.observe(key, value, T0 + timedelta(minutes=i), thresholds)
+    return alerts
+
+
+@pytest.mark.parametrize("baseline, jump", [(20.0, 21.0), (0.0, 1.0), (1000.0, 1010.0)])
+def test_jump_after_flat_series_is_flagged(baseline, jump):
+    detector = AnomalyDetector(warmup=30)
+    assert feed(detector, [baseline] * 100) == []
+    alerts = feed(detector, [jump])
+    assert [a.kind for a in alerts] == ["spike"]
+    assert alerts[0].score > detector.z_threshold
+
+
+def test_jump_after_flat_series_is_flagged_by_quantiles_below_z_threshold():
+    # Too small for a spike at this z threshold, but far outside the (floored) IQR fence
+    detector = AnomalyDetector(warmup=30, z_threshold=1000)
+    feed(detector, [20.0] * 100)
+    assert [a.kind for a in feed(detector, [20.5])] == ["quantile"]
+
+
+def test_no_alerts_during_warmup():
+    detector = AnomalyDetector(warmup=30)
+    assert feed(detector, [5.0] * 10 + [500.0]) == []
+
+
+def test_threshold_crossings():
+    detector = AnomalyDetector()
+    alerts = feed(detector, [10.0, 60.0, 40.0], thresholds=(50.0,))
+    assert [(a.kind, a.threshold) for a in alerts] == [("threshold_up", 50.0), ("threshold_down", 50.0)]
+
+
+def test_state_round_trip_and_old_format():
+    detector = AnomalyDetector(warmup=30)
+    feed(detector, [20.0] * 50)
+    states = detector.export_states()
+    assert "mean" not in states["s"] and "m2" not in states["s"]
+
+    # States persisted before the Welford accumulators were dropped still load
+    states["s"].update(mean=20.0, m2=0.0)
+    restored = AnomalyDetector(warmup=30)
+    restored.load_states(states)
+    assert [a.kind for a in feed(restored, [25.0])] == ["spike"]
+
+
+def test_alert_sink_logs_each_series_at_most_once_per_interval(monkeypatch, caplog):
+    import psycopg2
+
+    from subscriber import anomaly
+
+    def unreachable(**kwargs):
+        raise psycopg2.OperationalError("connection refused")
+
+    clock = {"now": 0.0}
+    monkeypatch.setattr(anomaly.psycopg2, "connect", unreachable)
+    monkeypatch.setattr(anomaly.time, "monotonic", lambda: clock["now"])
+    detector = AnomalyDetector()
+    sink = anomaly.AlertSink({}, detector, source="test", key_prefix="t:", flush_interval=3600, log_interval=60)
+    try:
+        noisy = feed(detector, [10.0, 60.0] * 5, key="noisy", thresholds=(50.0,))
+        with caplog.at_level("WARNING", logger=anomaly.logger.name):
+            sink.add(noisy)
+            sink.add(feed(detector, [10.0, 60.0], key="other", thresholds=(50.0,)))
+            clock["now"] = 61.0
+            sink.add(noisy[:1])
+        lines = [r.getMessage() for r in caplog.records if r.getMessage().startswith("🚨")]
+        assert len(lines) == 3
+        assert lines[0].endswith("(+0 suppressed)")
+        assert "noisy" in lines[2] and lines[2].endswith(f"(+{len(noisy) - 1} suppressed)")
+        # Every alert is still kept for alert_events
+        assert len(sink._pending) == len(noisy) + 2
+    finally:
+        sink._stop.set()
+        sink._thread.join()
+
+
+def test_alert_sink_counts_alerts_only_after_commit(monkeypatch):
+    import psycopg2
+
+    from subscriber import anomaly
+
+    class Connection:
+        """Writes succeed; the commit fails while ``fail`` is set."""
+
+        closed = 0
+        fail = True
+
+        def cursor(self):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def commit(self):
+            if self.fail:
+                raise psycopg2.OperationalError("server closed the connection")
+
+        def rollback(self):
+            pass
+
+    conn = Connection()
+    monkeypatch.setattr(anomaly.psycopg2, "connect", lambda **kwargs: conn)
+    monkeypatch.setattr(anomaly, "load_detector_states", lambda *args: 0)
+    monkeypatch.setattr(anomaly.extras, "execute_values", lambda *args, **kwargs: None)
+    detector = AnomalyDetector()
+    sink = anomaly.AlertSink({}, detector, source="t_commit", key_prefix="t:", flush_interval=3600)
+    sink._stop.set()
+    sink._thread.join()
+
+    def emitted():
+        return anomaly.ALERTS._values.get(("t_commit", "threshold_up"), 0)
+
+    sink.add(feed(detector, [10.0, 60.0], thresholds=(50.0,)))
+    sink._flush(save_state=False)
+    assert emitted() == 0 and len(sink._pending) == 1
+
+    conn.fail = False
+    sink._flush(save_state=False)
+    assert emitted() == 1 and sink._pending == []
@@ -0,0 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("aiomqtt")
+pytest.importorskip("paho.mqtt")
+
+from async_subscriber import AsyncIngest  # noqa: E402
+from batch_writer import REJECTED_ROWS  # noqa: E402
+
+TS = datetime(2024, 1, 1)
+
+
+class FakeConnection:
+    """asyncpg connection stand-in: COPYs containing a value in ``bad`` fail and roll back their savepoint."""
+
+    def __init__(self, bad=(), error=asyncpg.DataError):
+        self.bad = set(bad)
+        self.error = error
+        self.copied = []
+        self.copies = 0
+        self.open_transactions = 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.open_transactions += 1
+        try:
+            yield
+        finally:
+            self.open_transactions -= 1
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies += 1
+        if any(record[2] in self.bad for record in records):
+            raise self.error("integer out of range")
+        self.copied.extend(records)
+
+
+def make_rows(values):
+    return [("lake/raw/int", "{}", value, TS) for value in values]
+
+
+def copy(conn, table, rows):
+    ingest = AsyncIngest.__new__(AsyncIngest)
+    return asyncio.run(ingest._copy_isolating(conn, table, rows))
+
+
+def test_copy_isolating_clean_batch_is_one_copy():
+    conn = FakeConnection()
+    rows = make_rows(range(6))
+    assert copy(conn, "lake_raw_data_int", rows) == 6
+    assert conn.copied == rows
+    assert conn.copies == 1
+
+
+@pytest.mark.parametrize("error", [asyncpg.DataError, asyncpg.IntegrityConstraintViolationError])
+def test_copy_isolating_leaves_out_bad_row(error):
+    conn = FakeConnection(bad={4}, error=error)
+    before = REJECTED_ROWS._values.get(("t_async",), 0)
+    assert copy(conn, "t_async", make_rows(range(7))) == 6
+    assert [row[2] for row in conn.copied] == [0, 1, 2, 3, 5, 6]
+    assert REJECTED_ROWS._values.get(("t_async",), 0) - before == 1
+    assert conn.open_transactions == 0
+
+
+def test_copy_isolating_propagates_other_errors():
+    conn = FakeConnection(bad={0}, error=asyncpg.UndefinedTableError)
+    with pytest.raises(asyncpg.UndefinedTableError):
+        copy(conn, "t_missing", make_rows(range(3)))
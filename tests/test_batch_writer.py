@@ -0,0 +1,133 @@
+from datetime import datetime
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import batch_writer  # noqa: E402
+from batch_writer import REJECTED_ROWS, insert_rows  # noqa: E402
+
+TS = datetime(2024, 1, 1)
+
+
+class FakeCursor:
+    """Stands in for a psycopg2 cursor: rows whose value is in ``bad`` make the insert fail."""
+
+    def __init__(self, bad=(), error=psycopg2.DataError):
+        self.bad = set(bad)
+        self.error = error
+        self.inserted = []
+        self.statements = []
+        self.attempts = 0
+        self.failures = 0
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+    def insert(self, rows):
+        self.attempts += 1
+        if any(row[2] in self.bad for row in rows):
+            self.failures += 1
+            raise self.error("value out of range")
+        self.inserted.extend(rows)
+
+
+@pytest.fixture(autouse=True)
+def fake_execute_values(monkeypatch):
+    monkeypatch.setattr(batch_writer.extras, "execute_values", lambda cur, sql, rows, page_size: cur.insert(rows))
+
+
+def make_rows(values):
+    return [("lake/raw/int", "{}", value, TS) for value in values]
+
+
+def rejected(table):
+    return REJECTED_ROWS._values.get((table,), 0)
+
+
+def test_insert_rows_writes_clean_batch_in_one_statement():
+    cur = FakeCursor()
+    rows = make_rows(range(8))
+    assert insert_rows(cur, "lake_raw_data_int", rows) == 8
+    assert cur.inserted == rows
+    assert cur.attempts == 1
+    assert cur.statements == ["SAVEPOINT insert_rows", "RELEASE SAVEPOINT insert_rows"]
+
+
+@pytest.mark.parametrize("error", [psycopg2.DataError, psycopg2.IntegrityError])
+def test_insert_rows_leaves_out_only_rejected_rows(error):
+    cur = FakeCursor(bad={3, 6}, error=error)
+    rows = make_rows(range(8))
+    before = rejected("t_split")
+    assert insert_rows(cur, "t_split", rows) == 6
+    assert sorted(row[2] for row in cur.inserted) == [0, 1, 2, 4, 5, 7]
+    assert rejected("t_split") - before == 2
+    # Every failed attempt is rolled back to its savepoint, and every savepoint is released
+    assert cur.statements.count("ROLLBACK TO SAVEPOINT insert_rows") == cur.failures
+    assert cur.statements.count("SAVEPOINT insert_rows") == cur.statements.count("RELEASE SAVEPOINT insert_rows")
+
+
+def test_insert_rows_single_bad_row():
+    cur = FakeCursor(bad={0})
+    assert insert_rows(cur, "t_single", make_rows([0])) == 0
+    assert cur.inserted == []
+    assert cur.statements == ["SAVEPOINT insert_rows", "ROLLBACK TO SAVEPOINT insert_rows", "RELEASE SAVEPOINT insert_rows"]
+
+
+def test_insert_rows_propagates_errors_not_caused_by_rows():
+    cur = FakeCursor(bad={1}, error=psycopg2.ProgrammingError)
+    with pytest.raises(psycopg2.ProgrammingError):
+        insert_rows(cur, "t_missing", make_rows(range(4)))
+    assert cur.inserted == []
+
+
+class BrokenConnection:
+    """Fails the commit, then loses the connection so rollback raises too."""
+
+    closed = 0
+
+    def __init__(self):
+        self.cur = FakeCursor()
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self.cur
+
+    def __exit__(self, *exc):
+        return False
+
+    def commit(self):
+        raise psycopg2.ProgrammingError("permission denied")
+
+    def rollback(self):
+        raise psycopg2.InterfaceError("connection already closed")
+
+    def close(self):
+        pass
+
+
+class FakeSpool:
+    def __init__(self):
+        self.items = []
+
+    def append(self, items):
+        self.items.extend(items)
+        return len(items)
+
+
+def test_write_spools_batch_when_rollback_fails(monkeypatch):
+    monkeypatch.setattr(batch_writer.psycopg2, "connect", lambda **kwargs: BrokenConnection())
+    spool = FakeSpool()
+    writer = batch_writer.BatchWriter({}, flush_interval=3600, spool=spool)
+    rows = make_rows(range(3))
+    try:
+        for row in rows:
+            writer.add("lake_raw_data_int", row)
+        assert writer.flush() == 0
+        assert spool.items == [("lake_raw_data_int", row) for row in rows]
+        assert writer._conn is None
+    finally:
+        writer._stop.set()
+        writer._timer.join()
@@ -0,0 +1,88 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# run_publisher loads the OpenAQ client and .env support at import time
+pytest.importorskip("openaq")
+pytest.importorskip("dotenv")
+pd = pytest.importorskip("pandas")
+
+import run_publisher  # noqa: E402
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    """Keeps what COPY receives and returns it as the RETURNING rows of the INSERT ... SELECT."""
+
+    def __init__(self):
+        self.copied = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def copy_expert(self, query, buffer):
+        self.copied = [line.split(",") for line in buffer.getvalue().splitlines()]
+
+    def fetchall(self):
+        return [(int(station), int(parameter), ts) for station, parameter, _, ts in self.copied]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cur = FakeCursor()
+        self.committed = False
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(run_publisher, "BULK_COPY_THRESHOLD", 2)
+    monkeypatch.setattr(run_publisher, "update_watermarks", lambda cur, ranges: None)
+    monkeypatch.setattr(run_publisher, "refresh_rollups", lambda cur, ranges: None)
+    return FakeConnection()
+
+
+def test_copy_path_skips_missing_values(conn):
+    values = [1.5, math.nan, None, 4.0]
+    df = pd.DataFrame({
+        "station_id": [1] * len(values),
+        "parameter_id": [2] * len(values),
+        "value": values,
+        "timestamp_utc": [T0 + timedelta(hours=i) for i in range(len(values))],
+    })
+
+    inserted = run_publisher.insert_dataframe_to_db(conn, df)
+
+    assert conn.committed
+    assert [float(row[2]) for row in conn.cur.copied] == [1.5, 4.0]
+    assert len(inserted) == 2
+
+
+def test_all_missing_values_insert_nothing(conn):
+    df = pd.DataFrame({
+        "station_id": [1, 1, 1],
+        "parameter_id": [2, 2, 2],
+        "value": [math.nan] * 3,
+        "timestamp_utc": [T0 + timedelta(hours=i) for i in range(3)],
+    })
+
+    inserted = run_publisher.insert_dataframe_to_db(conn, df)
+
+    assert inserted.empty
+    assert not conn.committed
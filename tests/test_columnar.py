@@ -0,0 +1,52 @@
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.columnar import PG_EPOCH_OFFSET_US, PGCOPY_SIGNATURE, read_copy_binary
+
+FIELDS = [("timestamp_utc", "timestamptz"), ("parameter_id", "int4"), ("value", "float8")]
+
+
+def copy_binary(rows, extension=b""):
+    """Stream as written by COPY ... TO STDOUT WITH (FORMAT binary) for FIELDS."""
+    data = PGCOPY_SIGNATURE + struct.pack(">ii", 0, len(extension)) + extension
+    for ts, parameter_id, value in rows:
+        us = (ts - pd.Timestamp("1970-01-01", tz="UTC")) // pd.Timedelta(microseconds=1) - PG_EPOCH_OFFSET_US
+        data += struct.pack(">h", 3)
+        data += struct.pack(">iq", 8, us) + struct.pack(">ii", 4, parameter_id) + struct.pack(">id", 8, value)
+    return data + struct.pack(">h", -1)
+
+
+def test_decodes_rows():
+    ts = [pd.Timestamp("2024-03-01 10:00:00.123456", tz="UTC"), pd.Timestamp("1999-12-31 23:59", tz="UTC")]
+    columns = read_copy_binary(copy_binary([(ts[0], 2, 12.5), (ts[1], -7, -0.25)]), FIELDS)
+    assert list(pd.to_datetime(columns["timestamp_utc"], utc=True)) == ts
+    assert columns["parameter_id"].tolist() == [2, -7]
+    assert columns["value"].tolist() == [12.5, -0.25]
+    assert columns["value"].dtype == np.float64
+
+
+def test_skips_header_extension():
+    ts = pd.Timestamp("2024-01-01", tz="UTC")
+    columns = read_copy_binary(copy_binary([(ts, 1, 1.0)], extension=b"\x00" * 6), FIELDS)
+    assert columns["parameter_id"].tolist() == [1]
+
+
+def test_empty_result():
+    columns = read_copy_binary(copy_binary([]), FIELDS)
+    assert all(len(values) == 0 for values in columns.values())
+
+
+def test_rejects_other_formats():
+    with pytest.raises(ValueError):
+        read_copy_binary(b"timestamp_utc,value\n", FIELDS)
+
+
+def test_rejects_null_columns():
+    data = copy_binary([(pd.Timestamp("2024-01-01", tz="UTC"), 1, 1.0)])
+    # Replace the float8 field (length 8 + value) with a NULL (length -1)
+    data = data[:-14] + struct.pack(">i", -1) + struct.pack(">h", -1)
+    with pytest.raises(ValueError):
+        read_copy_binary(data, FIELDS)
@@ -0,0 +1,85 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("dotenv")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import compact_lake  # noqa: E402
+
+T0 = datetime(2024, 1, 1)
+
+
+class FakeConnection:
+    """Serves ARCHIVE_BATCH_SQL from an in-memory table ordered by id."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        matching = [r for r in self.rows if r[4] < params["cutoff"] and r[0] > params["after_id"]]
+        self.result = matching[:params["batch_rows"]]
+
+    def fetchall(self):
+        return self.result
+
+    def rollback(self):
+        pass
+
+
+def lake_rows(n):
+    return [(i, "lake/raw/int", '{"v": %d}' % i, i, T0 + timedelta(minutes=i)) for i in range(1, n + 1)]
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(compact_lake, "LAKE_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(compact_lake, "LAKE_COMPACT_BATCH_ROWS", 10)
+    return tmp_path
+
+
+def test_archive_file_writes_one_row_group_per_batch(archive_dir, monkeypatch):
+    monkeypatch.setattr(compact_lake, "LAKE_ARCHIVE_FILE_ROWS", 1000)
+    conn = FakeConnection(lake_rows(35))
+    schema = compact_lake.archive_schema("lake_raw_data_int")
+
+    batches, path = compact_lake.archive_file(conn, "lake_raw_data_int", schema, T0 + timedelta(days=1), 0)
+
+    assert [len(ids) for ids in batches] == [10, 10, 10, 5]
+    assert os.listdir(archive_dir / "lake_raw_data_int") == ["20240101-1-35.parquet"]
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 4
+    assert parquet.read().column("id").to_pylist() == list(range(1, 36))
+
+
+def test_archive_file_rolls_over_at_file_rows(archive_dir, monkeypatch):
+    monkeypatch.setattr(compact_lake, "LAKE_ARCHIVE_FILE_ROWS", 25)
+    conn = FakeConnection(lake_rows(35))
+    schema = compact_lake.archive_schema("lake_raw_data_int")
+    cutoff = T0 + timedelta(days=1)
+
+    first, _ = compact_lake.archive_file(conn, "lake_raw_data_int", schema, cutoff, 0)
+    second, _ = compact_lake.archive_file(conn, "lake_raw_data_int", schema, cutoff, first[-1][-1])
+
+    assert [len(ids) for ids in first] == [10, 10, 5]
+    assert [len(ids) for ids in second] == [10]
+    assert sorted(os.listdir(archive_dir / "lake_raw_data_int")) == ["20240101-1-25.parquet", "20240101-26-35.parquet"]
+
+
+def test_archive_file_nothing_to_archive(archive_dir):
+    conn = FakeConnection(lake_rows(5))
+    schema = compact_lake.archive_schema("lake_raw_data_int")
+    assert compact_lake.archive_file(conn, "lake_raw_data_int", schema, T0, 0) == ([], None)
+    assert os.listdir(archive_dir / "lake_raw_data_int") == []
@@ -0,0 +1,25 @@
+import numpy as np
+
+from utils.downsampling import lttb_indices
+
+
+def test_returns_everything_when_small():
+    assert lttb_indices(np.arange(5), np.arange(5), 10).tolist() == [0, 1, 2, 3, 4]
+    assert lttb_indices(np.arange(5), np.arange(5), 2).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_keeps_endpoints_and_order():
+    x = np.arange(1000)
+    y = np.sin(x / 30.0)
+    idx = lttb_indices(x, y, 50)
+    assert len(idx) == 50
+    assert idx[0] == 0 and idx[-1] == 999
+    assert (np.diff(idx) > 0).all()
+
+
+def test_keeps_spikes():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[[137, 512, 861]] = [50.0, -40.0, 30.0]
+    idx = lttb_indices(x, y, 20)
+    assert {137, 512, 861} <= set(idx.tolist())
@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import ingest_queue  # noqa: E402
+from ingest_queue import IngestQueue, WriterPool  # noqa: E402
+
+
+class FakeSpool:
+    def __init__(self):
+        self.items = []
+
+    def append(self, items):
+        self.items.extend(items)
+        return len(items)
+
+
+class FakeWriter:
+    """Records rows instead of writing them; one per worker thread."""
+
+    instances = []
+
+    def __init__(self, db_config, **kwargs):
+        self.rows = []
+        self.closed = False
+        FakeWriter.instances.append(self)
+
+    def add(self, table, row):
+        self.rows.append((table, row))
+
+    def close(self):
+        self.closed = True
+
+
+def drain(q):
+    items = []
+    while (item := q.get(timeout=0)) is not None:
+        items.append(item)
+    return items
+
+
+def test_drop_oldest_discards_the_oldest_items():
+    q = IngestQueue(maxsize=2, policy="drop_oldest")
+    for i in range(5):
+        q.put(("t", i))
+    assert drain(q) == [("t", 3), ("t", 4)]
+    assert q.stats() == {"depth": 0, "dropped": 3, "spilled": 0}
+
+
+def test_spill_sends_overflow_to_the_spool():
+    spool = FakeSpool()
+    q = IngestQueue(maxsize=2, policy="spill", spool=spool)
+    for i in range(4):
+        q.put(("t", i))
+    assert drain(q) == [("t", 0), ("t", 1)]
+    assert spool.items == [("t", 2), ("t", 3)]
+    assert q.spilled == 2 and q.dropped == 0
+
+
+def test_policy_validation():
+    with pytest.raises(ValueError):
+        IngestQueue(policy="lifo")
+    with pytest.raises(ValueError):
+        IngestQueue(policy="spill")
+
+
+def test_writer_pool_close_drains_the_queue(monkeypatch):
+    monkeypatch.setattr(ingest_queue, "BatchWriter", FakeWriter)
+    FakeWriter.instances = []
+    q = IngestQueue(maxsize=1000)
+    items = [("t", i) for i in range(500)]
+    for item in items:
+        q.put(item)
+
+    pool = WriterPool(q, db_config={}, workers=3, flush_interval=0.05)
+    pool.close()
+
+    assert q.depth() == 0
+    assert len(FakeWriter.instances) == 3
+    assert all(writer.closed for writer in FakeWriter.instances)
+    written = [item for writer in FakeWriter.instances for item in writer.rows]
+    assert sorted(written) == items
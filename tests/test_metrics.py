@@ -0,0 +1,75 @@
+import importlib.util
+import os
+
+import pytest
+
+from subscriber.metrics import Counter, Gauge, Histogram, render_metrics
+
+
+def test_counter_renders_help_type_and_labelled_samples():
+    counter = Counter("test_requests_total", "Requests served", ["route"])
+    counter.labels("lake/+/int").inc()
+    counter.labels("lake/+/int").inc(2)
+    counter.labels('we"ird\\route\n').inc()
+    assert counter.render() == [
+        "# HELP test_requests_total Requests served",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="lake/+/int"} 3',
+        'test_requests_total{route="we\\"ird\\\\route\\n"} 1',
+    ]
+
+
+def test_labels_must_match_label_names():
+    counter = Counter("test_arity_total", "Arity", ["a", "b"])
+    with pytest.raises(ValueError):
+        counter.labels("only-one")
+
+
+def test_gauge_reads_function_at_scrape_time():
+    depth = {"value": 3}
+    gauge = Gauge("test_depth", "Queue depth")
+    gauge.set_function(lambda: depth["value"])
+    depth["value"] = 7
+    assert gauge.render()[-1] == "test_depth 7"
+    gauge.set_function(lambda: 0.5)
+    assert gauge.render()[-1] == "test_depth 0.5"
+
+
+def test_histogram_buckets_are_cumulative_with_inf_count_and_sum():
+    histogram = Histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.render()[2:] == [
+        'test_latency_seconds_bucket{le="0.1"} 2',
+        'test_latency_seconds_bucket{le="1.0"} 3',
+        'test_latency_seconds_bucket{le="+Inf"} 4',
+        "test_latency_seconds_count 4",
+        "test_latency_seconds_sum 3.65",
+    ]
+
+
+def test_render_metrics_includes_every_registered_metric():
+    Counter("test_registered_total", "Registered").inc()
+    text = render_metrics()
+    assert text.endswith("\n")
+    assert "# TYPE test_registered_total counter\ntest_registered_total 1\n" in text
+
+
+def test_subscriber_labels_messages_by_route_not_topic():
+    pytest.importorskip("paho.mqtt")
+    pytest.importorskip("psycopg2")
+    # subscriber/subscriber.py is the entrypoint module; `subscriber` is the package in tests
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "subscriber", "subscriber.py")
+    spec = importlib.util.spec_from_file_location("subscriber_main", path)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    from routing import Route, Router
+
+    app.router = Router([Route("sensors/+/temp", "lake_raw_data_float", "float")])
+    for i in range(50):
+        app.decode_message(f"sensors/device-{i}/temp", b'{"value": 21.5}')
+    app.decode_message("sensors/device-1/temp", b"not json")
+    app.decode_message("other/topic", b'{"value": 1}')
+
+    assert app.MESSAGES_RECEIVED._values == {("sensors/+/temp",): 51, (app.UNROUTED,): 1}
+    assert app.PARSE_FAILURES._values == {("sensors/+/temp",): 1}
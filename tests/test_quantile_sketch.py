@@ -0,0 +1,61 @@
+import math
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+from utils.quantile_sketch import PROFILE_SKETCH_GAMMA, merge_sketches, profile_box_stats, sketch_quantiles
+
+# Maximum relative error of a bucket's representative value
+RELATIVE_ERROR = (PROFILE_SKETCH_GAMMA - 1) / (PROFILE_SKETCH_GAMMA + 1)
+
+
+def sketch_bin(v):
+    """Python version of profile_sketch_bin() in init.sql."""
+    if v > 0:
+        return str(math.ceil(math.log(v) / math.log(PROFILE_SKETCH_GAMMA)))
+    if v < 0:
+        return "n" + str(math.ceil(math.log(-v) / math.log(PROFILE_SKETCH_GAMMA)))
+    return "z"
+
+
+def sketch(values):
+    return dict(Counter(sketch_bin(v) for v in values))
+
+
+def test_signed_quantiles():
+    values = [-10, -5, -1, 0, 0, 1, 2, 3, 50]
+    result = sketch_quantiles(sketch(values), (0, 0.25, 0.5, 0.75, 1))
+    for estimate, exact in zip(result, [-10, -1, 0, 2, 50]):
+        assert estimate == pytest.approx(exact, rel=RELATIVE_ERROR)
+
+
+def test_negative_values_are_ordered_by_magnitude():
+    result = sketch_quantiles(sketch([-100, -10, -1]), (0, 0.5, 1))
+    assert result[0] < result[1] < result[2] < 0
+
+
+def test_empty_sketch():
+    assert sketch_quantiles({}, (0.25, 0.5)) == [None, None]
+
+
+def test_merge_adds_counts():
+    merged = merge_sketches([{"1": 2, "z": 1}, {"1": 3, "n4": 1}])
+    assert merged == {"1": 5, "z": 1, "n4": 1}
+
+
+def test_box_stats_from_cells():
+    # Monday cells: hour -> values
+    cells = {0: [1.0, 2.0], 1: [4.0, 8.0], 2: [6.0, 10.0, 2.0]}
+    rows = [{
+        "day_of_week": 1, "hour_of_day": hour, "sample_count": len(values),
+        "value_sum": sum(values), "value_sumsq": sum(v * v for v in values),
+        "value_min": min(values), "value_max": max(values), "value_sketch": sketch(values),
+    } for hour, values in cells.items()]
+    stats = profile_box_stats(pd.DataFrame(rows)).iloc[0]
+    everything = [v for values in cells.values() for v in values]
+    assert stats["sample_count"] == len(everything)
+    assert stats["min"] == 1 and stats["max"] == 10
+    assert stats["mean"] == pytest.approx(sum(everything) / len(everything))
+    assert stats["sd"] == pytest.approx(pd.Series(everything).std(ddof=0))
+    assert stats["min"] <= stats["q1"] <= stats["median"] <= stats["q3"] <= stats["max"]
@@ -0,0 +1,133 @@
+import pandas as pd
+import pytest
+
+from utils.range_cache import RangeCache
+
+DAY1 = pd.Timestamp("2024-01-01", tz="UTC")
+DAY2 = pd.Timestamp("2024-01-02", tz="UTC")
+
+
+class FakeSource:
+    """Rows of one (station, parameter) stamped with a fake server clock, like ingested_at."""
+
+    def __init__(self):
+        self.clock = pd.Timestamp("2024-02-01", tz="UTC")
+        self.rows = []
+        self.fetches = []
+        self.fail = False
+
+    def add(self, *timestamps):
+        self.clock += pd.Timedelta(seconds=1)
+        self.rows += [(pd.Timestamp(ts, tz="UTC"), self.clock) for ts in timestamps]
+
+    def fetch(self, station_id, parameter_id, lower, upper):
+        self.fetches.append((lower, upper))
+        if self.fail:
+            return None
+        ts = sorted(t for t, _ in self.rows if lower <= t < upper)
+        return pd.DataFrame({"timestamp_utc": pd.Series(ts, dtype="datetime64[ns, UTC]"), "value": 1.0})
+
+    def changed_days(self, station_id, parameter_id, since, lower, upper):
+        first_new = {}
+        if since is not None:
+            for t, ingested_at in self.rows:
+                if ingested_at > since and lower <= t < upper:
+                    day = t.floor("D")
+                    first_new[day] = min(first_new.get(day, t), t)
+        return self.clock, first_new
+
+
+@pytest.fixture
+def source():
+    source = FakeSource()
+    source.add("2024-01-01 08:00", "2024-01-01 12:00", "2024-01-02 09:00")
+    return source
+
+
+def make_cache(source, **kwargs):
+    kwargs.setdefault("changed_days", source.changed_days)
+    # Overlap shorter than the fake clock step, so already verified rows are not reported again
+    return RangeCache(source.fetch, max_bytes=10**8, refresh_seconds=3600, settle=pd.Timedelta(0),
+                      change_overlap=pd.Timedelta(0), **kwargs)
+
+
+def timestamps(df):
+    return [str(ts) for ts in df["timestamp_utc"]]
+
+
+def test_cached_days_are_not_fetched_again(source):
+    cache = make_cache(source)
+    first = cache.get_range(1, 2, DAY1, DAY2 + pd.Timedelta(hours=23))
+    assert len(first) == 3
+    assert len(source.fetches) == 1
+    again = cache.get_range(1, 2, DAY1, DAY1 + pd.Timedelta(hours=10))
+    assert timestamps(again) == ["2024-01-01 08:00:00+00:00"]
+    assert len(source.fetches) == 1
+
+
+def test_refresh_without_changes_keeps_segments(source):
+    cache = make_cache(source)
+    cache.get_range(1, 2, DAY1, DAY2)
+    segments = cache.stats()["segments"]
+    df = cache.get_range(1, 2, DAY1, DAY2, refresh=True)
+    assert len(df) == 2
+    assert len(source.fetches) == 1
+    assert cache.stats()["segments"] == segments
+
+
+def test_new_rows_after_the_last_one_are_appended(source):
+    cache = make_cache(source)
+    cache.get_range(1, 2, DAY1, DAY2)
+    source.add("2024-01-01 13:00")
+    df = cache.get_range(1, 2, DAY1, DAY1 + pd.Timedelta(hours=23), refresh=True)
+    assert timestamps(df)[-1] == "2024-01-01 13:00:00+00:00"
+    assert len(df) == 3
+    # Only the tail of the day was requested
+    lower, upper = source.fetches[-1]
+    assert lower > pd.Timestamp("2024-01-01 12:00", tz="UTC") and upper == DAY2
+
+
+def test_late_rows_refetch_the_whole_day(source):
+    cache = make_cache(source)
+    cache.get_range(1, 2, DAY1, DAY2 + pd.Timedelta(hours=23))
+    source.add("2024-01-01 10:00")
+    df = cache.get_range(1, 2, DAY1, DAY2 + pd.Timedelta(hours=23), refresh=True)
+    assert timestamps(df) == ["2024-01-01 08:00:00+00:00", "2024-01-01 10:00:00+00:00",
+                              "2024-01-01 12:00:00+00:00", "2024-01-02 09:00:00+00:00"]
+    # Only the changed day
+    assert source.fetches[-1] == (DAY1, DAY2)
+    assert len(source.fetches) == 2
+
+
+def test_failed_refetch_keeps_cached_rows(source):
+    cache = make_cache(source)
+    cache.get_range(1, 2, DAY1, DAY2)
+    source.add("2024-01-01 10:00")
+    source.fail = True
+    df = cache.get_range(1, 2, DAY1, DAY2, refresh=True)
+    assert len(df) == 2
+    source.fail = False
+    assert len(cache.get_range(1, 2, DAY1, DAY2, refresh=True)) == 3
+
+
+def test_without_change_detection_only_recent_days_are_refetched(source):
+    cache = make_cache(source, changed_days=None)
+    cache.get_range(1, 2, DAY1, DAY2)
+    cache.get_range(1, 2, DAY1, DAY2, refresh=True)
+    assert len(source.fetches) == 1
+
+    recent = RangeCache(source.fetch, max_bytes=10**8, settle=pd.Timedelta(days=100000))
+    recent.get_range(1, 2, DAY1, DAY2)
+    recent.get_range(1, 2, DAY1, DAY2, refresh=True)
+    assert len(source.fetches) == 3
+
+
+def test_evicts_least_recently_used_days(source):
+    cache = make_cache(source)
+    cache.get_range(1, 2, DAY1, DAY1)
+    one_day = cache.stats()["bytes"]
+    cache.max_bytes = one_day
+    cache.get_range(1, 2, DAY2, DAY2)
+    assert cache.stats()["segments"] == 1
+    cache.get_range(1, 2, DAY2, DAY2)
+    assert len(source.fetches) == 2
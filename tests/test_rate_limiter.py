@@ -0,0 +1,53 @@
+import pytest
+
+# run_publisher loads the OpenAQ client and .env support at import time
+pytest.importorskip("openaq")
+pytest.importorskip("dotenv")
+
+import run_publisher  # noqa: E402
+from run_publisher import RateLimiter  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock; sleep() advances it instead of waiting, by at least its 1 µs resolution."""
+    state = {"now": 1000.0, "slept": 0.0}
+
+    def sleep(seconds):
+        seconds = max(seconds, 1e-6)
+        state["now"] += seconds
+        state["slept"] += seconds
+
+    monkeypatch.setattr(run_publisher.time, "monotonic", lambda: state["now"])
+    monkeypatch.setattr(run_publisher.time, "sleep", sleep)
+    return state
+
+
+def test_burst_is_taken_from_the_refill_rate():
+    limiter = RateLimiter(60, burst=5)
+    assert limiter.capacity == 5
+    assert limiter.rate == pytest.approx(55 / 60)
+    # The burst never exceeds half the quota
+    assert RateLimiter(6, burst=10).capacity == 3
+    assert RateLimiter(0).capacity == 1
+
+
+def test_never_exceeds_quota_in_a_minute(clock):
+    limiter = RateLimiter(60, burst=5)
+    started = clock["now"]
+    granted = 0
+    while True:
+        limiter.acquire()
+        if clock["now"] - started >= 60:
+            break
+        granted += 1
+    assert granted <= 60
+    assert granted >= 59
+
+
+def test_pause_blocks_and_empties_the_bucket(clock):
+    limiter = RateLimiter(60, burst=5)
+    limiter.pause(30)
+    limiter.acquire()
+    # Waits the pause, then one refill interval since the bucket was emptied
+    assert clock["slept"] == pytest.approx(30 + 60 / 55)
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+from subscriber.routing import INT4_MAX, INT4_MIN, Route, Router, filter_to_regex
+
+
+def matches(topic_filter, topic):
+    return re.fullmatch(filter_to_regex(topic_filter), topic) is not None
+
+
+@pytest.mark.parametrize("topic_filter, topic, expected", [
+    ("lake/raw/int", "lake/raw/int", True),
+    ("lake/raw/int", "lake/raw/float", False),
+    ("lake/+/int", "lake/raw/int", True),
+    ("lake/+/int", "lake/raw/x/int", False),
+    ("lake/+", "lake/", True),
+    ("lake/#", "lake", True),
+    ("lake/#", "lake/raw/int", True),
+    ("lake/#", "lakehouse/raw", False),
+    ("#", "anything/at/all", True),
+    # Regex metacharacters in a level are literal
+    ("a.b/c", "axb/c", False),
+    ("a.b/c", "a.b/c", True),
+])
+def test_filter_to_regex(topic_filter, topic, expected):
+    assert matches(topic_filter, topic) is expected
+
+
+@pytest.mark.parametrize("topic_filter", ["lake/#/int", "lake/raw+", "lake/#raw", "a+/b"])
+def test_filter_to_regex_rejects_misplaced_wildcards(topic_filter):
+    with pytest.raises(ValueError):
+        filter_to_regex(topic_filter)
+
+
+def test_router_first_route_wins_and_skips_sys_topics():
+    specific = Route("lake/raw/int", "lake_raw_data_int", "int")
+    catch_all = Route("#", "lake_raw_data_float", "float")
+    router = Router([specific, catch_all])
+    assert router.match("lake/raw/int") is specific
+    assert router.match("lake/raw/other") is catch_all
+    assert router.match("$SYS/broker/uptime") is None
+
+
+@pytest.mark.parametrize("table", ["lake; DROP TABLE x", "1table", "lake-raw", ""])
+def test_route_rejects_invalid_table(table):
+    with pytest.raises(ValueError):
+        Route("lake/raw/int", table, "int")
+
+
+def test_route_rejects_unknown_value_type():
+    with pytest.raises(ValueError):
+        Route("lake/raw/int", "lake_raw_data_int", "text")
+
+
+@pytest.mark.parametrize("value, expected", [
+    (42, 42),
+    (42.0, 42),
+    (INT4_MAX, INT4_MAX),
+    (INT4_MIN, INT4_MIN),
+    (INT4_MAX + 1, None),
+    (INT4_MIN - 1, None),
+    (float(2**40), None),
+    (42.5, None),
+    (float("nan"), None),
+    (float("inf"), None),
+    ("42", None),
+    (None, None),
+])
+def test_coerce_int(value, expected):
+    assert Route("t", "t", "int").coerce(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1, 1.0),
+    (1.5, 1.5),
+    (float("nan"), None),
+    (float("inf"), None),
+    (float("-inf"), None),
+    # Too large for a float
+    (10**400, None),
+    ("1.5", None),
+])
+def test_coerce_float(value, expected):
+    assert Route("t", "t", "float").coerce(value) == expected
+
+
+def test_coerce_applies_bounds():
+    route = Route("t", "t", "float", min_value=0, max_value=100)
+    assert route.coerce(0) == 0.0
+    assert route.coerce(100) == 100.0
+    assert route.coerce(-0.1) is None
+    assert route.coerce(100.1) is None
@@ -0,0 +1,119 @@
+import os
+from datetime import datetime
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import spool as spool_module  # noqa: E402
+from spool import Spool, SpoolDrainer  # noqa: E402
+
+
+def item(i):
+    return ("lake_raw_data_int", ("lake/raw/int", '{"v": %d}' % i, i, datetime(2024, 1, 1, 0, 0, i % 60)))
+
+
+def sealed_segment(spool, items):
+    assert spool.append(items) == len(items)
+    return spool.oldest_segment()
+
+
+def test_append_and_read_round_trip(tmp_path):
+    spool = Spool(str(tmp_path))
+    items = [item(i) for i in range(5)]
+    path = sealed_segment(spool, items)
+    assert spool.read_segment(path) == items
+    assert spool.size_bytes() == os.path.getsize(path)
+
+
+def test_read_segment_skips_corrupt_and_torn_lines(tmp_path):
+    spool = Spool(str(tmp_path))
+    path = sealed_segment(spool, [item(0)])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("not json\n")
+        f.write('["lake_raw_data_int", "lake/raw/int"]\n')
+        f.write(Spool._encode(item(1)))
+        f.write(Spool._encode(item(2))[:-10])
+    assert spool.read_segment(path) == [item(0), item(1)]
+
+
+def test_rewrite_segment_keeps_unreplayed_tail(tmp_path):
+    spool = Spool(str(tmp_path))
+    items = [item(i) for i in range(10)]
+    path = sealed_segment(spool, items)
+    spool.rewrite_segment(path, items[7:])
+    assert spool.read_segment(path) == items[7:]
+    assert spool.size_bytes() == os.path.getsize(path)
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_segments_are_picked_up_on_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    path = sealed_segment(spool, [item(0)])
+    spool.close()
+    reopened = Spool(str(tmp_path))
+    assert reopened.oldest_segment() == path
+    assert reopened.read_segment(path) == [item(0)]
+
+
+def test_full_spool_rejects_writes(tmp_path):
+    one = len(Spool._encode(item(0)).encode("utf-8"))
+    spool = Spool(str(tmp_path), max_bytes=one * 2)
+    assert spool.append([item(0), item(1)]) == 2
+    assert spool.append([item(2)]) == 0
+    path = spool.oldest_segment()
+    assert spool.read_segment(path) == [item(0), item(1)]
+    # Accepts writes again once replay frees space
+    spool.remove_segment(path)
+    assert spool.append([item(2)]) == 1
+
+
+def test_drainer_quarantines_segment_after_max_attempts(tmp_path, monkeypatch):
+    def unreachable(**kwargs):
+        raise psycopg2.OperationalError("connection refused")
+
+    # Keeps the drainer thread idle; _record_failure is driven directly
+    monkeypatch.setattr(spool_module.psycopg2, "connect", unreachable)
+    spool = Spool(str(tmp_path))
+    path = sealed_segment(spool, [item(0)])
+    later = os.path.join(str(tmp_path), "segment-999999999999.jsonl")
+    open(later, "w").close()
+
+    drainer = SpoolDrainer(spool, {}, idle_interval=3600, max_attempts=3)
+    try:
+        drainer._record_failure(path)
+        drainer._record_failure(path)
+        # A failure of another segment restarts the count
+        drainer._record_failure(later)
+        drainer._record_failure(path)
+        drainer._record_failure(path)
+        assert os.path.exists(path)
+        drainer._record_failure(path)
+    finally:
+        drainer.close()
+
+    quarantined = [name for name in os.listdir(tmp_path) if name.startswith("quarantine-")]
+    assert not os.path.exists(path)
+    assert len(quarantined) == 1 and quarantined[0].endswith(os.path.basename(path))
+    assert spool.oldest_segment() is None
+    assert spool.size_bytes() == 0
+
+
+def test_quarantine_keeps_earlier_files_and_counts_against_the_limit(tmp_path):
+    one = len(Spool._encode(item(0)).encode("utf-8"))
+    spool = Spool(str(tmp_path), max_bytes=one * 3)
+    first = spool.quarantine_segment(sealed_segment(spool, [item(0)]))
+    # Restarted with no segments left, the spool numbers its segments from zero again
+    spool.close()
+    spool = Spool(str(tmp_path), max_bytes=one * 3)
+    second = spool.quarantine_segment(sealed_segment(spool, [item(1)]))
+    assert os.path.basename(first).endswith("segment-000000000000.jsonl")
+    assert os.path.basename(second).endswith("segment-000000000000.jsonl")
+    assert first != second
+    assert spool.read_segment(first) == [item(0)]
+    assert spool.read_segment(second) == [item(1)]
+
+    assert spool.size_bytes() == 0 and spool.quarantine_bytes() == 2 * one
+    assert spool.append([item(2), item(3)]) == 0
+    assert spool.append([item(2)]) == 1
+    assert Spool(str(tmp_path), max_bytes=one * 3).quarantine_bytes() == 2 * one
@@ -0,0 +1,49 @@
+import pytest
+
+from utils.sql_explorer import normalize_explorer_query
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT 1", "SELECT 1"),
+    ("  SELECT 1 ;  ", "SELECT 1"),
+    ("SELECT 1;;", "SELECT 1"),
+    ("SELECT 1; -- fin", "SELECT 1"),
+    ("SELECT 1; /* fin */", "SELECT 1"),
+    ("SELECT ';' AS x", "SELECT ';' AS x"),
+    ("SELECT 'it''s; fine'", "SELECT 'it''s; fine'"),
+    ('SELECT 1 AS "a;b"', 'SELECT 1 AS "a;b"'),
+    ("SELECT E'\\'; still a literal'", "SELECT E'\\'; still a literal'"),
+    ("SELECT $$a; b$$", "SELECT $$a; b$$"),
+    ("SELECT $tag$a; $$ b$tag$", "SELECT $tag$a; $$ b$tag$"),
+    ("SELECT 1 -- a; b\n", "SELECT 1 -- a; b"),
+    ("SELECT /* a /* nested; */ b; */ 1", "SELECT /* a /* nested; */ b; */ 1"),
+])
+def test_accepts_single_statement(query, expected):
+    assert normalize_explorer_query(query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT 1; SELECT 2",
+    "SELECT 1; COMMIT; DROP TABLE dim_stations",
+    "SELECT 'x'; DELETE FROM t",
+    # Without the E prefix a backslash does not escape the quote
+    "SELECT '\\'; DELETE FROM t; SELECT '",
+    "SELECT $$x$$; DELETE FROM t",
+    "SELECT 1 /* c */; SELECT 2",
+    "SELECT 1;\n-- c\nSELECT 2",
+])
+def test_rejects_several_statements(query):
+    with pytest.raises(ValueError, match="una sentencia"):
+        normalize_explorer_query(query)
+
+
+@pytest.mark.parametrize("query", ["", "   ", ";", " ; ; ", "-- sólo un comentario"])
+def test_rejects_empty_query(query):
+    with pytest.raises(ValueError, match="vacía"):
+        normalize_explorer_query(query)
+
+
+def test_dollar_inside_identifier_is_not_a_tag():
+    # 'a$b$' is an identifier, not the start of a dollar-quoted block
+    with pytest.raises(ValueError):
+        normalize_explorer_query("SELECT a$b$; DELETE FROM t")